@@ -1,6 +1,13 @@
 from flask import Flask, request, jsonify, render_template
-import pymysql, os, requests, json, sys
+import os, requests, json, sys, math
 from langchain_agent import OutfitAIAgent
+from llm_providers import offline_providers_configured
+from rate_limiter import RateLimited, rate_limited_response
+from db_pool import get_db_conn, pool_stats, DB_HOST
+from prefetch import attach_outfit_items
+from catalog_index import find_items
+from keyword_matcher import KeywordExtractor
+from outfit_fields import get_outfit_fields, get_outfit_projector, project_outfits, outfit_field_stats
 import uuid
 from datetime import datetime
 from decimal import Decimal
@@ -30,17 +37,11 @@ def json_serial(obj):
 # =======================
 # 環境設定
 # =======================
-DB_HOST = os.getenv('DB_HOST', 'mysql')
-DB_PORT = int(os.getenv('DB_PORT', '3306'))
-DB_USER = os.getenv('DB_USER', 'root')
-DB_PASS = os.getenv('DB_PASS', 'rootpassword')
-DB_NAME = os.getenv('DB_NAME', 'outfit_db')
-
 # 只用 Gemini
 LLM_API_KEY = os.getenv('LLM_API_KEY')
 
-# 只要有 Gemini key 就啟用 AI
-USE_GEMINI = bool(LLM_API_KEY)
+# 只要有 Gemini key (或 LLM_PROVIDERS 設定離線模型) 就啟用 AI
+USE_GEMINI = bool(LLM_API_KEY) or offline_providers_configured()  # LLM_PROVIDERS=fake / replay 不需要 key
 
 # 初始化 LangChain Agent（只給 Gemini）
 agent = None
@@ -55,234 +56,6 @@ if USE_GEMINI:
 GEMINI_MODEL = "gemini-2.0-flash-lite"
 GEMINI_URL = f"https://generativelanguage.googleapis.com/v1beta/models/{GEMINI_MODEL}:generateContent?key={LLM_API_KEY}"
 
-# =======================
-# 🔧 彈性資料庫欄位偵測系統
-# =======================
-FIELD_CANDIDATES = {
-    'primary_key': ['id', 'outfit_id', 'ID', 'pk', 'outfit_pk'],
-    'title': ['name', 'title', '標題', '名稱', 'outfit_name', 'item_name'],
-    'occasion': ['occasion', 'type', '場合', '類型', 'category', 'style'],
-    'image': ['image_url', 'image_path', 'img', 'picture', '圖片', 'photo'],
-    'description': ['description', 'desc', '描述', 'details', 'notes', 'remark']
-}
-
-def detect_outfit_fields(conn):
-    """自動偵測 outfits 表格的欄位結構 (含二次保險機制)"""
-    try:
-        with conn.cursor() as cur:
-            cur.execute("DESCRIBE outfits")
-            result = cur.fetchall()
-            # 處理可能是字典或元組的結果
-            if result and isinstance(result[0], dict):
-                columns = [row['Field'] for row in result]
-            else:
-                columns = [row[0] for row in result]
-            
-            detected = {}
-            missing_fields = []
-            
-            for field_type, candidates in FIELD_CANDIDATES.items():
-                matched = next((col for col in columns if col in candidates), None)
-                detected[field_type] = matched
-                if not matched:
-                    missing_fields.append(field_type)
-            
-            # 印出偵測結果（方便除錯）
-            print("\n" + "="*50, flush=True)
-            print("📊 資料庫欄位偵測結果:", flush=True)
-            print("="*50, flush=True)
-            for field_type, field_name in detected.items():
-                status = "✅" if field_name else "❌"
-                print(f"{status} {field_type:15s}: {field_name or '未找到'}", flush=True)
-            
-            # 🛡️ 二次保險: 如果有未偵測到的欄位,嘗試模糊匹配
-            if missing_fields:
-                print("\n🔍 啟動二次保險機制 (模糊匹配)...", flush=True)
-                fuzzy_matched = fuzzy_match_fields(columns, missing_fields)
-                
-                for field_type, fuzzy_col in fuzzy_matched.items():
-                    if fuzzy_col:
-                        detected[field_type] = fuzzy_col
-                        print(f"✅ 模糊匹配成功: {field_type:15s} -> {fuzzy_col}", flush=True)
-            
-            print("="*50 + "\n", flush=True)
-            
-            return detected
-    except Exception as e:
-        print(f"⚠️ 欄位偵測失敗: {e}", flush=True)
-        # 返回預設值
-        return {
-            'primary_key': 'id',
-            'title': 'name',
-            'occasion': 'occasion',
-            'image': 'image_url',
-            'description': 'description'
-        }
-
-def fuzzy_match_fields(columns, missing_fields):
-    """
-    二次保險: 模糊匹配欄位
-    使用關鍵字匹配,例如包含 'title' 或 'name' 的欄位都可能是標題
-    """
-    fuzzy_rules = {
-        'title': ['title', 'name', '標題', '名', '名稱'],
-        'occasion': ['occasion', 'type', 'event', '場合', '類型', '事件'],
-        'image': ['image', 'img', 'pic', 'photo', '圖', '照片'],
-        'description': ['desc', 'detail', 'note', 'info', 'memo', '描述', '說明', '備註']
-    }
-    
-    matched = {}
-    for field_type in missing_fields:
-        if field_type not in fuzzy_rules:
-            continue
-            
-        keywords = fuzzy_rules[field_type]
-        for col in columns:
-            col_lower = col.lower()
-            # 檢查欄位名是否包含任一關鍵字
-            if any(keyword.lower() in col_lower or keyword in col for keyword in keywords):
-                matched[field_type] = col
-                break
-    
-    return matched
-
-def standardize_outfit(outfit, fields):
-    """
-    將資料庫查詢結果標準化為統一格式
-    包含三重保險機制 + 資料品質追蹤
-    """
-    # 追蹤資料來源品質
-    data_quality = {
-        'source': 'unknown',  # 'exact', 'fuzzy', 'default'
-        'missing_fields': [],
-        'warnings': []
-    }
-    
-    # 🛡️ 保險1: 使用偵測到的欄位 (精確匹配)
-    result = {
-        '_id': outfit.get(fields['primary_key']) if fields['primary_key'] else None,
-        '_title': outfit.get(fields['title']) if fields['title'] else None,
-        '_occasion': outfit.get(fields['occasion']) if fields['occasion'] else None,
-        '_image': outfit.get(fields['image']) if fields['image'] else '',
-        '_description': outfit.get(fields['description']) if fields['description'] else None,
-    }
-    
-    # 記錄精確匹配的欄位
-    if fields['primary_key'] and result['_id']:
-        data_quality['source'] = 'exact'
-    
-    # 🛡️ 保險2: 如果標準化欄位為空,從原始資料中智能搜尋 (模糊匹配)
-    if not result['_id']:
-        for key in ['id', 'outfit_id', 'ID', 'uid', 'pk']:
-            if key in outfit and outfit[key]:
-                result['_id'] = outfit[key]
-                data_quality['source'] = 'fuzzy'
-                data_quality['warnings'].append(f"ID 使用模糊匹配: {key}")
-                break
-    
-    if not result['_title']:
-        for key in ['name', 'title', 'outfit_name', '標題', '名稱', 'outfit_title', 'label', 'outfit名稱']:
-            if key in outfit and outfit[key]:
-                result['_title'] = outfit[key]
-                if data_quality['source'] == 'exact':
-                    data_quality['source'] = 'mixed'
-                elif data_quality['source'] == 'unknown':
-                    data_quality['source'] = 'fuzzy'
-                data_quality['warnings'].append(f"標題使用模糊匹配: {key}")
-                break
-    
-    if not result['_occasion']:
-        for key in ['occasion', 'type', 'category', 'style', '場合', '類型', 'event_type', 'scene', 'suitable_for']:
-            if key in outfit and outfit[key]:
-                result['_occasion'] = outfit[key]
-                if data_quality['source'] == 'exact':
-                    data_quality['source'] = 'mixed'
-                elif data_quality['source'] == 'unknown':
-                    data_quality['source'] = 'fuzzy'
-                data_quality['warnings'].append(f"場合使用模糊匹配: {key}")
-                break
-    
-    if not result['_description']:
-        for key in ['description', 'desc', 'details', 'notes', '描述', '說明', 'memo', 'comment', '簡介']:
-            if key in outfit and outfit[key]:
-                result['_description'] = outfit[key]
-                if data_quality['source'] == 'exact':
-                    data_quality['source'] = 'mixed'
-                elif data_quality['source'] == 'unknown':
-                    data_quality['source'] = 'fuzzy'
-                data_quality['warnings'].append(f"描述使用模糊匹配: {key}")
-                break
-    
-    # 🛡️ 保險3: 提供友善的預設值 (但標記為低品質)
-    if not result['_id']:
-        result['_id'] = -1  # 使用 -1 表示無效ID
-        data_quality['missing_fields'].append('id')
-        data_quality['source'] = 'default'
-        
-    if not result['_title']:
-        result['_title'] = '⚠️ 未命名穿搭'
-        data_quality['missing_fields'].append('title')
-        if data_quality['source'] != 'default':
-            data_quality['source'] = 'mixed'
-    
-    if not result['_occasion']:
-        result['_occasion'] = '⚠️ 未分類'
-        data_quality['missing_fields'].append('occasion')
-        if data_quality['source'] != 'default':
-            data_quality['source'] = 'mixed'
-    
-    if not result['_description']:
-        result['_description'] = '⚠️ 無說明'
-        data_quality['missing_fields'].append('description')
-        if data_quality['source'] != 'default':
-            data_quality['source'] = 'mixed'
-    
-    # 保留原始資料 & 資料品質資訊
-    result['_raw'] = outfit
-    result['_data_quality'] = data_quality
-    result.update(outfit)
-    
-    # 如果資料品質有問題,輸出警告日誌
-    if data_quality['source'] in ['fuzzy', 'mixed', 'default']:
-        print(f"⚠️ 資料品質警告 (ID: {result['_id']}): 來源={data_quality['source']}", flush=True)
-        if data_quality['warnings']:
-            for warning in data_quality['warnings']:
-                print(f"   - {warning}", flush=True)
-        if data_quality['missing_fields']:
-            print(f"   - 缺少欄位: {', '.join(data_quality['missing_fields'])}", flush=True)
-    
-    return result
-
-# 全域變數：啟動時偵測一次，避免重複偵測
-_outfit_fields_cache = None
-
-def get_outfit_fields():
-    """取得或快取欄位偵測結果"""
-    global _outfit_fields_cache
-    if _outfit_fields_cache is None:
-        conn = get_db_conn()
-        try:
-            _outfit_fields_cache = detect_outfit_fields(conn)
-        finally:
-            conn.close()
-    return _outfit_fields_cache
-
-# =======================
-# 資料庫連線
-# =======================
-def get_db_conn():
-    print("DB 連線資訊：", DB_HOST, DB_PORT, DB_USER, DB_PASS, DB_NAME, flush=True)
-    return pymysql.connect(
-        host=DB_HOST,
-        port=DB_PORT,
-        user=DB_USER,
-        password=DB_PASS,
-        db=DB_NAME,
-        charset='utf8mb4',
-        cursorclass=pymysql.cursors.DictCursor,
-        use_unicode=True
-    )
-
 # =======================
 # 🔑 RAG 關鍵字映射
 # =======================
@@ -295,15 +68,13 @@ KEYWORD_MAPPING = {
     '旅遊': ['旅遊', '旅行', '出遊', 'travel'],
 }
 
+# 編譯成 Aho-Corasick 自動機；設定 KEYWORD_MAPPING_FILE 可用 JSON 檔擴充/覆蓋映射 (熱更新)
+_keyword_extractor = KeywordExtractor(KEYWORD_MAPPING, path=os.getenv('KEYWORD_MAPPING_FILE'),
+                                      ignore_case=False)
+
 def extract_keywords(text: str):
-    """從使用者輸入中提取關鍵字"""
-    found_keywords = []
-    for key, synonyms in KEYWORD_MAPPING.items():
-        for synonym in synonyms:
-            if synonym in text:
-                found_keywords.append(key)
-                break
-    return list(set(found_keywords))  # 去重
+    """從使用者輸入中提取關鍵字 (一次掃描，已去重)"""
+    return _keyword_extractor.extract(text)
 
 # =======================
 # 🤖 共用：AI 穿搭推薦邏輯（Jinja / JSON 共用）
@@ -346,18 +117,13 @@ def generate_recommendation(user_input: str,
                 cur.execute("SELECT * FROM outfits LIMIT 5")
                 outfits = cur.fetchall()
 
-            # 標準化所有穿搭資料
-            outfits = [standardize_outfit(o, fields) for o in outfits]
+            # 標準化所有穿搭資料 (編譯好的欄位投影，依查詢結果欄位自動更新)
+            outfits = project_outfits(cur, list(outfits))
 
-            # 幫每個 outfit 抓對應 items
-            for o in outfits:
-                cur.execute("""
-                    SELECT i.* FROM items i
-                    JOIN outfit_items oi ON i.id = oi.item_id
-                    WHERE oi.outfit_id=%s
-                """, (o['_id'],))
-                o['items'] = cur.fetchall()
+            # 幫所有 outfit 一次抓回對應 items (單一查詢，避免 N+1)
+            attach_outfit_items(cur, outfits)
 
+            for o in outfits:
                 # 轉換 datetime 和 Decimal 為可序列化類型
                 if 'created_at' in o:
                     o['created_at'] = o['created_at'].isoformat() if o['created_at'] else None
@@ -387,10 +153,14 @@ def generate_recommendation(user_input: str,
             session_id=session_id,
             user_input=user_input + rag_context,
             db_outfits=outfits,
-            preferred_model=preferred_model
+            preferred_model=preferred_model,
+            query=user_input
         )
         return ai_response, outfits, keywords
 
+    except RateLimited:
+        # 超過速率限制交給路由回應 429 + Retry-After
+        raise
     except Exception as e:
         # 詳細的錯誤處理
         error_msg = str(e)
@@ -475,11 +245,14 @@ def recommend_page():
         selected_model = request.form.get('model', 'auto')
         session_id = "web-page-session"  # 固定給這個頁面用的 session
 
-        ai_response, outfits, keywords = generate_recommendation(
-            user_input=user_input,
-            session_id=session_id,
-            preferred_model=selected_model
-        )
+        try:
+            ai_response, outfits, keywords = generate_recommendation(
+                user_input=user_input,
+                session_id=session_id,
+                preferred_model=selected_model
+            )
+        except RateLimited as e:
+            ai_response = f"⏳ 請求太頻繁，請 {math.ceil(e.retry_after)} 秒後再試"
 
     return render_template(
         'aichat.html',  # Jinja 版的穿搭機器人頁面
@@ -500,16 +273,8 @@ def get_items():
     conn = get_db_conn()
     try:
         with conn.cursor() as cur:
-            sql = "SELECT * FROM items WHERE 1=1"
-            params = []
-            if color:
-                sql += " AND color LIKE %s"
-                params.append(f"%{color}%")
-            if category:
-                sql += " AND category=%s"
-                params.append(category)
-            cur.execute(sql, params)
-            items = cur.fetchall()
+            # color 包含比對 / category 精確比對改由記憶體索引處理
+            items = find_items(cur, color=color, category=category)
             
             # 轉換 datetime 和 Decimal 為可序列化類型
             for item in items:
@@ -539,11 +304,14 @@ def recommend():
     if not user_input:
         return jsonify({"error": "請輸入訊息"}), 400
 
-    ai_response, outfits, keywords = generate_recommendation(
-        user_input=user_input,
-        session_id=session_id,
-        preferred_model=preferred_model
-    )
+    try:
+        ai_response, outfits, keywords = generate_recommendation(
+            user_input=user_input,
+            session_id=session_id,
+            preferred_model=preferred_model
+        )
+    except RateLimited as e:
+        return rate_limited_response(e)
 
     return jsonify({
         "response": ai_response,
@@ -581,7 +349,10 @@ def ping():
         "status": "ok",
         "db_host": DB_HOST,
         "gemini_model": GEMINI_MODEL,
-        "ai_enabled": USE_GEMINI
+        "ai_enabled": USE_GEMINI,
+        "db_pool": pool_stats(),
+        "llm_cache": agent.response_cache.stats() if agent else None,
+        "rate_limit": agent.rate_limit_stats() if agent else None
     })
 
 # =======================
@@ -619,13 +390,13 @@ def check_data_quality():
             cur.execute("SELECT * FROM outfits LIMIT 5")
             outfits = cur.fetchall()
             
+            outfits = project_outfits(cur, list(outfits))
+            projector = get_outfit_projector()
             for outfit in outfits:
-                standardized = standardize_outfit(outfit, fields)
-                quality_info = standardized['_data_quality']
-                
+                quality_info = projector.explain(outfit)
                 quality_report["sample_data_quality"].append({
-                    "id": standardized['_id'],
-                    "title": standardized['_title'],
+                    "id": outfit['_id'],
+                    "title": outfit['_title'],
                     "quality_source": quality_info['source'],
                     "warnings": quality_info['warnings'],
                     "missing_fields": quality_info['missing_fields']
@@ -649,6 +420,9 @@ def check_data_quality():
             quality_report["overall_health"] = "unknown"
             quality_report["recommendation"] = "❓ 無法評估資料品質"
         
+        # 所有請求累計的欄位命中統計 (精確 / 模糊 / 預設值)
+        quality_report["aggregate"] = outfit_field_stats()
+
         return jsonify(quality_report)
         
     except Exception as e:
@@ -9,7 +9,10 @@ def create_app():
     # 設定環境變數
     app.config['JSON_AS_ASCII'] = False
     app.config['JSON_SORT_KEYS'] = False
-    app.json.ensure_ascii = False
+
+    # JSON 編碼改用 orjson (中文不跳脫、Decimal / datetime 直接編碼)
+    from json_provider import init_json
+    init_json(app)
 
     # 從環境變數加載設定 (如果需要)
     # app.config.from_envvar('YOUR_APP_SETTINGS', silent=True)
@@ -33,6 +36,14 @@ def create_app():
     from blueprints.wardrobe import wardrobe_bp
     app.register_blueprint(wardrobe_bp, url_prefix='/wardrobe')
 
+    # 效能指標：每個請求的延遲 + Prometheus 格式的 /metrics
+    from metrics import init_metrics
+    init_metrics(app)
+
+    # 預先載入商品索引 (失敗時第一次查詢會再載入)
+    from catalog_index import warm_up_catalog_index
+    warm_up_catalog_index()
+
 
     @app.route('/')
     def index():
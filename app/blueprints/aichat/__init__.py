@@ -1,5 +1,14 @@
+import os
+
 from flask import Blueprint
 
 aichat_bp = Blueprint('aichat', __name__, template_folder='templates')
 
-from . import routes
+# 使用哪一版服務：v1 (outfits 表，routes.py / services.py) 或 v4 (items 表，routes_v4.py / services_v4.py)
+# 場合推薦池、語意檢索 (RETRIEVAL_MODE)、整套穿搭 /aichat/outfits 只在 v4 提供
+AICHAT_SERVICES = os.getenv('AICHAT_SERVICES', 'v1')
+
+if AICHAT_SERVICES == 'v4':
+    from . import routes_v4
+else:
+    from . import routes
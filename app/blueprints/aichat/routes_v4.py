@@ -1,11 +1,24 @@
-from flask import request, jsonify, render_template
+from flask import request, jsonify, render_template, Response, stream_with_context
 from . import aichat_bp
 from .services_v4 import (
     generate_recommendation, 
+    generate_recommendation_stream,
+    compose_outfits, 
     agent, 
-    get_db_conn
+    get_db_conn,
+    retrieval_cache_stats,
+    occasion_pool_stats,
+    semantic_index_stats
 )
-from decimal import Decimal
+from db_pool import pool_stats
+from rate_limiter import RateLimited, rate_limited_response
+from catalog_index import find_items, ItemStream, catalog_color_stats
+from json_provider import dumps_bytes
+from response_fields import project, parse_fields, ITEM_FIELDS
+from pagination import (InvalidPage, NDJSON_MIMETYPE, decode_cursor, page_size, wants_ndjson,
+                        page_response, ndjson_lines)
+import math
+import sys
 
 # =======================
 # 👕 Jinja 版 AI 穿搭頁面（aichat.html）
@@ -28,11 +41,14 @@ def chat():
         selected_model = request.form.get('model', 'auto')
         session_id = "web-page-session"  # 固定給這個頁面用的 session
 
-        ai_response, outfits, keywords = generate_recommendation(
-            user_input=user_input,
-            session_id=session_id,
-            preferred_model=selected_model
-        )
+        try:
+            ai_response, outfits, keywords = generate_recommendation(
+                user_input=user_input,
+                session_id=session_id,
+                preferred_model=selected_model
+            )
+        except RateLimited as e:
+            ai_response = f"⏳ 請求太頻繁，請 {math.ceil(e.retry_after)} 秒後再試"
 
     return render_template(
         'aichat.html',
@@ -48,30 +64,40 @@ def chat():
 # =======================
 @aichat_bp.route('/items', methods=['GET'])
 def get_items():
+    """
+    ?color=&category=&fields=&limit=&cursor=（預設精簡欄位，fields=* 取完整資料列）
+    - 預設 keyset 分頁：{"items": [...], "next": 游標}，下一頁帶 ?cursor=<next>，next 為 null 表示沒有下一頁
+    - ?format=ndjson：從 cursor 之後串流全部符合的商品，每行一筆 (不分頁)
+    """
     color = request.args.get('color')
     category = request.args.get('category')
+    projection = parse_fields(request.args.get('fields'), ITEM_FIELDS)
+    try:
+        after_id = decode_cursor(request.args.get('cursor'))
+        limit = page_size(request.args.get('limit'))
+    except InvalidPage as e:
+        return jsonify({"error": str(e)}), 400
+
+    if wants_ndjson(request):
+        def lines():
+            # 連線在開始輸出時才借出，串流結束 (或客戶端中斷) 時歸還
+            stream = ItemStream(get_db_conn(), color=color, category=category, after_id=after_id)
+            try:
+                yield from ndjson_lines(stream, projection)
+            finally:
+                stream.close()
+
+        return Response(lines(), mimetype=NDJSON_MIMETYPE, headers={'X-Accel-Buffering': 'no'})
+
     conn = get_db_conn()
     try:
         with conn.cursor() as cur:
-            sql = "SELECT * FROM items WHERE 1=1"
-            params = []
-            if color:
-                sql += " AND color LIKE %s"
-                params.append(f"%{color}%")
-            if category:
-                sql += " AND category=%s"
-                params.append(category)
-            cur.execute(sql, params)
-            items = cur.fetchall()
-            
-            for item in items:
-                if 'created_at' in item:
-                    item['created_at'] = item['created_at'].isoformat() if item['created_at'] else None
-                if 'price' in item and isinstance(item['price'], Decimal):
-                    item['price'] = float(item['price'])
+            # color 包含比對 / category 精確比對改由記憶體索引處理
+            items = find_items(cur, color=color, category=category, after_id=after_id, limit=limit)
     finally:
         conn.close()
-    return jsonify(items)
+    # Decimal / datetime 由 JSON provider (orjson) 編碼
+    return jsonify(page_response(items, limit, projection))
 
 # =======================
 # 🤖 JSON 版 AI 穿搭推薦 API（保留給前端 fetch 用）
@@ -80,30 +106,110 @@ def get_items():
 def recommend():
     """
     純後端 API 版本：
-    - 接收 JSON：{"message": "...", "session_id": "...", "model": "..."}
-    - 回傳 JSON，給前端 fetch / axios 使用
+    - 接收 JSON：{"message": "...", "session_id": "...", "model": "...", "fields": "..."}
+    - 回傳 JSON，給前端 fetch / axios 使用；db_data 依 fields 投影（預設精簡欄位）
     """
     data = request.json or {}
     user_input = data.get('message', '')
     session_id = data.get('session_id', 'default')
     preferred_model = data.get('model', 'auto')
+    gender = data.get('gender') or None
+    fields = data.get('fields') or request.args.get('fields')
 
     if not user_input:
         return jsonify({"error": "請輸入訊息"}), 400
 
-    ai_response, outfits, keywords = generate_recommendation(
-        user_input=user_input,
-        session_id=session_id,
-        preferred_model=preferred_model
-    )
+    try:
+        ai_response, outfits, keywords = generate_recommendation(
+            user_input=user_input,
+            session_id=session_id,
+            preferred_model=preferred_model,
+            gender=gender
+        )
+    except RateLimited as e:
+        return rate_limited_response(e)
 
     return jsonify({
         "response": ai_response,
         "session_id": session_id,
-        "db_data": outfits,
+        "db_data": project(outfits, fields, ITEM_FIELDS),
         "keywords": keywords
     })
 
+# =======================
+# 🌊 串流版 AI 穿搭推薦 API（Server-Sent Events，與 v1 相同的事件格式）
+# =======================
+def _sse(event, data):
+    """組一則 SSE 訊息"""
+    return f"event: {event}\ndata: {dumps_bytes(data).decode('utf-8')}\n\n"
+
+@aichat_bp.route('/recommend/stream', methods=['GET', 'POST'])
+def recommend_stream():
+    """
+    串流版本：
+    - POST JSON {"message": "...", "session_id": "...", "model": "...", "gender": "...", "fields": "..."}，或 GET ?message=...（給 EventSource 用）
+    - 先送出 items 事件（檢索結果，db_data 依 fields 投影），再逐段送出 token 事件，最後 done 事件
+    - 對話記錄在串流結束時寫入
+    """
+    data = request.get_json(silent=True) or request.args
+    user_input = data.get('message', '')
+    session_id = data.get('session_id', 'default')
+    preferred_model = data.get('model', 'auto')
+    gender = data.get('gender') or None
+    fields = data.get('fields')
+
+    if not user_input:
+        return jsonify({"error": "請輸入訊息"}), 400
+
+    def events():
+        try:
+            for event, payload in generate_recommendation_stream(
+                user_input=user_input,
+                session_id=session_id,
+                preferred_model=preferred_model,
+                gender=gender
+            ):
+                if event == "items":
+                    payload = dict(payload, db_data=project(payload["db_data"], fields, ITEM_FIELDS))
+                yield _sse(event, payload)
+        except Exception as e:
+            print(f"❌ 串流推薦失敗: {e}", flush=True, file=sys.stderr)
+            yield _sse("error", {"error": "推薦失敗，請稍後再試"})
+
+    return Response(
+        stream_with_context(events()),
+        mimetype='text/event-stream',
+        headers={
+            'Cache-Control': 'no-cache',
+            'X-Accel-Buffering': 'no'  # 關閉 nginx 緩衝，讓每段文字立即送出
+        }
+    )
+
+# =======================
+# 👔 整套穿搭組合 API
+# =======================
+@aichat_bp.route('/outfits', methods=['GET', 'POST'])
+def outfits():
+    """
+    組出完整穿搭 (上衣 + 下身 + 外套)：
+    - GET ?message=約會&gender=女&n=3&outer=1
+    - POST JSON：{"message": "...", "gender": "...", "n": 3, "outer": true}
+    """
+    data = (request.get_json(silent=True) or {}) if request.method == 'POST' else request.args
+    try:
+        n = max(1, min(int(data.get('n', 3)), 10))
+    except (TypeError, ValueError):
+        return jsonify({"error": "n 必須是整數"}), 400
+    with_outer = str(data.get('outer', '1')).lower() not in ('0', 'false', 'no')
+
+    result, keywords = compose_outfits(
+        user_input=data.get('message', ''),
+        gender=data.get('gender') or None,
+        n=n,
+        with_outer=with_outer
+    )
+    return jsonify({"outfits": result, "keywords": keywords})
+
 # =======================
 # 🗑️ 清除對話記憶
 # =======================
@@ -129,7 +235,18 @@ def clear_session():
 # =======================
 @aichat_bp.route('/ping')
 def ping():
+    semantic_index = semantic_index_stats()
     return jsonify({
-        "status": "ok",
-        "ai_enabled": bool(agent)
+        "status": "degraded" if semantic_index['degraded'] else "ok",
+        "ai_enabled": bool(agent),
+        "db_pool": pool_stats(),
+        "retrieval_cache": retrieval_cache_stats(),
+        "occasion_pools": occasion_pool_stats(),
+        "semantic_index": semantic_index,
+        "color_palette": catalog_color_stats(),
+        "llm_cache": agent.response_cache.stats() if agent else None,
+        "rate_limit": agent.rate_limit_stats() if agent else None,
+        "llm_providers": agent.provider_stats() if agent else None,
+        "session_store": agent.store.stats() if agent else None,
+        "sessions": agent.sessions.stats() if agent else None
     })
\ No newline at end of file
@@ -5,7 +5,6 @@ AI 穿搭推薦服務模組 (v2)
 
 import os
 import sys
-import pymysql
 from decimal import Decimal
 from datetime import datetime
 
@@ -18,16 +17,13 @@ if hasattr(sys.stderr, 'reconfigure'):
 # 導入 LangChain Agent（從 app 根目錄）
 sys.path.append(os.path.join(os.path.dirname(__file__), '..', '..'))
 from langchain_agent import OutfitAIAgent
+from db_pool import get_db_conn
+from keyword_matcher import KeywordExtractor
+from item_sampler import sample_items, MATCH_TYPE_OR_CATEGORY
 
 # =======================
 # 環境設定
 # =======================
-DB_HOST = os.getenv('DB_HOST', 'mysql')
-DB_PORT = int(os.getenv('DB_PORT', '3306'))
-DB_USER = os.getenv('DB_USER', 'root')
-DB_PASS = os.getenv('DB_PASS', 'rootpassword')
-DB_NAME = os.getenv('DB_NAME', 'outfit_db')
-
 # AI 模型設定
 LLM_API_KEY = os.getenv('LLM_API_KEY')
 USE_GEMINI = bool(LLM_API_KEY)
@@ -45,22 +41,6 @@ if USE_GEMINI:
     except Exception as e:
         print(f"⚠️ AI Agent 初始化失敗: {e}", flush=True, file=sys.stderr)
 
-# =======================
-# 資料庫連線
-# =======================
-def get_db_conn():
-    """建立資料庫連線"""
-    return pymysql.connect(
-        host=DB_HOST,
-        port=DB_PORT,
-        user=DB_USER,
-        password=DB_PASS,
-        db=DB_NAME,
-        charset='utf8mb4',
-        cursorclass=pymysql.cursors.DictCursor,
-        use_unicode=True
-    )
-
 # =======================
 # 關鍵字映射 (RAG)
 # =======================
@@ -77,16 +57,11 @@ KEYWORD_MAPPING = {
     '正式': ['正式', 'formal', '商務'],
 }
 
+_keyword_extractor = KeywordExtractor(KEYWORD_MAPPING)
+
 def extract_keywords(text: str):
-    """從使用者輸入中提取關鍵字，用於資料庫查詢"""
-    found_keywords = []
-    text_lower = text.lower()
-    for key, synonyms in KEYWORD_MAPPING.items():
-        for synonym in synonyms:
-            if synonym.lower() in text_lower:
-                found_keywords.append(key)
-                break
-    return list(set(found_keywords))
+    """從使用者輸入中提取關鍵字，用於資料庫查詢 (Aho-Corasick 一次掃描，不分大小寫)"""
+    return _keyword_extractor.extract(text)
 
 def serialize_item(item):
     """將資料庫查詢出的 item 序列化，處理 Decimal 和 datetime"""
@@ -122,22 +97,14 @@ def generate_recommendation(user_input: str,
     try:
         with conn.cursor() as cur:
             if keywords:
-                # 建立模糊查詢條件
-                # 例如: "T恤" 或 "褲" -> clothing_type LIKE '%T恤%' OR clothing_type LIKE '%褲%'
-                like_clauses = [f"(clothing_type LIKE %s OR category LIKE %s)" for _ in keywords]
-                sql_query = f"SELECT * FROM items WHERE {' OR '.join(like_clauses)} ORDER BY RAND() LIMIT 5"
-                # 參數需要是兩倍的關鍵字，分別給 clothing_type 和 category
-                query_params = []
-                for kw in keywords:
-                    query_params.extend([f'%{kw}%', f'%{kw}%'])
-                
-                cur.execute(sql_query, query_params)
-                items = cur.fetchall()
+                # 模糊比對條件
+                # 例如: "T恤" 或 "褲" -> clothing_type LIKE '%T恤%' OR category LIKE '%T恤%' ...
+                # 改從預先建好的 id 列表隨機抽樣，不必每次整表排序
+                items = sample_items(cur, 5, terms=keywords, match=MATCH_TYPE_OR_CATEGORY)
 
             # 如果關鍵字查詢沒有結果，隨機推薦幾件
             if not items:
-                cur.execute("SELECT * FROM items ORDER BY RAND() LIMIT 5")
-                items = cur.fetchall()
+                items = sample_items(cur, 5)
             
             # 序列化查詢結果
             items = [serialize_item(item) for item in items]
@@ -7,7 +7,6 @@ AI 穿搭推薦服務模組 (v3)
 
 import os
 import sys
-import pymysql
 from decimal import Decimal
 from datetime import datetime
 
@@ -25,12 +24,9 @@ if hasattr(sys.stderr, 'reconfigure'):
 
 sys.path.append(os.path.join(os.path.dirname(__file__), '..', '..'))
 from langchain_agent import OutfitAIAgent
-
-DB_HOST = os.getenv('DB_HOST', 'mysql')
-DB_PORT = int(os.getenv('DB_PORT', '3306'))
-DB_USER = os.getenv('DB_USER', 'root')
-DB_PASS = os.getenv('DB_PASS', 'rootpassword')
-DB_NAME = os.getenv('DB_NAME', 'outfit_db')
+from db_pool import get_db_conn
+from keyword_matcher import KeywordExtractor
+from item_sampler import sample_items, MATCH_TYPE_OR_NAME
 
 LLM_API_KEY = os.getenv('LLM_API_KEY')
 USE_GEMINI = bool(LLM_API_KEY)
@@ -53,7 +49,7 @@ if USE_GEMINI:
 # - 這是 v3 的核心，用於彌補 `items` 表沒有 `occasion` 或 `style` 欄位的問題。
 # - `OCCASION_STYLE_MAPPING` 將使用者可能輸入的「場合」或「風格」關鍵字，
 #   映射到一個或多個在 `items` 表中可以被查詢的 `clothing_type`。
-# - `extract_keywords` 函數則負責從使用者的問句中找出這些關鍵字。
+# - `extract_keywords` 函數則用編譯好的 Aho-Corasick 自動機，一次掃描找出問句中的這些關鍵字。
 # ==============================================================================
 OCCASION_STYLE_MAPPING = {
     '運動': ['運動褲', '運動鞋', '運動上衣', '運動外套', 'T恤'],
@@ -67,31 +63,23 @@ OCCASION_STYLE_MAPPING = {
     '工裝': ['工作褲', '靴子', '工作襯衫', '吊帶褲'],
 }
 
+# 場合/風格關鍵字編譯成 Aho-Corasick 自動機；
+# 設定 OCCASION_KEYWORD_FILE 可用 JSON 檔加入同義詞 (例如 {"約會": ["約會", "date"]})，檔案變動時自動重建
+_keyword_extractor = KeywordExtractor({key: [key] for key in OCCASION_STYLE_MAPPING},
+                                      path=os.getenv('OCCASION_KEYWORD_FILE'))
+
 def extract_keywords(text: str):
-    """從使用者輸入中提取「場合」或「風格」關鍵字"""
-    found_keywords = []
-    text_lower = text.lower()
-    for key in OCCASION_STYLE_MAPPING.keys():
-        if key.lower() in text_lower:
-            found_keywords.append(key)
-    return list(set(found_keywords))
+    """從使用者輸入中提取「場合」或「風格」關鍵字 (一次掃描，已去重)"""
+    return _keyword_extractor.extract(text)
 
 # ==============================================================================
 # 區塊 3: 資料庫連線與序列化
 # 說明:
-# - `get_db_conn` 負責建立與資料庫的連線。
+# - `get_db_conn` 從共用連線池 (db_pool) 借出連線，用完 close() 即歸還。
 # - `serialize_item` 是一個輔助函數，用於將從資料庫取出的資料（可能包含
 #   Decimal、datetime 等特殊格式）轉換為 Python 能直接處理的 float 和 string，
 #   以便後續傳遞給 AI 或前端。
 # ==============================================================================
-def get_db_conn():
-    """建立資料庫連線"""
-    return pymysql.connect(
-        host=DB_HOST, port=DB_PORT, user=DB_USER, password=DB_PASS,
-        db=DB_NAME, charset='utf8mb4', cursorclass=pymysql.cursors.DictCursor,
-        use_unicode=True
-    )
-
 def serialize_item(item):
     """將資料庫查詢出的 item 序列化"""
     if not item: return None
@@ -107,7 +95,7 @@ def serialize_item(item):
 # - 步驟 1 (檢索):
 #   - 呼叫 `extract_keywords` 找出使用者想問的「場合/風格」。
 #   - 如果找到關鍵字，就用 `OCCASION_STYLE_MAPPING` 把它們轉換成衣物類型列表。
-#   - 產生 SQL 查詢，從 `items` 表中找出符合這些衣物類型的單品。
+#   - 從抽樣索引 (item_sampler) 中，隨機取出符合這些衣物類型的單品。
 #   - 如果沒有找到關鍵字或查詢無結果，就隨機推薦幾件單品作為備案。
 # - 步驟 2 (增強):
 #   - 將查詢到的單品資訊（包含您指定的 color 和 clothing_type）整理成一段文字，
@@ -140,27 +128,14 @@ def generate_recommendation(user_input: str,
                     target_clothing_types.extend(OCCASION_STYLE_MAPPING.get(kw, []))
                 
                 if target_clothing_types:
-                    # 建立一個同時查詢 clothing_type 和 name 的 SQL 語句
-                    # 例如: (clothing_type = %s OR name LIKE %s)
-                    where_clauses = []
-                    query_params = []
-                    for t_type in set(target_clothing_types): # 使用 set 避免重複
-                        where_clauses.append("(clothing_type = %s OR name LIKE %s)")
-                        query_params.extend([t_type, f'%{t_type}%'])
-
-                    sql_query = f"""
-                        SELECT * FROM items 
-                        WHERE {' OR '.join(where_clauses)}
-                        ORDER BY RAND() 
-                        LIMIT 5
-                    """
-                    cur.execute(sql_query, tuple(query_params))
-                    items = cur.fetchall()
+                    # 同時比對 clothing_type 和 name，等同
+                    # (clothing_type = %s OR name LIKE %s)，但改從預先建好的 id 列表隨機抽樣
+                    items = sample_items(cur, 5, terms=set(target_clothing_types),
+                                         match=MATCH_TYPE_OR_NAME)
 
             # 如果關鍵字查詢沒有結果，隨機推薦幾件
             if not items:
-                cur.execute("SELECT * FROM items ORDER BY RAND() LIMIT 5")
-                items = cur.fetchall()
+                items = sample_items(cur, 5)
             
             items = [serialize_item(item) for item in items]
 
@@ -4,11 +4,12 @@ AI 穿搭推薦服務模組 (v4)
 - 針對新的 `items` 資料庫結構進行查詢
 - 透過關鍵字映射，將抽象的「場合/風格」對應到具體的「衣物類型」
 - **優化: 同時查詢 `clothing_type` 和 `name` 欄位，提高準確率**
+- 需設定 AICHAT_SERVICES=v4 才會載入 (預設 v1)；場合推薦池、語意檢索、整套穿搭組合只在這個版本提供
 """
 
 import os
 import sys
-import pymysql
+import random
 from decimal import Decimal
 from datetime import datetime
 
@@ -26,15 +27,20 @@ if hasattr(sys.stderr, 'reconfigure'):
 
 sys.path.append(os.path.join(os.path.dirname(__file__), '..', '..'))
 from langchain_agent import OutfitAIAgent
-
-DB_HOST = os.getenv('DB_HOST', 'mysql')
-DB_PORT = int(os.getenv('DB_PORT', '3306'))
-DB_USER = os.getenv('DB_USER', 'root')
-DB_PASS = os.getenv('DB_PASS', 'rootpassword')
-DB_NAME = os.getenv('DB_NAME', 'outfit_db')
+from rate_limiter import RateLimited
+from db_pool import get_db_conn
+from keyword_matcher import KeywordExtractor
+from item_sampler import sample_items, MATCH_TYPE_OR_NAME
+from catalog_index import current_catalog_version, fetch_items_by_ids
+from occasion_pools import OCCASION_STYLE_MAPPING, OccasionPoolStore
+from embedding_index import SemanticRetriever
+from outfit_composer import get_outfit_composer, SLOT_NAMES
+from retrieval_cache import RetrievalCache
+from metrics import span
+from llm_providers import offline_providers_configured
 
 LLM_API_KEY = os.getenv('LLM_API_KEY')
-USE_GEMINI = bool(LLM_API_KEY)
+USE_GEMINI = bool(LLM_API_KEY) or offline_providers_configured()  # LLM_PROVIDERS=fake / replay 不需要 key
 
 agent = None
 if USE_GEMINI:
@@ -54,45 +60,27 @@ if USE_GEMINI:
 # - 這是 v4 的核心，用於彌補 `items` 表沒有 `occasion` 或 `style` 欄位的問題。
 # - `OCCASION_STYLE_MAPPING` 將使用者可能輸入的「場合」或「風格」關鍵字，
 #   映射到一個或多個在 `items` 表中可以被查詢的 `clothing_type` 或 `name`。
-# - `extract_keywords` 函數則負責從使用者的問句中找出這些關鍵字。
+#   (定義在 occasion_pools 模組，離線計算推薦池時也會用到)
+# - `extract_keywords` 函數則用編譯好的 Aho-Corasick 自動機，一次掃描找出問句中的這些關鍵字。
 # ==============================================================================
-OCCASION_STYLE_MAPPING = {
-    '運動': ['運動褲', '運動鞋', '運動上衣', '運動外套', 'T恤'],
-    '正式': ['襯衫', '西裝褲', '皮鞋', '西裝外套', '領帶', '正裝襯衫'],
-    '上班': ['襯衫', '西裝褲', '皮鞋', '西裝外套', '針織衫', '卡其褲'],
-    '約會': ['洋裝', '襯衫', '裙子', '休閒鞋', '針織衫'],
-    '休閒': ['T恤', '牛仔褲', '休閒褲', '運動鞋', '連帽衫'],
-    '街頭': ['連帽衫', '牛仔褲', '運動鞋', '棒球帽', 'T恤'],
-    '文青': ['襯衫', '帆布鞋', '卡其褲', '針織衫', '漁夫帽'],
-    '韓風': ['寬褲', '老爹鞋', '大學T', '西裝外套', '襯衫'],
-    '工裝': ['工作褲', '靴子', '工作襯衫', '吊帶褲'],
-}
+
+# 場合/風格關鍵字編譯成 Aho-Corasick 自動機；
+# 設定 OCCASION_KEYWORD_FILE 可用 JSON 檔加入同義詞 (例如 {"約會": ["約會", "date"]})，檔案變動時自動重建
+_keyword_extractor = KeywordExtractor({key: [key] for key in OCCASION_STYLE_MAPPING},
+                                      path=os.getenv('OCCASION_KEYWORD_FILE'))
 
 def extract_keywords(text: str):
-    """從使用者輸入中提取「場合」或「風格」關鍵字"""
-    found_keywords = []
-    text_lower = text.lower()
-    for key in OCCASION_STYLE_MAPPING.keys():
-        if key.lower() in text_lower:
-            found_keywords.append(key)
-    return list(set(found_keywords))
+    """從使用者輸入中提取「場合」或「風格」關鍵字 (一次掃描，已去重)"""
+    return _keyword_extractor.extract(text)
 
 # ==============================================================================
 # 區塊 3: 資料庫連線與序列化
 # 說明:
-# - `get_db_conn` 負責建立與資料庫的連線。
+# - `get_db_conn` 從共用連線池 (db_pool) 借出連線，用完 close() 即歸還。
 # - `serialize_item` 是一個輔助函數，用於將從資料庫取出的資料（可能包含
 #   Decimal、datetime 等特殊格式）轉換為 Python 能直接處理的 float 和 string，
 #   以便後續傳遞給 AI 或前端。
 # ==============================================================================
-def get_db_conn():
-    """建立資料庫連線"""
-    return pymysql.connect(
-        host=DB_HOST, port=DB_PORT, user=DB_USER, password=DB_PASS,
-        db=DB_NAME, charset='utf8mb4', cursorclass=pymysql.cursors.DictCursor,
-        use_unicode=True
-    )
-
 def serialize_item(item):
     """將資料庫查詢出的 item 序列化"""
     if not item: return None
@@ -101,6 +89,99 @@ def serialize_item(item):
         elif isinstance(value, datetime): item[key] = value.isoformat()
     return item
 
+# 熱門場合的候選商品池快取：同樣的關鍵字組合直接從池中抽 5 件，
+# 商品目錄版本改變 (重新匯入) 時自動失效
+RETRIEVAL_POOL_SIZE = int(os.getenv('RETRIEVAL_POOL_SIZE', '50'))
+_retrieval_cache = RetrievalCache(name='v4')
+
+# 離線預先計算的場合推薦池 (pipeline/06_build_occasion_pools.py)：
+# 有可用的池就只取前 RETRIEVAL_POOL_SIZE 件抽樣，池過期或缺少時才即時檢索
+_occasion_pools = OccasionPoolStore()
+
+def _load_candidate_pool(clothing_types, gender=None):
+    """檢索一批候選商品 (自行借連線，可在背景刷新時呼叫)"""
+    conn = get_db_conn()
+    try:
+        with conn.cursor() as cur:
+            items = sample_items(cur, RETRIEVAL_POOL_SIZE, terms=set(clothing_types),
+                                 match=MATCH_TYPE_OR_NAME, gender=gender)
+            return [serialize_item(item) for item in items]
+    finally:
+        conn.close()
+
+def _sample_from_occasion_pools(keywords, gender=None, k=5):
+    """從預先計算的池取前段再抽 k 件；池不可用時回傳 None"""
+    conn = get_db_conn()
+    try:
+        with conn.cursor() as cur:
+            ids = _occasion_pools.slice(cur, keywords, gender=gender, limit=RETRIEVAL_POOL_SIZE)
+            if ids is None:
+                return None
+            picks = random.sample(ids, min(k, len(ids)))
+            return [serialize_item(item) for item in fetch_items_by_ids(cur, picks)]
+    finally:
+        conn.close()
+
+# 語意檢索 (pipeline/07_build_embeddings.py 離線建立的向量索引)：
+# RETRIEVAL_MODE=hybrid 時沒有場合關鍵字才使用；semantic 時優先使用；keyword 時不使用
+RETRIEVAL_MODE = os.getenv('RETRIEVAL_MODE', 'hybrid')   # keyword / hybrid / semantic
+_semantic = SemanticRetriever()
+
+def _semantic_items(user_input, gender=None, k=5):
+    """依語意相似度取出 k 件 (沒有索引或沒有足夠相似的商品時回傳空列表)"""
+    # 多取一些，依性別篩選後仍有 k 件
+    hits = _semantic.search(user_input, k * 4 if gender else k)
+    if not hits:
+        return []
+    conn = get_db_conn()
+    try:
+        with conn.cursor() as cur:
+            items = fetch_items_by_ids(cur, [item_id for item_id, _ in hits])
+    finally:
+        conn.close()
+    if gender:
+        items = [item for item in items if item.get('gender') in (gender, None, '', '-', '中性')]
+    return [serialize_item(item) for item in items[:k]]
+
+# 整套穿搭：從 items 組出 上衣 + 下身 (+ 外套)，加一點隨機擾動讓每次結果有變化
+OUTFIT_JITTER = float(os.getenv('OUTFIT_JITTER', '0.1'))
+
+def compose_outfits(user_input: str = '', gender: str = None, n: int = 3, with_outer: bool = True):
+    """
+    依「場合/風格」關鍵字組出 n 套完整穿搭 (沒有關鍵字時從全部商品組合)
+
+    Returns:
+        ([{"top": item, "bottom": item, "outer": item 或 None, "score": 分數}, ...], keywords)
+    """
+    keywords = extract_keywords(user_input) if user_input else []
+    terms = {t for kw in keywords for t in OCCASION_STYLE_MAPPING.get(kw, [])}
+    conn = get_db_conn()
+    try:
+        with conn.cursor() as cur:
+            with span('outfits', 'compose'):
+                outfits = get_outfit_composer().compose(cur, n=n, gender=gender, terms=terms or None,
+                                                        with_outer=with_outer, jitter=OUTFIT_JITTER)
+            ids = [o[slot] for o in outfits for slot in SLOT_NAMES if o[slot] is not None]
+            with span('outfits', 'fetch_items'):
+                items = {item['id']: serialize_item(item) for item in fetch_items_by_ids(cur, ids)}
+    finally:
+        conn.close()
+    result = [{**{slot: items.get(o[slot]) for slot in SLOT_NAMES}, 'score': o['score']} for o in outfits]
+    return result, keywords
+
+def retrieval_cache_stats():
+    return _retrieval_cache.stats()
+
+def semantic_index_stats():
+    stats = _semantic.stats()
+    stats['mode'] = RETRIEVAL_MODE
+    # 有啟用語意檢索卻沒有索引：不會報錯，但會退回推薦池 / 隨機推薦，在 /ping 標示出來
+    stats['degraded'] = RETRIEVAL_MODE != 'keyword' and not stats['loaded']
+    return stats
+
+def occasion_pool_stats():
+    return _occasion_pools.stats()
+
 # ==============================================================================
 # 區塊 4: AI 穿搭推薦主函數
 # 說明:
@@ -108,8 +189,11 @@ def serialize_item(item):
 # - 步驟 1 (檢索):
 #   - 呼叫 `extract_keywords` 找出使用者想問的「場合/風格」。
 #   - 如果找到關鍵字，就用 `OCCASION_STYLE_MAPPING` 把它們轉換成衣物類型列表。
-#   - **優化**: 產生同時查詢 `clothing_type` (精確比對) 和 `name` (模糊比對) 的 SQL。
-#   - 如果沒有找到關鍵字或查詢無結果，就隨機推薦幾件單品作為備案。
+#   - 優先使用離線預先計算的場合推薦池 (occasion_pools)，從排序後的前段隨機抽 5 件。
+#   - 池不可用時才即時檢索：同時比對 `clothing_type` (精確比對) 和 `name` (模糊比對)，
+#     由抽樣索引隨機取出 (不再 ORDER BY RAND())；同樣關鍵字組合的候選池會快取 (retrieval_cache)。
+#   - 沒有場合關鍵字時改用語意檢索 (embedding_index，RETRIEVAL_MODE 設定)，依問句與商品文字的相似度取出。
+#   - 如果都沒有結果，就隨機推薦幾件單品作為備案。
 # - 步驟 2 (增強):
 #   - 將查詢到的單品資訊（包含您指定的 color 和 clothing_type）整理成一段文字，
 #     這段文字就是提供給 AI 的「上下文 (Context)」。
@@ -118,63 +202,59 @@ def serialize_item(item):
 #   - AI 會根據這些資訊，生成一段更自然、更完整的推薦文案。
 #   - 如果 AI 服務失敗，會提供一個備援的回應，至少讓使用者看到資料庫的查詢結果。
 # ==============================================================================
-def generate_recommendation(user_input: str,
-                            session_id: str = 'default',
-                            preferred_model: str = 'auto'):
+def retrieve_items(user_input: str, gender: str = None):
     """
-    根據使用者輸入的「場合」或「風格」產生推薦
+    RAG 檢索 + 增強：回傳 (items, keywords, rag_context)
     """
-    if not user_input:
-        return "請告訴我您想要的風格或場合，例如「適合上班的穿搭」", [], []
-
     # 1. RAG - 檢索 (Retrieval)
-    keywords = extract_keywords(user_input)
+    with span('recommend_v4', 'keywords'):
+        keywords = extract_keywords(user_input)
     items = []
     
-    conn = get_db_conn()
-    try:
-        with conn.cursor() as cur:
-            if keywords:
+    with span('recommend_v4', 'retrieval'):
+        try:
+            if RETRIEVAL_MODE == 'semantic':
+                items = _semantic_items(user_input, gender=gender)
+
+            if keywords and not items:
                 # 將場合/風格關鍵字轉換為衣物類型
                 target_clothing_types = []
                 for kw in keywords:
                     target_clothing_types.extend(OCCASION_STYLE_MAPPING.get(kw, []))
-                
+
                 if target_clothing_types:
-                    # 建立一個同時查詢 clothing_type 和 name 的 SQL 語句
-                    # 例如: (clothing_type = %s OR name LIKE %s)
-                    where_clauses = []
-                    query_params = []
-                    for t_type in set(target_clothing_types): # 使用 set 避免重複
-                        where_clauses.append("(clothing_type = %s OR name LIKE %s)")
-                        query_params.extend([t_type, f'%{t_type}%'])
-
-                    sql_query = f"""
-                        SELECT * FROM items 
-                        WHERE {' OR '.join(where_clauses)}
-                        ORDER BY RAND() 
-                        LIMIT 5
-                    """
-                    cur.execute(sql_query, tuple(query_params))
-                    items = cur.fetchall()
+                    items = _sample_from_occasion_pools(keywords, gender=gender)
+                    if items is None:
+                        # 同時比對 clothing_type 和 name，等同
+                        # (clothing_type = %s OR name LIKE %s)；候選池依關鍵字組合快取
+                        pool = _retrieval_cache.get_or_load(
+                            (frozenset(keywords), gender),
+                            lambda: _load_candidate_pool(target_clothing_types, gender),
+                            version=current_catalog_version())
+                        # 複製一份，避免後續修改影響快取內容
+                        items = [dict(item) for item in random.sample(pool, min(5, len(pool)))]
+
+            if not items and RETRIEVAL_MODE == 'hybrid':
+                items = _semantic_items(user_input, gender=gender)
 
             # 如果關鍵字查詢沒有結果，隨機推薦幾件
             if not items:
-                cur.execute("SELECT * FROM items ORDER BY RAND() LIMIT 5")
-                items = cur.fetchall()
-            
-            items = [serialize_item(item) for item in items]
+                conn = get_db_conn()
+                try:
+                    with conn.cursor() as cur:
+                        items = [serialize_item(item) for item in sample_items(cur, 5, gender=gender)]
+                finally:
+                    conn.close()
 
-    except Exception as e:
-        print(f"❌ 資料庫查詢失敗: {e}", flush=True, file=sys.stderr)
-        items = []
-    finally:
-        conn.close()
+        except Exception as e:
+            print(f"❌ 資料庫查詢失敗: {e}", flush=True, file=sys.stderr)
+            items = []
 
     # 2. 增強 (Augmented) - 準備給 AI 的上下文
     rag_context = ""
     if items:
-        rag_context += f"\n\n資料庫根據你提到的「{'、'.join(keywords)}」風格/場合，找到了這些衣物，請你參考並以條列式推薦給使用者：\n"
+        basis = f"你提到的「{'、'.join(keywords)}」風格/場合" if keywords else "你的描述"
+        rag_context += f"\n\n資料庫根據{basis}，找到了這些衣物，請你參考並以條列式推薦給使用者：\n"
         for item in items:
             # 建立包含 color 和 clothing_type 的描述
             item_desc = f"- 一件 {item.get('color', '未知顏色')} 的 {item.get('clothing_type', '未知類型')} ({item.get('name', '')})"
@@ -182,30 +262,111 @@ def generate_recommendation(user_input: str,
     else:
         rag_context = "\n\n資料庫中沒有找到符合條件的衣物。"
 
+    return items, keywords, rag_context
+
+
+def _database_only_text(rag_context):
+    """未啟用 AI 時的說明文字"""
+    return "AI 尚未啟用，以下為資料庫推薦：\n" + rag_context
+
+
+def _ai_error_fallback(items, rag_context):
+    """AI 失敗時的訊息 + 資料庫推薦"""
+    fallback_text = f"⚠️ AI 服務暫時無法使用。\n\n"
+    if items:
+        fallback_text += "不過，我仍在資料庫中為您找到了一些推薦：\n"
+        fallback_text += rag_context
+    else:
+        fallback_text += "抱歉，目前無法提供任何推薦。"
+    return fallback_text
+
+
+def generate_recommendation(user_input: str,
+                            session_id: str = 'default',
+                            preferred_model: str = 'auto',
+                            gender: str = None):
+    """
+    根據使用者輸入的「場合」或「風格」產生推薦 (gender: 只推薦該性別與中性的商品)
+    超過速率限制時拋出 RateLimited，由路由回應 429
+    """
+    if not user_input:
+        return "請告訴我您想要的風格或場合，例如「適合上班的穿搭」", [], []
+
+    items, keywords, rag_context = retrieve_items(user_input, gender=gender)
+
     # 如果未啟用 AI，僅返回資料庫內容
     if not USE_GEMINI or not agent:
-        text = "AI 尚未啟用，以下為資料庫推薦：\n"
-        text += rag_context
-        return text, items, keywords
+        return _database_only_text(rag_context), items, keywords
 
     # 3. 生成 (Generation) - 呼叫 AI
     try:
         final_prompt = user_input + rag_context
-        ai_response = agent.chat(
-            session_id=session_id,
-            user_input=final_prompt,
-            db_outfits=items,
-            preferred_model=preferred_model
-        )
+        with span('recommend_v4', 'agent'):
+            ai_response = agent.chat(
+                session_id=session_id,
+                user_input=final_prompt,
+                db_outfits=items,
+                preferred_model=preferred_model,
+                query=user_input
+            )
         return ai_response, items, keywords
 
+    except RateLimited:
+        # 超過速率限制交給路由回應 429 + Retry-After
+        raise
     except Exception as e:
         error_msg = str(e)
         print(f"❌ AI 服務錯誤: {error_msg}", flush=True, file=sys.stderr)
-        fallback_text = f"⚠️ AI 服務暫時無法使用。\n\n"
-        if items:
-            fallback_text += "不過，我仍在資料庫中為您找到了一些推薦：\n"
-            fallback_text += rag_context
-        else:
-            fallback_text += "抱歉，目前無法提供任何推薦。"
-        return fallback_text, items, keywords
+        return _ai_error_fallback(items, rag_context), items, keywords
+
+
+def generate_recommendation_stream(user_input: str,
+                                   session_id: str = 'default',
+                                   preferred_model: str = 'auto',
+                                   gender: str = None):
+    """
+    串流版 generate_recommendation：先送出檢索結果，再逐段送出 AI 回應
+    事件與 v1 (services.generate_recommendation_stream) 相同：
+        ("items", {"db_data": [...], "keywords": [...], "session_id": ...})
+        ("model", {"model": 模型名稱})
+        ("token", {"text": 文字片段})
+        ("done",  {"response": 完整回應})
+        ("error", {"error": 訊息})      已開始輸出後才失敗，或超過速率限制 (附 retry_after)
+    """
+    items, keywords, rag_context = retrieve_items(user_input, gender=gender)
+    yield "items", {"db_data": items, "keywords": keywords, "session_id": session_id}
+
+    if not USE_GEMINI or not agent:
+        text = _database_only_text(rag_context)
+        yield "token", {"text": text}
+        yield "done", {"response": text}
+        return
+
+    started = False
+    try:
+        for event, value in agent.chat_stream(
+            session_id=session_id,
+            user_input=user_input + rag_context,
+            db_outfits=items,
+            preferred_model=preferred_model,
+            query=user_input
+        ):
+            if event == "model":
+                yield "model", {"model": value}
+            elif event == "token":
+                started = True
+                yield "token", {"text": value}
+            else:
+                yield "done", {"response": value}
+    except RateLimited as e:
+        yield "error", {"error": f"請求太頻繁，請 {e.retry_after:.0f} 秒後再試", "retry_after": e.retry_after}
+    except Exception as e:
+        error_msg = str(e)
+        print(f"❌ AI 串流錯誤: {error_msg}", flush=True, file=sys.stderr)
+        if started:
+            # 已經送出部分內容，只能通知前端中斷
+            yield "error", {"error": "AI 回應中斷，請稍後再試"}
+            return
+        text = _ai_error_fallback(items, rag_context)
+        yield "token", {"text": text}
+        yield "done", {"response": text}
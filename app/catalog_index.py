@@ -0,0 +1,479 @@
+"""
+商品目錄索引模組 (欄式存放)
+items 表小且以讀取為主，因此每個 worker 啟動時整批載入記憶體：
+
+- id / price 用 NumPy 陣列存放
+- gender / clothing_type / category / length / color 以「代碼 + 字典」存放 (字串只存一次)
+- sku 為字串列表；name 只存正規化後的字串，另建 n-gram 倒排索引做包含比對
+- 依 id / created_at 增量更新，不必每次整表重載
+- catalog_meta.version (由 05_database_import 匯入時 +1) 改變時整表重載，
+  並作為檢索快取的失效依據
+- 每件商品的 Pantone 色盤代碼 (color_harmony) 隨快照保存，配色和諧度只需陣列索引
+
+檢索時用布林遮罩在記憶體中篩選，只把最後選中的 id 交給 MySQL 取完整資料
+"""
+
+import os
+import sys
+import time
+import threading
+
+import numpy as np
+
+from ngram_index import NgramIndex
+from color_harmony import palette_index, harmony, UNKNOWN as UNKNOWN_COLOR
+
+# 多久檢查一次商品表是否有變動 (秒)
+CATALOG_CHECK_INTERVAL = float(os.getenv('CATALOG_CHECK_INTERVAL', '30'))
+
+CATEGORICAL_FIELDS = ('gender', 'clothing_type', 'category', 'length', 'color')
+CATALOG_COLUMNS = ('id', 'sku', 'name', 'price', 'created_at') + CATEGORICAL_FIELDS
+
+# =======================
+# 關鍵字比對規則
+# 欄位名稱 -> 'exact' (完全相同) 或 'contains' (包含，等同 LIKE '%x%')
+# =======================
+# v3 / v4: (clothing_type = %s OR name LIKE %s)
+MATCH_TYPE_OR_NAME = (('clothing_type', 'exact'), ('name', 'contains'))
+# v2: (clothing_type LIKE %s OR category LIKE %s)
+MATCH_TYPE_OR_CATEGORY = (('clothing_type', 'contains'), ('category', 'contains'))
+
+
+def _norm(value):
+    """比對用的正規化 (MySQL utf8mb4_unicode_ci 不分大小寫)"""
+    return value.strip().casefold() if isinstance(value, str) else None
+
+
+class _Vocab:
+    """類別欄位的字典 (只增不減，可在多個快照之間共用)"""
+
+    def __init__(self):
+        self.values = []   # 代碼 -> 原始字串
+        self.normed = []   # 代碼 -> 正規化字串
+        self._codes = {}
+        self._lock = threading.Lock()
+
+    def encode(self, value):
+        if value is None:
+            return -1
+        code = self._codes.get(value)
+        if code is None:
+            with self._lock:
+                code = self._codes.get(value)
+                if code is None:
+                    code = len(self.values)
+                    self.values.append(value)
+                    self.normed.append(_norm(value))
+                    self._codes[value] = code
+        return code
+
+    def codes_matching(self, term, how):
+        """回傳符合關鍵字的代碼陣列 (只掃字典，不掃整欄)"""
+        if how == 'exact':
+            return np.array([c for c, v in enumerate(self.normed) if v == term], dtype=np.int32)
+        return np.array([c for c, v in enumerate(self.normed) if v is not None and term in v], dtype=np.int32)
+
+
+class CatalogSnapshot:
+    """某個時間點的商品目錄 (建好後唯讀)"""
+
+    def __init__(self, ids, price, codes, sku, name_norm, vocabs, max_created, version, name_index=None):
+        self.ids = ids              # np.int64，依 id 排序
+        self.price = price          # np.float64，NULL 為 nan
+        self.codes = codes          # {欄位: np.int32 代碼陣列，NULL 為 -1}
+        self.sku = sku
+        self.name_norm = name_norm  # 正規化後的 name (原始字串由 MySQL 取完整資料時提供)
+        self.name_index = name_index if name_index is not None else NgramIndex.build(name_norm)
+        self.vocabs = vocabs
+        self.max_created = max_created
+        self.version = version
+        self._palette = None
+
+    def __len__(self):
+        return len(self.ids)
+
+    @property
+    def max_id(self):
+        return int(self.ids[-1]) if len(self.ids) else 0
+
+    @property
+    def palette(self):
+        """每件商品的 Pantone 色盤代碼 (np.int16，無法辨識為 -1)；第一次使用時由顏色字典換算"""
+        if self._palette is None:
+            by_code = np.array([palette_index(v) for v in self.vocabs['color'].values] + [UNKNOWN_COLOR],
+                               dtype=np.int16)
+            self._palette = by_code[self.codes['color']]
+        return self._palette
+
+    def color_stats(self, top=10):
+        """無法對到色盤的商品比例，以及最常見的無法辨識色名 (配色分數對這些商品沒有作用)"""
+        unknown = self.palette == UNKNOWN_COLOR
+        codes = self.codes['color'][unknown]
+        values, counts = np.unique(codes[codes >= 0], return_counts=True)
+        order = np.argsort(-counts)[:top]
+        color_values = self.vocabs['color'].values
+        return {
+            'items': len(self),
+            'unknown': int(unknown.sum()),
+            'unknown_ratio': round(float(unknown.mean()), 4) if len(self) else 0.0,
+            'top_unknown': {color_values[values[i]]: int(counts[i]) for i in order},
+        }
+
+    def color_harmony(self, rows_a, rows_b):
+        """兩組列位置的配色和諧度矩陣 (len(a) × len(b))"""
+        return harmony(self.palette[rows_a], self.palette[rows_b])
+
+    # -----------------------
+    # 篩選
+    # -----------------------
+    def field_mask(self, field, term, how='exact'):
+        """單一欄位的比對遮罩"""
+        term = _norm(term)
+        if not term:
+            return np.zeros(len(self), dtype=bool)
+        if field in self.codes:
+            return np.isin(self.codes[field], self.vocabs[field].codes_matching(term, how))
+        if field == 'name':
+            mask = np.zeros(len(self), dtype=bool)
+            mask[self.name_index.search(term, self.name_norm, exact=(how == 'exact'))] = True
+            return mask
+        if field == 'sku':
+            return np.fromiter((_norm(s) == term for s in self.sku), dtype=bool, count=len(self))
+        raise ValueError(f"不支援的欄位: {field}")
+
+    def mask(self, terms=None, match=MATCH_TYPE_OR_NAME, gender=None, category=None,
+             color=None, min_price=None, max_price=None):
+        """
+        組合條件的布林遮罩
+
+        Args:
+            terms: 關鍵字列表，任一關鍵字符合即可 (OR)
+            match: 關鍵字比對規則
+            gender / category: 精確篩選 (AND)
+            color: 顏色包含比對 (AND，等同 color LIKE '%x%')
+            min_price / max_price: 價格區間 (AND，NULL 價格不符合)
+        """
+        result = np.ones(len(self), dtype=bool)
+        if terms:
+            matched = np.zeros(len(self), dtype=bool)
+            for term in terms:
+                for field, how in match:
+                    matched |= self.field_mask(field, term, how)
+            result &= matched
+        if gender is not None:
+            result &= self.field_mask('gender', gender)
+        if category is not None:
+            result &= self.field_mask('category', category)
+        if color is not None:
+            result &= self.field_mask('color', color, 'contains')
+        if min_price is not None:
+            result &= self.price >= min_price
+        if max_price is not None:
+            result &= self.price <= max_price
+        return result
+
+    def filter_ids(self, **filters):
+        """回傳符合條件的 id 陣列"""
+        return self.ids[self.mask(**filters)]
+
+    def nbytes(self):
+        """估計常駐記憶體用量 (位元組)"""
+        total = self.ids.nbytes + self.price.nbytes + sum(c.nbytes for c in self.codes.values())
+        total += sum(sys.getsizeof(s) for s in self.sku if s is not None)
+        total += sum(sys.getsizeof(s) for s in self.name_norm if s is not None)
+        total += self.name_index.nbytes()
+        return total
+
+
+def _columns_from_rows(rows, vocabs):
+    ids = np.fromiter((r['id'] for r in rows), dtype=np.int64, count=len(rows))
+    price = np.fromiter((float(r['price']) if r.get('price') is not None else np.nan for r in rows),
+                        dtype=np.float64, count=len(rows))
+    codes = {f: np.fromiter((vocabs[f].encode(r.get(f)) for r in rows), dtype=np.int32, count=len(rows))
+             for f in CATEGORICAL_FIELDS}
+    sku = [r.get('sku') for r in rows]
+    name_norm = [_norm(r.get('name')) for r in rows]
+    return ids, price, codes, sku, name_norm
+
+
+def _max_created(rows, current=None):
+    values = [r['created_at'] for r in rows if r.get('created_at') is not None]
+    if current is not None:
+        values.append(current)
+    return max(values) if values else None
+
+
+class CatalogIndex:
+    """每個 worker 一份的商品目錄索引，負責載入與增量更新"""
+
+    def __init__(self, check_interval=CATALOG_CHECK_INTERVAL):
+        self.check_interval = check_interval
+        self.vocabs = {f: _Vocab() for f in CATEGORICAL_FIELDS}
+        self._snapshot = None
+        self._version = 0
+        self._db_version = None  # catalog_meta 中的版本號
+        self._last_check = 0.0
+        self._lock = threading.Lock()
+
+    @property
+    def snapshot(self):
+        return self._snapshot
+
+    # -----------------------
+    # 載入 / 更新
+    # -----------------------
+    def _select(self, cur, where='', params=()):
+        cur.execute(f"SELECT {', '.join(CATALOG_COLUMNS)} FROM items {where} ORDER BY id", params)
+        return cur.fetchall()
+
+    @staticmethod
+    def _read_db_version(cur):
+        """讀取 catalog_meta 的版本號 (舊資料庫沒有這張表時回傳 None)"""
+        try:
+            cur.execute("SELECT version FROM catalog_meta WHERE name = 'items'")
+            row = cur.fetchone()
+            return row['version'] if row else None
+        except Exception:
+            return None
+
+    def load(self, cur):
+        """整表載入"""
+        self._db_version = self._read_db_version(cur)
+        rows = self._select(cur)
+        self._version += 1
+        self._snapshot = CatalogSnapshot(*_columns_from_rows(rows, self.vocabs), vocabs=self.vocabs,
+                                         max_created=_max_created(rows), version=self._version)
+        print(f"📚 商品索引已載入 ({len(rows)} 件, 約 {self._snapshot.nbytes() / 1024:.0f} KB)",
+              flush=True, file=sys.stderr)
+        return self._snapshot
+
+    def _apply_delta(self, rows):
+        """把新增/更新的列合併進目前的快照 (產生新的快照，舊快照不變)"""
+        base = self._snapshot
+        d_ids, d_price, d_codes, d_sku, d_name = _columns_from_rows(rows, self.vocabs)
+
+        pos = np.searchsorted(base.ids, d_ids)
+        in_range = pos < len(base.ids)
+        existing = np.zeros(len(d_ids), dtype=bool)
+        existing[in_range] = base.ids[pos[in_range]] == d_ids[in_range]
+
+        price = base.price.copy()
+        codes = {f: c.copy() for f, c in base.codes.items()}
+        sku, name = list(base.sku), list(base.name_norm)
+
+        # 已存在的 id：原地更新
+        upd = np.nonzero(existing)[0]
+        price[pos[upd]] = d_price[upd]
+        for f in CATEGORICAL_FIELDS:
+            codes[f][pos[upd]] = d_codes[f][upd]
+        for i in upd:
+            sku[pos[i]] = d_sku[i]
+            name[pos[i]] = d_name[i]
+
+        # 新的 id：附加在後面並維持依 id 排序
+        new = np.nonzero(~existing)[0]
+        ids = np.concatenate([base.ids, d_ids[new]])
+        price = np.concatenate([price, d_price[new]])
+        codes = {f: np.concatenate([codes[f], d_codes[f][new]]) for f in CATEGORICAL_FIELDS}
+        sku += [d_sku[i] for i in new]
+        name += [d_name[i] for i in new]
+        if len(new) and len(base.ids) and d_ids[new].min() < base.ids[-1]:
+            order = np.argsort(ids, kind='stable')
+            ids, price = ids[order], price[order]
+            codes = {f: c[order] for f, c in codes.items()}
+            sku = [sku[i] for i in order]
+            name = [name[i] for i in order]
+            name_index = None  # 列位置全部改變，n-gram 索引整個重建
+        else:
+            # 只有附加與原地更新：在舊的 n-gram 索引上補上受影響的列即可
+            changed = {int(pos[i]): d_name[i] for i in upd}
+            changed.update({len(base.ids) + j: d_name[i] for j, i in enumerate(new)})
+            name_index = base.name_index.extended(changed)
+
+        self._version += 1
+        self._snapshot = CatalogSnapshot(ids, price, codes, sku, name, vocabs=self.vocabs,
+                                         max_created=_max_created(rows, base.max_created),
+                                         version=self._version, name_index=name_index)
+        print(f"🔄 商品索引增量更新 (+{len(new)} 新增, {len(upd)} 更新)", flush=True, file=sys.stderr)
+
+    def refresh(self, cur, force=False):
+        """
+        需要時更新索引並回傳最新快照
+        - 每 check_interval 秒最多檢查一次 (COUNT / MAX(id) / MAX(created_at))
+        - 有新的 id 或 created_at 就增量更新；筆數對不上 (例如有刪除) 就整表重載
+        - catalog_meta 版本號改變時整表重載
+        """
+        snap = self._snapshot
+        if not force and snap is not None and time.monotonic() - self._last_check < self.check_interval:
+            return snap
+
+        with self._lock:
+            snap = self._snapshot
+            if not force and snap is not None and time.monotonic() - self._last_check < self.check_interval:
+                return snap
+            self._last_check = time.monotonic()
+
+            if force or snap is None:
+                return self.load(cur)
+
+            cur.execute("SELECT COUNT(*) AS n, MAX(id) AS max_id, MAX(created_at) AS max_created FROM items")
+            sig = cur.fetchone() or {}
+            n, max_id, max_created = sig.get('n') or 0, sig.get('max_id') or 0, sig.get('max_created')
+
+            # 匯入流程更新了版本號 (可能有 UPSERT 改到既有商品)：整表重載
+            if self._read_db_version(cur) != self._db_version:
+                return self.load(cur)
+
+            if n == len(snap) and max_id == snap.max_id and max_created == snap.max_created:
+                return snap
+
+            if snap.max_created is not None:
+                rows = self._select(cur, "WHERE id > %s OR created_at > %s", (snap.max_id, snap.max_created))
+            else:
+                rows = self._select(cur, "WHERE id > %s", (snap.max_id,))
+            if rows:
+                self._apply_delta(rows)
+            if len(self._snapshot) != n:
+                return self.load(cur)
+            return self._snapshot
+
+    def invalidate(self):
+        """強制下次使用時重新檢查商品表"""
+        self._last_check = 0.0
+
+
+# =======================
+# 每個 worker 共用一個索引
+# =======================
+_catalog_index = CatalogIndex()
+
+# 依 id 取完整資料時，單次 IN (...) 最多放幾個 id
+FETCH_CHUNK_SIZE = 1000
+
+
+def get_catalog_index():
+    return _catalog_index
+
+
+def fetch_items_by_ids(cur, ids):
+    """依 id 取回完整商品資料 (主鍵查詢)，並保持 ids 的順序"""
+    ids = [int(i) for i in ids]
+    if not ids:
+        return []
+    rows = {}
+    for start in range(0, len(ids), FETCH_CHUNK_SIZE):
+        chunk = ids[start:start + FETCH_CHUNK_SIZE]
+        placeholders = ','.join(['%s'] * len(chunk))
+        cur.execute(f"SELECT * FROM items WHERE id IN ({placeholders})", chunk)
+        rows.update((row['id'], row) for row in cur.fetchall())
+    return [rows[i] for i in ids if i in rows]
+
+
+def _filtered_ids(cur, color, category, after_id):
+    """記憶體索引篩選後 id > after_id 的部分 (ids 已依 id 排序)"""
+    ids = _catalog_index.refresh(cur).filter_ids(color=color or None, category=category or None)
+    return ids[np.searchsorted(ids, after_id, side='right'):]
+
+
+def find_items(cur, color=None, category=None, after_id=0, limit=None):
+    """
+    /items 用的篩選：color 包含比對、category 精確比對
+    篩選在記憶體索引中完成，MySQL 只做主鍵查詢 (不再 color LIKE '%x%' 掃整表)
+
+    keyset 分頁：只回傳 id > after_id 的前 limit 筆 (依 id 排序)，limit=None 表示不限筆數
+    """
+    if not color and not category:
+        if limit is None:
+            cur.execute("SELECT * FROM items WHERE id > %s ORDER BY id", (after_id,))
+        else:
+            cur.execute("SELECT * FROM items WHERE id > %s ORDER BY id LIMIT %s", (after_id, limit))
+        return cur.fetchall()
+    ids = _filtered_ids(cur, color, category, after_id)
+    return fetch_items_by_ids(cur, ids if limit is None else ids[:limit])
+
+
+class ItemStream:
+    """
+    依 id 順序逐筆產生商品 (記憶體用量與商品數無關)
+
+    - 沒有篩選條件：unbuffered server-side cursor (SSDictCursor)，每次 fetchmany 一批
+    - 有篩選條件：記憶體索引取出 id 後，每 FETCH_CHUNK_SIZE 個 id 查一次主鍵
+
+    用法：
+        stream = ItemStream(conn, color=...)
+        try:
+            for item in stream: ...
+        finally:
+            stream.close()
+
+    沒有讀完就結束 (例如客戶端中斷) 時，close() 會把連線標記為損壞，
+    歸還時直接關閉，不必把剩下的結果全部讀完
+    """
+
+    def __init__(self, conn, color=None, category=None, after_id=0, batch_size=FETCH_CHUNK_SIZE):
+        self.conn = conn
+        self.color = color
+        self.category = category
+        self.after_id = after_id
+        self.batch_size = batch_size
+        self.cur = None
+        self.finished = False
+
+    def __iter__(self):
+        if not self.color and not self.category:
+            import pymysql.cursors
+            self.cur = self.conn.cursor(pymysql.cursors.SSDictCursor)
+            self.cur.execute("SELECT * FROM items WHERE id > %s ORDER BY id", (self.after_id,))
+            while True:
+                rows = self.cur.fetchmany(self.batch_size)
+                if not rows:
+                    break
+                yield from rows
+        else:
+            self.cur = self.conn.cursor()
+            ids = _filtered_ids(self.cur, self.color, self.category, self.after_id)
+            for start in range(0, len(ids), self.batch_size):
+                yield from fetch_items_by_ids(self.cur, ids[start:start + self.batch_size])
+        self.finished = True
+
+    def close(self):
+        if self.cur is not None:
+            if self.finished:
+                self.cur.close()
+            elif hasattr(self.conn, 'discard'):
+                self.conn.discard()
+        self.conn.close()
+
+
+def current_catalog_version():
+    """
+    目前的商品目錄版本 (每次載入或增量更新都會 +1)
+    多數時候不碰資料庫，只有超過檢查間隔才會查一次
+    """
+    from db_pool import get_db_conn
+    conn = get_db_conn()
+    try:
+        with conn.cursor() as cur:
+            return _catalog_index.refresh(cur).version
+    finally:
+        conn.close()
+
+
+def catalog_color_stats():
+    """目前商品索引的色盤對應狀況 (尚未載入時回傳 None，不碰資料庫)"""
+    snap = _catalog_index.snapshot
+    return snap.color_stats() if snap is not None else None
+
+
+def warm_up_catalog_index():
+    """worker 啟動時預先載入 (失敗不影響啟動，第一次查詢時會再載入)"""
+    from db_pool import get_db_conn
+    try:
+        conn = get_db_conn()
+        try:
+            with conn.cursor() as cur:
+                _catalog_index.refresh(cur, force=True)
+        finally:
+            conn.close()
+    except Exception as e:
+        print(f"⚠️ 商品索引預載失敗 (稍後再試): {e}", flush=True, file=sys.stderr)
@@ -0,0 +1,162 @@
+"""
+熔斷器模組 (每個模型供應商一個)
+供應商餘額不足或持續 429 時，不必每次對話都先撞一次錯誤：
+
+- closed:    正常呼叫，統計最近 N 次的錯誤率與慢呼叫比例
+- open:      錯誤率或慢呼叫比例超過門檻 (或遇到餘額不足 / 認證失敗這類不會自己好的錯誤) 就開啟，
+             冷卻期間自動模式直接略過
+- half_open: 冷卻結束後只放行一個試探請求；成功就關閉，失敗就再開啟一輪冷卻
+- 健康分數 = 成功率 × (1 - 慢呼叫比例 / 2)，供健康檢查輸出
+"""
+
+import os
+import re
+import time
+import threading
+from collections import deque
+
+BREAKER_WINDOW = int(os.getenv('BREAKER_WINDOW', '20'))               # 統計最近幾次呼叫
+BREAKER_MIN_CALLS = int(os.getenv('BREAKER_MIN_CALLS', '5'))          # 至少幾次才判斷
+BREAKER_ERROR_RATE = float(os.getenv('BREAKER_ERROR_RATE', '0.5'))    # 錯誤率門檻
+BREAKER_SLOW_CALL = float(os.getenv('BREAKER_SLOW_CALL', '15'))       # 超過幾秒算慢呼叫
+BREAKER_SLOW_RATE = float(os.getenv('BREAKER_SLOW_RATE', '0.8'))      # 慢呼叫比例門檻
+BREAKER_COOLDOWN = float(os.getenv('BREAKER_COOLDOWN', '30'))         # 開啟後冷卻秒數
+
+CLOSED, OPEN, HALF_OPEN = 'closed', 'open', 'half_open'
+
+# 不會自己恢復的錯誤：遇到一次就直接開啟
+FATAL_STATUS_CODES = (401, 402, 403)
+FATAL_ERROR_MARKERS = ('Insufficient Balance', 'API key')
+# 錯誤訊息中的 HTTP 狀態碼 (只認狀態碼的寫法，不會誤判 request id、port、token 數這類數字)：
+#   "Error code: 401"、"status 403"、"status_code=402"、"401 Unauthorized"、"403 Client Error"
+FATAL_STATUS_PATTERN = re.compile(
+    r'(?:error code|status(?:[ _]code)?)\s*[:=]?\s*(40[123])\b'
+    r'|\b(40[123])\s+(?:unauthorized|payment required|forbidden|client error)',
+    re.IGNORECASE)
+
+
+def is_fatal_error(error):
+    # SDK 例外直接帶有狀態碼：openai / groq 為 status_code，google.api_core 為 code
+    status = getattr(error, 'status_code', None)
+    if status is None:
+        status = getattr(getattr(error, 'response', None), 'status_code', None)
+    if status is None:
+        status = getattr(error, 'code', None)
+    if status in FATAL_STATUS_CODES:
+        return True
+    message = str(error)
+    return (any(marker in message for marker in FATAL_ERROR_MARKERS)
+            or FATAL_STATUS_PATTERN.search(message) is not None)
+
+
+class CircuitBreaker:
+    """單一供應商的熔斷器"""
+
+    def __init__(self, name, window=BREAKER_WINDOW, min_calls=BREAKER_MIN_CALLS,
+                 error_rate=BREAKER_ERROR_RATE, slow_call=BREAKER_SLOW_CALL,
+                 slow_rate=BREAKER_SLOW_RATE, cooldown=BREAKER_COOLDOWN):
+        self.name = name
+        self.min_calls = min_calls
+        self.error_rate_threshold = error_rate
+        self.slow_call = slow_call
+        self.slow_rate_threshold = slow_rate
+        self.cooldown = cooldown
+        self.state = CLOSED
+        self._calls = deque(maxlen=window)   # (成功?, 慢呼叫?)
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+        self._lock = threading.Lock()
+        self._stats = {'opened': 0, 'rejected': 0}
+        self._last_error = None
+
+    def allow(self):
+        """這次能不能呼叫 (open 時立即回傳 False)"""
+        with self._lock:
+            if self.state == OPEN:
+                if time.monotonic() - self._opened_at < self.cooldown:
+                    self._stats['rejected'] += 1
+                    return False
+                self.state = HALF_OPEN
+                self._probe_in_flight = False
+            if self.state == HALF_OPEN:
+                if self._probe_in_flight:
+                    self._stats['rejected'] += 1
+                    return False
+                self._probe_in_flight = True
+            return True
+
+    def cancel_probe(self):
+        """allow() 放行後實際上沒有呼叫 (例如被限流)，歸還 half_open 的試探名額"""
+        with self._lock:
+            if self.state == HALF_OPEN:
+                self._probe_in_flight = False
+
+    def retry_in(self):
+        """距離下次試探還有幾秒 (非 open 狀態回傳 0)"""
+        with self._lock:
+            if self.state != OPEN:
+                return 0.0
+            return max(0.0, self.cooldown - (time.monotonic() - self._opened_at))
+
+    def record_success(self, latency):
+        with self._lock:
+            if self.state == HALF_OPEN:
+                # 試探成功：恢復正常，重新統計
+                self.state = CLOSED
+                self._probe_in_flight = False
+                self._calls.clear()
+            self._calls.append((True, latency >= self.slow_call))
+            self._evaluate()
+
+    def record_failure(self, error):
+        with self._lock:
+            self._last_error = str(error)[:200]
+            if self.state == HALF_OPEN or is_fatal_error(error):
+                self._open()
+                return
+            self._calls.append((False, False))
+            self._evaluate()
+
+    def _evaluate(self):
+        if self.state != CLOSED or len(self._calls) < self.min_calls:
+            return
+        error_rate, slow_rate = self._rates()
+        if error_rate >= self.error_rate_threshold or slow_rate >= self.slow_rate_threshold:
+            self._open()
+
+    def _open(self):
+        self.state = OPEN
+        self._opened_at = time.monotonic()
+        self._probe_in_flight = False
+        self._stats['opened'] += 1
+
+    def _rates(self):
+        total = len(self._calls)
+        if not total:
+            return 0.0, 0.0
+        errors = sum(1 for ok, _ in self._calls if not ok)
+        slow = sum(1 for _, is_slow in self._calls if is_slow)
+        return errors / total, slow / total
+
+    def health_score(self):
+        with self._lock:
+            if self.state == OPEN:
+                return 0.0
+            error_rate, slow_rate = self._rates()
+            return round((1 - error_rate) * (1 - slow_rate / 2), 3)
+
+    def stats(self):
+        score = self.health_score()
+        retry_in = self.retry_in()
+        with self._lock:
+            error_rate, slow_rate = self._rates()
+            return {
+                'state': self.state,
+                'health_score': score,
+                'calls': len(self._calls),
+                'error_rate': round(error_rate, 3),
+                'slow_rate': round(slow_rate, 3),
+                'retry_in_s': round(retry_in, 1),
+                'last_error': self._last_error,
+                **self._stats,
+            }
@@ -0,0 +1,271 @@
+"""
+顏色和諧度模組 (Pantone 色盤)
+pipeline/02_detect_colors.py 把每件商品歸到 PANTONE_COLORS 其中一色，這裡預先算好色盤兩兩之間的搭配分數：
+
+- 中性色 (黑 / 白 / 灰 / 深藍 / 米 / 卡其 / 咖啡) 幾乎百搭
+- 有彩色依 HSV 色相差判斷：同色系 (深淺搭配看 Lab 明度差)、鄰近色、互補色、三角配色，其餘視為衝突
+- 結果是 (色數 + 1) × (色數 + 1) 的矩陣，最後一列 / 一欄給無法辨識的顏色；
+  商品索引快照存每件商品的色盤代碼，大量配對的和諧度只是一次陣列索引
+"""
+
+import colorsys
+
+import numpy as np
+
+# ==================== Pantone 色號系統 ====================
+# (02_detect_colors.py 的色號比對也使用這份色盤)
+PANTONE_COLORS = {
+    # 無彩色系
+    "黑色 (Pantone Black 6)": {"rgb": (0, 0, 0), "h_range": None, "v_max": 20},
+    "白色 (Pantone White)": {"rgb": (255, 255, 255), "h_range": None, "v_min": 90},
+    "深灰色 (Pantone Cool Gray 11)": {"rgb": (83, 86, 90), "h_range": (180, 270), "v_range": (20, 40)},
+    "灰色 (Pantone Cool Gray 8)": {"rgb": (147, 149, 152), "h_range": (180, 270), "v_range": (40, 65)},
+    "淺灰色 (Pantone Cool Gray 3)": {"rgb": (200, 201, 202), "h_range": (180, 270), "v_range": (65, 90)},
+
+    # 藍色系 (H: 180-240)
+    "深藍色 (Pantone 2767 C)": {"rgb": (13, 36, 107), "h_range": (200, 240)},
+    "藍色 (Pantone 2945 C)": {"rgb": (0, 102, 179), "h_range": (190, 220)},
+    "淺藍色 (Pantone 283 C)": {"rgb": (155, 194, 230), "h_range": (180, 210)},
+
+    # 綠色系 (H: 80-180)
+    "深綠色 (Pantone 3308 C)": {"rgb": (0, 86, 63), "h_range": (130, 160)},
+    "綠色 (Pantone 355 C)": {"rgb": (0, 135, 68), "h_range": (120, 180)},
+    "淺綠色 (Pantone 351 C)": {"rgb": (175, 215, 145), "h_range": (80, 130)},
+
+    # 紅色系 (H: 330-30)
+    "正紅色 (Pantone 186 C)": {"rgb": (200, 16, 46), "h_range": (350, 10)},
+    "深紅色 (Pantone 1815 C)": {"rgb": (135, 0, 35), "h_range": (340, 0)},
+    "粉紅色 (Pantone 189 C)": {"rgb": (247, 168, 184), "h_range": (330, 360)},
+    "酒紅色 (Pantone 209 C)": {"rgb": (123, 30, 66), "h_range": (330, 350)},
+
+    # 黃色系 (H: 40-60)
+    "黃色 (Pantone 109 C)": {"rgb": (255, 209, 0), "h_range": (45, 60)},
+    "淺黃色 (Pantone 100 C)": {"rgb": (244, 223, 142), "h_range": (40, 55)},
+
+    # 橘色系 (H: 10-40)
+    "橘色 (Pantone 021 C)": {"rgb": (254, 80, 0), "h_range": (15, 35)},
+
+    # 紫色系 (H: 270-330)
+    "深紫色 (Pantone 2627 C)": {"rgb": (82, 35, 152), "h_range": (270, 290)},
+    "紫色 (Pantone 2685 C)": {"rgb": (140, 91, 170), "h_range": (280, 310)},
+    "淺紫色 (Pantone 2567 C)": {"rgb": (199, 180, 217), "h_range": (270, 300)},
+
+    # 棕色系 (H: 20-40, 低飽和度)
+    "深咖啡色 (Pantone 476 C)": {"rgb": (75, 56, 42), "h_range": (20, 40), "s_max": 50},
+    "咖啡色 (Pantone 4625 C)": {"rgb": (120, 94, 74), "h_range": (20, 40)},
+    "米色 (Pantone 468 C)": {"rgb": (214, 196, 166), "h_range": (30, 50), "s_max": 40},
+    "卡其色 (Pantone 7502 C)": {"rgb": (164, 143, 110), "h_range": (30, 50)},
+}
+
+PALETTE_NAMES = list(PANTONE_COLORS)
+# 色名 (去掉括號內的色號)，例如 "深藍色"
+PALETTE_BASE_NAMES = [name.split(' (')[0] for name in PALETTE_NAMES]
+
+# 當作中性色處理 (搭什麼都不太會出錯)
+NEUTRAL_NAMES = {'黑色', '白色', '深灰色', '灰色', '淺灰色', '深藍色', '米色', '卡其色', '深咖啡色', '咖啡色'}
+
+UNKNOWN_SCORE = 0.6
+
+# 資料中常見、但不是色盤色名的寫法
+COLOR_ALIASES = {
+    '紅色': '正紅色',
+    '海軍藍': '深藍色',
+    '丹寧': '藍色',
+    '棕色': '咖啡色',
+    '駝色': '卡其色',
+    '奶油色': '米色',
+}
+
+# 英文色名 (dataset/items_fashion_small_clean.csv 等 Kaggle 目錄的 color 欄)，比對時不分大小寫
+ENGLISH_COLOR_ALIASES = {
+    'black': '黑色',
+    'white': '白色',
+    'off white': '白色',
+    'charcoal': '深灰色',
+    'dark grey': '深灰色',
+    'dark gray': '深灰色',
+    'grey': '灰色',
+    'gray': '灰色',
+    'grey melange': '灰色',
+    'steel': '灰色',
+    'light grey': '淺灰色',
+    'light gray': '淺灰色',
+    'silver': '淺灰色',
+    'navy blue': '深藍色',
+    'navy': '深藍色',
+    'dark blue': '深藍色',
+    'blue': '藍色',
+    'denim': '藍色',
+    'light blue': '淺藍色',
+    'turquoise blue': '淺藍色',
+    'turquoise': '淺藍色',
+    'sky blue': '淺藍色',
+    'olive': '深綠色',
+    'dark green': '深綠色',
+    'green': '綠色',
+    'sea green': '綠色',
+    'teal': '綠色',
+    'lime green': '淺綠色',
+    'light green': '淺綠色',
+    'mint': '淺綠色',
+    'red': '正紅色',
+    'maroon': '深紅色',
+    'burgundy': '酒紅色',
+    'wine': '酒紅色',
+    'pink': '粉紅色',
+    'rose': '粉紅色',
+    'peach': '粉紅色',
+    'yellow': '黃色',
+    'gold': '黃色',
+    'mustard': '黃色',
+    'light yellow': '淺黃色',
+    'orange': '橘色',
+    'rust': '橘色',
+    'purple': '紫色',
+    'magenta': '紫色',
+    'lavender': '淺紫色',
+    'mauve': '淺紫色',
+    'brown': '咖啡色',
+    'coffee brown': '咖啡色',
+    'copper': '咖啡色',
+    'bronze': '咖啡色',
+    'dark brown': '深咖啡色',
+    'beige': '米色',
+    'cream': '米色',
+    'skin': '米色',
+    'nude': '米色',
+    'khaki': '卡其色',
+    'tan': '卡其色',
+    'taupe': '卡其色',
+    'mushroom brown': '卡其色',
+    'camel': '卡其色',
+}
+
+
+# =======================
+# 色彩空間轉換
+# =======================
+def rgb_to_lab(rgb):
+    """sRGB (0-255) -> CIE Lab (D65)，可一次轉換多個顏色"""
+    c = np.asarray(rgb, dtype=np.float64) / 255.0
+    c = np.where(c > 0.04045, ((c + 0.055) / 1.055) ** 2.4, c / 12.92)
+    m = np.array([[0.4124564, 0.3575761, 0.1804375],
+                  [0.2126729, 0.7151522, 0.0721750],
+                  [0.0193339, 0.1191920, 0.9503041]])
+    xyz = c @ m.T / np.array([0.95047, 1.0, 1.08883])
+    f = np.where(xyz > 216 / 24389, np.cbrt(xyz), (24389 / 27 * xyz + 16) / 116)
+    return np.stack([116 * f[..., 1] - 16,
+                     500 * (f[..., 0] - f[..., 1]),
+                     200 * (f[..., 1] - f[..., 2])], axis=-1)
+
+
+# =======================
+# 兩色搭配分數
+# =======================
+def _pair_score(i, j, hsv, lab):
+    a, b = PALETTE_BASE_NAMES[i], PALETTE_BASE_NAMES[j]
+    a_neutral, b_neutral = a in NEUTRAL_NAMES, b in NEUTRAL_NAMES
+    light_diff = abs(lab[i][0] - lab[j][0])
+
+    if a_neutral and b_neutral:
+        # 中性色互搭：明度差越大層次越清楚 (黑 × 白最經典)
+        return 0.8 + 0.15 * min(light_diff / 100, 1.0)
+    if a_neutral or b_neutral:
+        return 0.9
+
+    hue_diff = abs(hsv[i][0] - hsv[j][0]) * 360
+    hue_diff = min(hue_diff, 360 - hue_diff)
+    if hue_diff < 15:
+        # 同色系：深淺搭配比兩件一樣的顏色好看
+        return 0.6 + 0.2 * min(light_diff / 40, 1.0)
+    if hue_diff <= 45:
+        return 0.8    # 鄰近色
+    if hue_diff >= 150:
+        return 0.7    # 互補色
+    if 105 <= hue_diff <= 135:
+        return 0.6    # 三角配色
+    return 0.3        # 色相衝突
+
+
+def build_harmony_matrix():
+    """色盤兩兩之間的搭配分數 (對稱矩陣，最後一列 / 一欄為未知顏色)"""
+    rgb = [PANTONE_COLORS[name]['rgb'] for name in PALETTE_NAMES]
+    hsv = [colorsys.rgb_to_hsv(r / 255, g / 255, b / 255) for r, g, b in rgb]
+    lab = rgb_to_lab(rgb)
+    n = len(PALETTE_NAMES)
+    matrix = np.full((n + 1, n + 1), UNKNOWN_SCORE, dtype=np.float32)
+    for i in range(n):
+        for j in range(n):
+            matrix[i, j] = _pair_score(i, j, hsv, lab)
+    return matrix
+
+
+# 模組載入時預先計算一次 (25 色，極小)
+HARMONY_MATRIX = build_harmony_matrix()
+UNKNOWN = -1  # 未知顏色的色盤代碼 (對應矩陣最後一列)
+
+
+# =======================
+# 查詢 API
+# =======================
+# 長的色名先比對，避免「深藍色」被當成「藍色」
+_BY_LENGTH = sorted(range(len(PALETTE_NAMES)), key=lambda i: -len(PALETTE_BASE_NAMES[i]))
+
+
+def palette_index(color):
+    """
+    商品顏色字串 -> 色盤代碼 (無法辨識回傳 UNKNOWN)
+    接受完整名稱 "白色 (Pantone White)"、色名 "白色"、包含色名的字串 "白色系"，
+    或英文色名 "Navy Blue" (沒有整個對到時，由最後一個字往前逐字比對，例如 "Dark Olive" -> olive)
+    """
+    if not color:
+        return UNKNOWN
+    color = color.strip()
+    if color in PANTONE_COLORS:
+        return PALETTE_NAMES.index(color)
+    base = color.split(' (')[0]
+    code = _match_base(base)
+    if code == UNKNOWN:
+        for alias, name in COLOR_ALIASES.items():
+            if alias in base:
+                return _match_base(name)
+        code = _match_english(base)
+    return code
+
+
+def _match_english(base):
+    words = base.lower().replace('-', ' ').replace('/', ' ').split()
+    name = ENGLISH_COLOR_ALIASES.get(' '.join(words))
+    if name is None:
+        name = next((ENGLISH_COLOR_ALIASES[w] for w in reversed(words) if w in ENGLISH_COLOR_ALIASES), None)
+    return UNKNOWN if name is None else _match_base(name)
+
+
+def _match_base(base):
+    for i in _BY_LENGTH:
+        name = PALETTE_BASE_NAMES[i]
+        if base == name or name in base or name.rstrip('色') == base:
+            return i
+    return UNKNOWN
+
+
+def palette_codes(colors):
+    """多個顏色字串 -> 色盤代碼陣列 (np.int16)"""
+    return np.fromiter((palette_index(c) for c in colors), dtype=np.int16, count=len(colors))
+
+
+def harmony(codes_a, codes_b):
+    """
+    兩組色盤代碼的搭配分數矩陣 (len(a) × len(b))，只做一次陣列索引
+
+    Args:
+        codes_a / codes_b: 色盤代碼陣列 (UNKNOWN 可)
+    """
+    a = np.asarray(codes_a)
+    b = np.asarray(codes_b)
+    return HARMONY_MATRIX[a[:, None], b[None, :]]
+
+
+def harmony_score(color_a, color_b):
+    """兩個顏色字串的搭配分數"""
+    return float(HARMONY_MATRIX[palette_index(color_a), palette_index(color_b)])
@@ -0,0 +1,263 @@
+"""
+資料庫連線池模組
+所有 get_db_conn() 呼叫點共用的 PyMySQL 連線池
+
+- 每個 worker 行程一個池，大小有上限 (DB_POOL_SIZE)
+- 借出時做健康檢查 (閒置過久就 ping 一次)
+- 歸還/借出時順便回收閒置過久的連線
+- 記錄等待時間等統計，供 /ping 健康檢查輸出
+"""
+
+import os
+import sys
+import time
+import threading
+from collections import deque
+
+import pymysql
+
+# =======================
+# 環境設定
+# =======================
+DB_HOST = os.getenv('DB_HOST', 'mysql')
+DB_PORT = int(os.getenv('DB_PORT', '3306'))
+DB_USER = os.getenv('DB_USER', 'root')
+DB_PASS = os.getenv('DB_PASS', 'rootpassword')
+DB_NAME = os.getenv('DB_NAME', 'outfit_db')
+
+DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', '5'))                      # 每個 worker 最多幾條連線
+DB_POOL_TIMEOUT = float(os.getenv('DB_POOL_TIMEOUT', '10'))             # 池滿時最多等幾秒
+DB_POOL_IDLE_TIMEOUT = float(os.getenv('DB_POOL_IDLE_TIMEOUT', '300'))  # 閒置超過幾秒就回收
+DB_POOL_PING_AFTER = float(os.getenv('DB_POOL_PING_AFTER', '30'))       # 閒置超過幾秒借出前先 ping
+
+
+class PoolTimeout(Exception):
+    """等待連線逾時 (池內連線全部被借出)"""
+
+
+def _connect():
+    """建立一條新的資料庫連線"""
+    return pymysql.connect(
+        host=DB_HOST,
+        port=DB_PORT,
+        user=DB_USER,
+        password=DB_PASS,
+        db=DB_NAME,
+        charset='utf8mb4',
+        cursorclass=pymysql.cursors.DictCursor,
+        use_unicode=True,
+        autocommit=True  # 避免連線重複使用時讀到舊的交易快照
+    )
+
+
+class PooledConnection:
+    """
+    借出的連線包裝
+    用法與原本的 pymysql 連線相同，close() 時歸還給池而不是真的關閉
+    """
+
+    def __init__(self, pool, conn):
+        self._pool = pool
+        self._conn = conn
+        self._broken = False
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+    def discard(self):
+        """標記為損壞，歸還時直接關閉不放回池中"""
+        self._broken = True
+
+    def close(self):
+        if self._conn is None:
+            return
+        conn, self._conn = self._conn, None
+        self._pool._release(conn, broken=self._broken)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None and issubclass(exc_type, pymysql.err.OperationalError):
+            self._broken = True
+        self.close()
+
+
+class ConnectionPool:
+    """有上限的連線池 (gevent 環境下 threading 會被 monkey-patch，等待為協作式)"""
+
+    def __init__(self, connect=_connect, max_size=DB_POOL_SIZE, timeout=DB_POOL_TIMEOUT,
+                 idle_timeout=DB_POOL_IDLE_TIMEOUT, ping_after=DB_POOL_PING_AFTER):
+        self._connect = connect
+        self.max_size = max_size
+        self.timeout = timeout
+        self.idle_timeout = idle_timeout
+        self.ping_after = ping_after
+
+        self._cond = threading.Condition()
+        self._idle = deque()  # (conn, 歸還時間)
+        self._size = 0        # 已建立 (含借出中) 的連線數
+
+        # 統計
+        self._stats = {
+            'checkouts': 0,
+            'created': 0,
+            'reaped': 0,
+            'failed_health_checks': 0,
+            'timeouts': 0,
+            'wait_time_total_ms': 0.0,
+            'wait_time_max_ms': 0.0,
+        }
+
+    # -----------------------
+    # 借出 / 歸還
+    # -----------------------
+    def get_connection(self):
+        """借出一條連線；池滿時等待，超過 timeout 拋出 PoolTimeout"""
+        start = time.monotonic()
+        deadline = start + self.timeout
+        conn = None
+
+        with self._cond:
+            self._reap_idle_locked()
+            while True:
+                if self._idle:
+                    conn, released_at = self._idle.pop()  # LIFO：優先用最熱的連線
+                    break
+                if self._size < self.max_size:
+                    self._size += 1
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._stats['timeouts'] += 1
+                    raise PoolTimeout(f"等待資料庫連線超過 {self.timeout} 秒 (pool size={self.max_size})")
+                self._cond.wait(remaining)
+
+            waited_ms = (time.monotonic() - start) * 1000
+            self._stats['checkouts'] += 1
+            self._stats['wait_time_total_ms'] += waited_ms
+            self._stats['wait_time_max_ms'] = max(self._stats['wait_time_max_ms'], waited_ms)
+
+        # 網路 I/O 不在鎖內進行
+        if conn is not None and time.monotonic() - released_at > self.ping_after:
+            conn = self._health_check(conn)
+        if conn is None:
+            conn = self._new_connection()
+
+        return PooledConnection(self, conn)
+
+    def _health_check(self, conn):
+        """閒置過久的連線先 ping，失敗就丟掉重建"""
+        try:
+            conn.ping(reconnect=False)
+            return conn
+        except Exception:
+            with self._cond:
+                self._stats['failed_health_checks'] += 1
+            self._close_quietly(conn)
+            return None
+
+    def _new_connection(self):
+        try:
+            conn = self._connect()
+        except Exception:
+            # 建立失敗要把名額還回去
+            with self._cond:
+                self._size -= 1
+                self._cond.notify()
+            raise
+        with self._cond:
+            self._stats['created'] += 1
+        return conn
+
+    def _release(self, conn, broken=False):
+        if broken or not conn.open:
+            self._close_quietly(conn)
+            with self._cond:
+                self._size -= 1
+                self._cond.notify()
+            return
+
+        with self._cond:
+            self._idle.append((conn, time.monotonic()))
+            self._reap_idle_locked()
+            self._cond.notify()
+
+    # -----------------------
+    # 閒置回收
+    # -----------------------
+    def _reap_idle_locked(self):
+        """回收閒置超過 idle_timeout 的連線 (呼叫端需持有鎖)"""
+        now = time.monotonic()
+        # deque 左邊是最久沒用的連線
+        while self._idle and now - self._idle[0][1] > self.idle_timeout:
+            conn, _ = self._idle.popleft()
+            self._size -= 1
+            self._stats['reaped'] += 1
+            self._close_quietly(conn)
+
+    @staticmethod
+    def _close_quietly(conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def close_all(self):
+        """關閉所有閒置連線 (借出中的連線歸還時照常處理)"""
+        with self._cond:
+            while self._idle:
+                conn, _ = self._idle.popleft()
+                self._size -= 1
+                self._close_quietly(conn)
+
+    # -----------------------
+    # 統計
+    # -----------------------
+    def stats(self):
+        with self._cond:
+            checkouts = self._stats['checkouts']
+            return {
+                'max_size': self.max_size,
+                'size': self._size,
+                'idle': len(self._idle),
+                'in_use': self._size - len(self._idle),
+                'checkouts': checkouts,
+                'created': self._stats['created'],
+                'reaped': self._stats['reaped'],
+                'failed_health_checks': self._stats['failed_health_checks'],
+                'timeouts': self._stats['timeouts'],
+                'wait_time_avg_ms': round(self._stats['wait_time_total_ms'] / checkouts, 3) if checkouts else 0.0,
+                'wait_time_max_ms': round(self._stats['wait_time_max_ms'], 3),
+            }
+
+
+# =======================
+# 每個 worker 一個池
+# =======================
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    """取得目前行程的連線池 (gunicorn fork 後會自動重建，不共用父行程的 socket)"""
+    global _pool, _pool_pid
+    pid = os.getpid()
+    if _pool is None or _pool_pid != pid:
+        with _pool_lock:
+            if _pool is None or _pool_pid != pid:
+                _pool = ConnectionPool()
+                _pool_pid = pid
+                print(f"✅ 資料庫連線池已建立 (pid={pid}, size={DB_POOL_SIZE})", flush=True, file=sys.stderr)
+    return _pool
+
+
+def get_db_conn():
+    """從連線池借出連線；用完照舊呼叫 conn.close() 即可歸還"""
+    return get_pool().get_connection()
+
+
+def pool_stats():
+    """連線池統計 (給健康檢查用)"""
+    return get_pool().stats()
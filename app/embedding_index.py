@@ -0,0 +1,344 @@
+"""
+語意檢索模組 (本機向量索引)
+使用者沒有輸入九個場合關鍵字時，不必退回隨機推薦：
+
+- 商品文字 (name / color / clothing_type / category) 以 char n-gram 雜湊 + TF-IDF 轉成向量
+  (純 CPU、不需下載模型，離線與線上用同一套設定，結果一致)
+- 離線 (pipeline/07_build_embeddings.py) 算好後存成 .npy，worker 以 mmap 方式載入，多個 worker 共用分頁快取
+- 查詢 = 一次矩陣乘法 + argpartition 取 top-k；
+  商品數超過 EMBEDDING_ANN_THRESHOLD 時另建 IVF 分群索引，只掃最接近的幾群
+- 索引目錄以 CURRENT 檔指向最新版本，重建時不會讀到寫一半的檔案
+"""
+
+import os
+import sys
+import json
+import math
+import time
+import zlib
+import shutil
+import threading
+
+import numpy as np
+
+EMBEDDING_DIR = os.getenv('EMBEDDING_DIR', '/app/data/embeddings')
+EMBEDDING_DIM = int(os.getenv('EMBEDDING_DIM', '256'))
+# 商品數超過此值才建立 IVF 分群索引 (0 表示不建立)
+EMBEDDING_ANN_THRESHOLD = int(os.getenv('EMBEDDING_ANN_THRESHOLD', '20000'))
+EMBEDDING_ANN_PROBES = int(os.getenv('EMBEDDING_ANN_PROBES', '8'))       # 查詢時掃幾群
+EMBEDDING_MIN_SCORE = float(os.getenv('EMBEDDING_MIN_SCORE', '0.1'))     # 餘弦相似度低於此值不採用
+EMBEDDING_RELOAD_INTERVAL = float(os.getenv('EMBEDDING_RELOAD_INTERVAL', '30'))
+
+ITEM_TEXT_FIELDS = ('name', 'color', 'clothing_type', 'category')
+# category 是英文代碼，轉成中文才能和使用者的問句比對
+CATEGORY_LABELS = {
+    'top': '上衣',
+    'bottom': '下身 褲子 裙子',
+    'outer': '外套',
+    'shoes': '鞋子',
+    'accessory': '配件',
+}
+NGRAM_RANGE = (1, 3)
+KEEP_VERSIONS = 2
+
+
+# =======================
+# 向量化
+# =======================
+def item_text(row):
+    """商品 -> 要向量化的文字"""
+    parts = []
+    for field in ITEM_TEXT_FIELDS:
+        value = row.get(field)
+        if not value:
+            continue
+        parts.append(CATEGORY_LABELS.get(value, value) if field == 'category' else str(value))
+    return ' '.join(parts)
+
+
+class HashingVectorizer:
+    """char n-gram 雜湊向量化 (crc32，跨行程穩定；正負號避免雜湊碰撞互相累加)"""
+
+    def __init__(self, dim=EMBEDDING_DIM, ngram_range=NGRAM_RANGE):
+        self.dim = dim
+        self.ngram_range = tuple(ngram_range)
+
+    def _features(self, text):
+        text = ' '.join(text.casefold().split())
+        lo, hi = self.ngram_range
+        for n in range(lo, hi + 1):
+            for i in range(len(text) - n + 1):
+                gram = text[i:i + n]
+                if gram.isspace():
+                    continue
+                h = zlib.crc32(gram.encode('utf-8'))
+                yield h % self.dim, 1.0 if (h >> 31) & 1 == 0 else -1.0
+
+    def counts(self, texts):
+        """詞頻矩陣 (N × dim，float32)"""
+        matrix = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for col, sign in self._features(text or ''):
+                matrix[row, col] += sign
+        return matrix
+
+    @staticmethod
+    def fit_idf(counts):
+        """平滑 IDF：log((1 + N) / (1 + df)) + 1"""
+        df = np.count_nonzero(counts, axis=0)
+        return (np.log((1 + len(counts)) / (1 + df)) + 1).astype(np.float32)
+
+    @staticmethod
+    def weight(counts, idf):
+        """次線性詞頻 × IDF，再 L2 正規化 (之後內積即餘弦相似度)"""
+        weighted = np.sign(counts) * np.log1p(np.abs(counts)) * idf
+        norms = np.linalg.norm(weighted, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return (weighted / norms).astype(np.float32)
+
+    def transform(self, texts, idf):
+        return self.weight(self.counts(texts), idf)
+
+
+# =======================
+# IVF 分群索引 (大型目錄用)
+# =======================
+def _train_ivf(vectors, n_lists, iterations=10, sample=20000, seed=0):
+    """球面 k-means，回傳 (群中心, 每列所屬群)"""
+    rng = np.random.default_rng(seed)
+    train = vectors[rng.choice(len(vectors), min(sample, len(vectors)), replace=False)]
+    centroids = train[rng.choice(len(train), n_lists, replace=False)].copy()
+    for _ in range(iterations):
+        assign = np.argmax(train @ centroids.T, axis=1)
+        for c in range(n_lists):
+            members = train[assign == c]
+            if len(members):
+                centroids[c] = members.sum(axis=0)
+        norms = np.linalg.norm(centroids, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        centroids /= norms
+    return centroids, np.argmax(vectors @ centroids.T, axis=1)
+
+
+def _topk(scores, k):
+    """分數最高的 k 個位置 (由高到低)"""
+    k = min(k, len(scores))
+    if k <= 0:
+        return np.empty(0, dtype=np.int64)
+    part = np.argpartition(-scores, k - 1)[:k]
+    return part[np.argsort(-scores[part], kind='stable')]
+
+
+# =======================
+# 索引
+# =======================
+class EmbeddingIndex:
+    """商品向量索引 (建好後唯讀)"""
+
+    def __init__(self, ids, vectors, idf, vectorizer, catalog_version=None,
+                 centroids=None, list_offsets=None):
+        self.ids = ids                    # np.int64 (有 IVF 時依分群排序)
+        self.vectors = vectors            # float32 N × dim，已正規化
+        self.idf = idf
+        self.vectorizer = vectorizer
+        self.catalog_version = catalog_version
+        self.centroids = centroids        # IVF 群中心 (沒有 IVF 時為 None)
+        self.list_offsets = list_offsets  # 第 c 群為 vectors[offsets[c]:offsets[c + 1]]
+
+    def __len__(self):
+        return len(self.ids)
+
+    @classmethod
+    def build(cls, rows, dim=EMBEDDING_DIM, ann_threshold=EMBEDDING_ANN_THRESHOLD, catalog_version=None):
+        """由 items 的列建立索引"""
+        vectorizer = HashingVectorizer(dim)
+        counts = vectorizer.counts([item_text(r) for r in rows])
+        idf = vectorizer.fit_idf(counts)
+        vectors = vectorizer.weight(counts, idf)
+        ids = np.fromiter((r['id'] for r in rows), dtype=np.int64, count=len(rows))
+
+        centroids = offsets = None
+        if ann_threshold and len(rows) > ann_threshold:
+            n_lists = max(1, int(math.sqrt(len(rows))))
+            centroids, assign = _train_ivf(vectors, n_lists)
+            order = np.argsort(assign, kind='stable')
+            ids, vectors = ids[order], vectors[order]
+            offsets = np.searchsorted(assign[order], np.arange(n_lists + 1)).astype(np.int64)
+        return cls(ids, vectors, idf, vectorizer, catalog_version, centroids, offsets)
+
+    def search(self, text, k=10, min_score=EMBEDDING_MIN_SCORE, probes=EMBEDDING_ANN_PROBES):
+        """
+        回傳與 text 最相似的 [(item_id, 分數), ...] (由高到低)
+        """
+        query = self.vectorizer.transform([text], self.idf)[0]
+        if not query.any() or not len(self):
+            return []
+        if self.centroids is not None:
+            lists = _topk(self.centroids @ query, probes)
+            rows = np.concatenate([np.arange(self.list_offsets[c], self.list_offsets[c + 1]) for c in lists])
+            scores = self.vectors[rows] @ query
+            best = _topk(scores, k)
+            positions, scores = rows[best], scores[best]
+        else:
+            scores = self.vectors @ query
+            positions = _topk(scores, k)
+            scores = scores[positions]
+        keep = scores >= min_score
+        return [(int(i), float(s)) for i, s in zip(self.ids[positions[keep]], scores[keep])]
+
+    # -----------------------
+    # 存檔 / 載入
+    # -----------------------
+    def save(self, directory=EMBEDDING_DIR):
+        """寫到新的版本子目錄，最後才更新 CURRENT (原子替換)"""
+        name = f"v{int(time.time() * 1000)}"
+        target = os.path.join(directory, name)
+        os.makedirs(target, exist_ok=True)
+        np.save(os.path.join(target, 'ids.npy'), self.ids)
+        np.save(os.path.join(target, 'vectors.npy'), np.ascontiguousarray(self.vectors))
+        np.save(os.path.join(target, 'idf.npy'), self.idf)
+        if self.centroids is not None:
+            np.save(os.path.join(target, 'centroids.npy'), self.centroids)
+            np.save(os.path.join(target, 'list_offsets.npy'), self.list_offsets)
+        with open(os.path.join(target, 'meta.json'), 'w', encoding='utf-8') as f:
+            json.dump({
+                'dim': self.vectorizer.dim,
+                'ngram_range': list(self.vectorizer.ngram_range),
+                'count': len(self),
+                'catalog_version': self.catalog_version,
+                'ivf_lists': None if self.centroids is None else len(self.centroids),
+            }, f, ensure_ascii=False)
+
+        tmp = os.path.join(directory, 'CURRENT.tmp')
+        with open(tmp, 'w') as f:
+            f.write(name)
+        os.replace(tmp, os.path.join(directory, 'CURRENT'))
+        _remove_old_versions(directory, keep=KEEP_VERSIONS)
+        return target
+
+    @classmethod
+    def load(cls, directory=EMBEDDING_DIR):
+        """載入 CURRENT 指向的版本 (向量矩陣以 mmap 唯讀開啟)"""
+        with open(os.path.join(directory, 'CURRENT')) as f:
+            target = os.path.join(directory, f.read().strip())
+        with open(os.path.join(target, 'meta.json'), encoding='utf-8') as f:
+            meta = json.load(f)
+        centroids = offsets = None
+        if meta.get('ivf_lists'):
+            centroids = np.load(os.path.join(target, 'centroids.npy'))
+            offsets = np.load(os.path.join(target, 'list_offsets.npy'))
+        return cls(np.load(os.path.join(target, 'ids.npy')),
+                   np.load(os.path.join(target, 'vectors.npy'), mmap_mode='r'),
+                   np.load(os.path.join(target, 'idf.npy')),
+                   HashingVectorizer(meta['dim'], meta['ngram_range']),
+                   meta.get('catalog_version'), centroids, offsets)
+
+
+def _remove_old_versions(directory, keep):
+    versions = sorted(d for d in os.listdir(directory)
+                      if d.startswith('v') and os.path.isdir(os.path.join(directory, d)))
+    for old in versions[:-keep]:
+        shutil.rmtree(os.path.join(directory, old), ignore_errors=True)
+
+
+def build_from_db(conn, directory=EMBEDDING_DIR, dim=EMBEDDING_DIM):
+    """讀取 items 建立索引並存檔，回傳索引"""
+    with conn.cursor() as cur:
+        cur.execute(f"SELECT id, {', '.join(ITEM_TEXT_FIELDS)} FROM items ORDER BY id")
+        rows = cur.fetchall()
+        try:
+            cur.execute("SELECT version FROM catalog_meta WHERE name = 'items'")
+            meta = cur.fetchone()
+        except Exception:
+            meta = None
+    index = EmbeddingIndex.build(rows, dim, catalog_version=meta['version'] if meta else None)
+    index.save(directory)
+    return index
+
+
+# =======================
+# 線上讀取
+# =======================
+class SemanticRetriever:
+    """每個 worker 一份；CURRENT 改變時自動重新載入，沒有索引時 search 回傳空列表"""
+
+    def __init__(self, directory=EMBEDDING_DIR, reload_interval=EMBEDDING_RELOAD_INTERVAL):
+        self.directory = directory
+        self.reload_interval = reload_interval
+        self._index = None
+        self._current = None
+        self._last_check = 0.0
+        self._lock = threading.Lock()
+        self._stats = {'queries': 0, 'empty': 0, 'reloads': 0, 'total_ms': 0.0}
+        self._status = 'missing'   # ok / missing / load_failed
+        self._error = None
+
+    def _refresh(self):
+        if time.monotonic() - self._last_check < self.reload_interval:
+            return
+        with self._lock:
+            if time.monotonic() - self._last_check < self.reload_interval:
+                return
+            self._last_check = time.monotonic()
+            try:
+                with open(os.path.join(self.directory, 'CURRENT')) as f:
+                    current = f.read().strip()
+            except OSError:
+                # 還沒建立索引 (或目錄沒有掛進容器)：只在第一次提示
+                if self._index is None and self._error is None:
+                    self._error = f"{self.directory} 沒有語意索引，請執行 pipeline/07_build_embeddings.py"
+                    print(f"⚠️ {self._error}", flush=True, file=sys.stderr)
+                return
+            if current == self._current:
+                return
+            try:
+                self._index = EmbeddingIndex.load(self.directory)
+                self._current = current
+                self._stats['reloads'] += 1
+                self._status, self._error = 'ok', None
+                print(f"🧭 語意索引已載入 ({len(self._index)} 件, {current})", flush=True, file=sys.stderr)
+            except Exception as e:
+                if self._index is None:
+                    self._status = 'load_failed'
+                self._error = f"語意索引載入失敗: {e}"
+                print(f"⚠️ {self._error}", flush=True, file=sys.stderr)
+
+    @property
+    def available(self):
+        self._refresh()
+        return self._index is not None
+
+    def search(self, text, k=10):
+        """回傳 [(item_id, 分數), ...]"""
+        self._refresh()
+        index = self._index
+        if index is None or not text:
+            return []
+        started = time.monotonic()
+        results = index.search(text, k)
+        with self._lock:
+            self._stats['queries'] += 1
+            self._stats['total_ms'] += (time.monotonic() - started) * 1000
+            if not results:
+                self._stats['empty'] += 1
+        return results
+
+    def stats(self):
+        self._refresh()
+        index = self._index
+        with self._lock:
+            queries = self._stats['queries']
+            return {
+                'status': self._status,
+                'error': self._error,
+                'directory': self.directory,
+                'loaded': index is not None,
+                'version': self._current,
+                'items': len(index) if index is not None else 0,
+                'ivf': index is not None and index.centroids is not None,
+                'catalog_version': index.catalog_version if index is not None else None,
+                'queries': queries,
+                'empty': self._stats['empty'],
+                'reloads': self._stats['reloads'],
+                'avg_ms': round(self._stats['total_ms'] / queries, 3) if queries else 0.0,
+            }
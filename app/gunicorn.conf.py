@@ -0,0 +1,16 @@
+"""
+gunicorn 設定 (Dockerfile 的 CMD 以 --config 載入；其餘參數仍由命令列指定)
+多 worker 的指標合併 (METRICS_DIR) 需要 master 在 worker 結束時封存它的數值，見 metrics.mark_process_dead
+"""
+
+from metrics import clear_metrics_dir, mark_process_dead
+
+
+def on_starting(server):
+    # 重新啟動 gunicorn：計數從 0 開始，不沿用上一次執行的 worker 檔案
+    clear_metrics_dir()
+
+
+def child_exit(server, worker):
+    # worker 被重啟 (timeout / max_requests) 或結束：數值併入 archive.json，PID 之後被重用也不會互相覆蓋
+    mark_process_dead(worker.pid)
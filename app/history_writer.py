@@ -0,0 +1,202 @@
+"""
+對話記錄背景批次寫入模組 (write-behind)
+對話記錄不必在請求中同步寫入資料庫：
+
+- chat 完成後只把這一輪放進記憶體佇列，立即返回
+- 背景執行緒累積到 HISTORY_BATCH_SIZE 筆、或距上次寫入超過 HISTORY_FLUSH_INTERVAL 秒，
+  就用一次多列 INSERT 寫入 conversation_history
+- 佇列有上限，滿了依 HISTORY_BACKPRESSURE 處理：
+    block:       等待空位 (最多 HISTORY_BLOCK_TIMEOUT 秒，仍滿就丟棄並計數)
+    drop_oldest: 丟掉最舊的一筆
+    sync:        直接在請求中同步寫入
+- 寫入失敗會保留批次重試；程序結束時 (atexit) 會把剩下的寫完
+"""
+
+import os
+import sys
+import time
+import atexit
+import threading
+from collections import deque
+
+HISTORY_BATCH_SIZE = int(os.getenv('HISTORY_BATCH_SIZE', '50'))
+HISTORY_FLUSH_INTERVAL = float(os.getenv('HISTORY_FLUSH_INTERVAL', '1'))
+HISTORY_QUEUE_SIZE = int(os.getenv('HISTORY_QUEUE_SIZE', '5000'))
+HISTORY_BACKPRESSURE = os.getenv('HISTORY_BACKPRESSURE', 'block')       # block / drop_oldest / sync
+HISTORY_BLOCK_TIMEOUT = float(os.getenv('HISTORY_BLOCK_TIMEOUT', '2'))
+HISTORY_MAX_RETRIES = int(os.getenv('HISTORY_MAX_RETRIES', '5'))
+
+BACKPRESSURE_POLICIES = ('block', 'drop_oldest', 'sync')
+
+
+class WriteBehindWriter:
+    """
+    背景批次寫入器
+
+    Args:
+        sink: 需提供 append_many([(session_id, turn), ...])，例如 MySQLSessionStore
+    """
+
+    def __init__(self, sink, batch_size=HISTORY_BATCH_SIZE, flush_interval=HISTORY_FLUSH_INTERVAL,
+                 max_queue=HISTORY_QUEUE_SIZE, policy=HISTORY_BACKPRESSURE,
+                 block_timeout=HISTORY_BLOCK_TIMEOUT, max_retries=HISTORY_MAX_RETRIES):
+        if policy not in BACKPRESSURE_POLICIES:
+            print(f"⚠️ 未知的 HISTORY_BACKPRESSURE={policy}，改用 block", flush=True, file=sys.stderr)
+            policy = 'block'
+        self.sink = sink
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_queue = max_queue
+        self.policy = policy
+        self.block_timeout = block_timeout
+        self.max_retries = max_retries
+
+        self._queue = deque()
+        self._in_flight = []          # 正在寫入的批次 (供 pending_for 讀取)
+        self._cond = threading.Condition()
+        self._closed = False
+        self._flush_requested = False
+        self._stats = {'submitted': 0, 'written': 0, 'batches': 0, 'dropped': 0,
+                       'sync_writes': 0, 'errors': 0, 'last_batch_ms': 0.0}
+
+        self._thread = threading.Thread(target=self._run, name='history-writer', daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    # -----------------------
+    # 寫入端 (請求執行緒)
+    # -----------------------
+    def submit(self, session_id, turn):
+        """放進佇列；佇列滿時依 back-pressure 政策處理"""
+        entry = (session_id, turn)
+        sync = False
+        with self._cond:
+            self._stats['submitted'] += 1
+            if self._closed:
+                self._stats['sync_writes'] += 1
+                sync = True
+            elif len(self._queue) < self.max_queue:
+                self._enqueue(entry)
+                return
+            elif self.policy == 'drop_oldest':
+                self._queue.popleft()
+                self._stats['dropped'] += 1
+                self._enqueue(entry)
+                return
+            elif self.policy == 'block':
+                deadline = time.monotonic() + self.block_timeout
+                while len(self._queue) >= self.max_queue and not self._closed:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._stats['dropped'] += 1
+                        print("⚠️ 對話記錄佇列已滿，丟棄一筆", flush=True, file=sys.stderr)
+                        return
+                    self._cond.wait(remaining)
+                self._enqueue(entry)
+                return
+            else:
+                self._stats['sync_writes'] += 1
+                sync = True
+        if sync:
+            self.sink.append_many([entry])
+
+    def _enqueue(self, entry):
+        self._queue.append(entry)
+        if len(self._queue) >= self.batch_size:
+            self._cond.notify_all()
+
+    def pending_for(self, session_id):
+        """尚未寫入資料庫的這個 session 的對話 (讓讀取端看得到自己剛寫的內容)"""
+        with self._cond:
+            return [turn for sid, turn in list(self._in_flight) + list(self._queue) if sid == session_id]
+
+    def flush(self, timeout=10):
+        """要求立即寫入並等待佇列清空"""
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            self._flush_requested = True
+            self._cond.notify_all()
+            while (self._queue or self._in_flight) and self._thread.is_alive():
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+        return True
+
+    def close(self, timeout=10):
+        """停止背景執行緒並寫完剩下的對話"""
+        with self._cond:
+            if self._closed:
+                return
+            self._closed = True
+            self._cond.notify_all()
+        self._thread.join(timeout)
+        if self._queue:
+            # 背景執行緒沒能寫完 (例如逾時)：最後同步寫一次
+            try:
+                self.sink.append_many(list(self._queue))
+                self._queue.clear()
+            except Exception as e:
+                print(f"⚠️ 關閉時寫入對話記錄失敗，遺失 {len(self._queue)} 筆: {e}", flush=True, file=sys.stderr)
+
+    # -----------------------
+    # 背景執行緒
+    # -----------------------
+    def _run(self):
+        retries = 0
+        while True:
+            with self._cond:
+                deadline = time.monotonic() + self.flush_interval
+                while (len(self._queue) < self.batch_size and not self._closed
+                       and not self._flush_requested):
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+                if not self._queue:
+                    self._flush_requested = False
+                    self._cond.notify_all()
+                    if self._closed:
+                        return
+                    continue
+                batch = [self._queue.popleft() for _ in range(min(len(self._queue), self.batch_size))]
+                self._in_flight = batch
+                self._cond.notify_all()  # 佇列有空位了，叫醒 block 中的寫入端
+
+            started = time.monotonic()
+            try:
+                self.sink.append_many(batch)
+            except Exception as e:
+                retries += 1
+                print(f"⚠️ 對話記錄批次寫入失敗 (第 {retries} 次): {e}", flush=True, file=sys.stderr)
+                backoff = min(5.0, 0.2 * 2 ** retries)
+                with self._cond:
+                    self._stats['errors'] += 1
+                    self._in_flight = []
+                    if retries <= self.max_retries and not self._closed:
+                        self._queue.extendleft(reversed(batch))  # 放回最前面，之後重試
+                    else:
+                        self._stats['dropped'] += len(batch)
+                        retries = 0
+                    self._cond.notify_all()
+                time.sleep(backoff)
+                continue
+
+            retries = 0
+            with self._cond:
+                self._in_flight = []
+                self._stats['written'] += len(batch)
+                self._stats['batches'] += 1
+                self._stats['last_batch_ms'] = round((time.monotonic() - started) * 1000, 2)
+                if not self._queue:
+                    self._flush_requested = False
+                self._cond.notify_all()
+
+    def stats(self):
+        with self._cond:
+            return {
+                'policy': self.policy,
+                'queued': len(self._queue),
+                'max_queue': self.max_queue,
+                **self._stats,
+            }
@@ -0,0 +1,87 @@
+"""
+隨機抽樣模組
+取代 `ORDER BY RAND() LIMIT k`：
+- 候選 id 由記憶體中的商品目錄索引 (catalog_index) 篩選
+- 各種關鍵字 / 篩選組合的候選 id 會快取，之後抽樣只要 O(k)
+- 商品索引更新 (版本號改變) 時，快取自動失效
+"""
+
+import os
+import random
+import threading
+from collections import OrderedDict
+
+from catalog_index import get_catalog_index, fetch_items_by_ids, MATCH_TYPE_OR_NAME, MATCH_TYPE_OR_CATEGORY
+
+# 組合條件結果快取的上限
+SAMPLER_MEMO_SIZE = int(os.getenv('SAMPLER_MEMO_SIZE', '256'))
+
+
+class ItemSampler:
+    """商品隨機抽樣器 (每個 worker 一份)"""
+
+    def __init__(self, index=None, memo_size=SAMPLER_MEMO_SIZE):
+        self.index = index or get_catalog_index()
+        self.memo_size = memo_size
+        self._memo = OrderedDict()
+        self._lock = threading.Lock()
+
+    def candidate_ids(self, cur, terms=None, match=MATCH_TYPE_OR_NAME, gender=None, category=None):
+        """
+        取得符合條件的 id 陣列 (同樣條件第二次起是 O(1))
+
+        Args:
+            terms: 關鍵字列表，任一關鍵字符合即可 (OR)
+            match: 關鍵字比對規則
+            gender / category: 額外的精確篩選 (AND)
+        """
+        snap = self.index.refresh(cur)
+        key = (snap.version, frozenset(terms) if terms else None, match if terms else None, gender, category)
+        with self._lock:
+            if key in self._memo:
+                self._memo.move_to_end(key)
+                return self._memo[key]
+
+        ids = snap.filter_ids(terms=terms, match=match, gender=gender, category=category)
+
+        with self._lock:
+            self._memo[key] = ids
+            while len(self._memo) > self.memo_size:
+                self._memo.popitem(last=False)
+        return ids
+
+    def sample_ids(self, cur, k, **filters):
+        """從符合條件的 id 中均勻抽出最多 k 個 (不重複)"""
+        ids = self.candidate_ids(cur, **filters)
+        if not len(ids):
+            return []
+        picks = random.sample(range(len(ids)), min(k, len(ids)))
+        return [int(ids[i]) for i in picks]
+
+
+# =======================
+# 每個 worker 共用一個抽樣器
+# =======================
+_sampler = ItemSampler()
+
+
+def get_sampler():
+    return _sampler
+
+
+def sample_items(cur, k, terms=None, match=MATCH_TYPE_OR_NAME, gender=None, category=None):
+    """
+    隨機抽出最多 k 件符合條件的商品 (取代 ORDER BY RAND() LIMIT k)
+
+    Args:
+        cur: 資料庫 cursor (DictCursor)
+        k: 抽幾件
+        terms: 關鍵字列表 (OR)，None 表示不限
+        match: 關鍵字比對規則 (MATCH_TYPE_OR_NAME / MATCH_TYPE_OR_CATEGORY)
+        gender / category: 精確篩選
+
+    Returns:
+        商品 dict 列表
+    """
+    ids = _sampler.sample_ids(cur, k, terms=terms, match=match, gender=gender, category=category)
+    return fetch_items_by_ids(cur, ids)
@@ -0,0 +1,54 @@
+"""
+orjson 版的 Flask JSON provider
+jsonify() / app.json.dumps() 改用 orjson 編碼 (requirements.txt 已包含)：
+
+- 直接輸出 UTF-8 bytes，不經過 str，中文不跳脫 (同 ensure_ascii=False)
+- datetime / date 原生支援 (ISO 8601)，Decimal 轉 float，numpy 數值 / 陣列原生支援，
+  其他型別轉字串 (同原本 SSE 的 default=str)，路由不用再逐筆轉換
+- 保持 dict 的原始順序 (同 JSON_SORT_KEYS=False)
+- init_json(app) 由 create_app() 呼叫
+"""
+
+from decimal import Decimal
+
+import orjson
+from flask.json.provider import JSONProvider
+
+ORJSON_OPTIONS = orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY
+
+
+def _default(obj):
+    """orjson 不支援的型別"""
+    if isinstance(obj, Decimal):
+        return float(obj)
+    if isinstance(obj, (set, frozenset, tuple)):
+        return list(obj)
+    return str(obj)
+
+
+def dumps_bytes(obj, indent=False):
+    """編碼成 UTF-8 bytes (回應本體直接使用，不必再 encode)"""
+    option = ORJSON_OPTIONS | orjson.OPT_INDENT_2 if indent else ORJSON_OPTIONS
+    return orjson.dumps(obj, default=_default, option=option)
+
+
+class OrjsonProvider(JSONProvider):
+    mimetype = 'application/json'
+
+    def dumps(self, obj, **kwargs):
+        return dumps_bytes(obj, indent=bool(kwargs.get('indent'))).decode('utf-8')
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        indent = self._app.debug
+        return self._app.response_class(dumps_bytes(obj, indent=indent) + b'\n', mimetype=self.mimetype)
+
+
+def init_json(app):
+    """在 create_app() 中呼叫：jsonify / app.json 改用 orjson"""
+    app.json_provider_class = OrjsonProvider
+    app.json = OrjsonProvider(app)
+    return app
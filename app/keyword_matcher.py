@@ -0,0 +1,162 @@
+"""
+關鍵字比對模組 (Aho-Corasick 多模式比對)
+取代「每個 key、每個同義詞各做一次 `in` 檢查」的 extract_keywords：
+
+- 由關鍵字映射 {key: [同義詞, ...]} 編譯成一個自動機，掃一次輸入就找出所有命中
+- 回傳命中的 key 以及位置
+- 映射可來自 JSON 檔，檔案變動時自動重建並原子替換，不必重啟 worker
+"""
+
+import os
+import sys
+import json
+import time
+import threading
+from collections import deque
+
+# 多久檢查一次映射檔是否變動 (秒)
+KEYWORD_RELOAD_INTERVAL = float(os.getenv('KEYWORD_RELOAD_INTERVAL', '5'))
+
+
+class AhoCorasick:
+    """Aho-Corasick 自動機 (建好後唯讀)"""
+
+    def __init__(self, patterns):
+        """
+        Args:
+            patterns: [(字串, payload), ...]，payload 會原樣回傳
+        """
+        self._goto = [{}]   # 節點 -> {字元: 下一個節點}
+        self._fail = [0]
+        self._out = [[]]    # 節點 -> [(payload, 字串長度), ...]
+
+        for word, payload in patterns:
+            if not word:
+                continue
+            node = 0
+            for ch in word:
+                nxt = self._goto[node].get(ch)
+                if nxt is None:
+                    nxt = len(self._goto)
+                    self._goto[node][ch] = nxt
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._out.append([])
+                node = nxt
+            self._out[node].append((payload, len(word)))
+
+        # BFS 建立 fail 連結，並把 fail 節點的輸出併進來
+        queue = deque(self._goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for ch, nxt in self._goto[node].items():
+                queue.append(nxt)
+                f = self._fail[node]
+                while f and ch not in self._goto[f]:
+                    f = self._fail[f]
+                self._fail[nxt] = self._goto[f].get(ch, 0) if node else 0
+                self._out[nxt] = self._out[nxt] + self._out[self._fail[nxt]]
+
+    def iter_matches(self, text):
+        """掃一次 text，依序產生 (payload, start, end)"""
+        goto, fail, out = self._goto, self._fail, self._out
+        node = 0
+        for i, ch in enumerate(text):
+            while node and ch not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(ch, 0)
+            for payload, length in out[node]:
+                yield payload, i - length + 1, i + 1
+
+
+def _load_mapping_file(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+    if not isinstance(data, dict):
+        raise ValueError("關鍵字映射檔必須是 {key: [同義詞, ...]} 格式")
+    return {key: list(synonyms) for key, synonyms in data.items()}
+
+
+class KeywordExtractor:
+    """
+    編譯好的關鍵字擷取器
+
+    Args:
+        mapping: 預設映射 {key: [同義詞, ...]} (key 本身不會自動加入，需要的話寫在同義詞裡)
+        path: 可選的 JSON 映射檔，內容同格式；載入後與預設映射合併 (同 key 以檔案為準)
+        ignore_case: 是否不分大小寫
+        check_interval: 檢查映射檔變動的間隔 (秒)
+    """
+
+    def __init__(self, mapping, path=None, ignore_case=True, check_interval=KEYWORD_RELOAD_INTERVAL):
+        self.default_mapping = dict(mapping)
+        self.path = path
+        self.ignore_case = ignore_case
+        self.check_interval = check_interval
+        self._mtime = None
+        self._last_check = 0.0
+        self._lock = threading.Lock()
+        self._automaton = None
+        self.mapping = {}
+        self.reload()
+
+    # -----------------------
+    # 編譯 / 熱更新
+    # -----------------------
+    def _compile(self, mapping):
+        patterns = []
+        for key, synonyms in mapping.items():
+            for synonym in synonyms:
+                word = synonym.lower() if self.ignore_case else synonym
+                patterns.append((word, key))
+        return AhoCorasick(patterns)
+
+    def reload(self):
+        """重新讀取映射檔並重建自動機 (建好後才替換，讀取端不會看到半成品)"""
+        with self._lock:
+            mapping = dict(self.default_mapping)
+            mtime = None
+            if self.path and os.path.exists(self.path):
+                try:
+                    mtime = os.path.getmtime(self.path)
+                    mapping.update(_load_mapping_file(self.path))
+                except Exception as e:
+                    print(f"⚠️ 關鍵字映射檔載入失敗，沿用目前版本: {e}", flush=True, file=sys.stderr)
+                    if self._automaton is not None:
+                        return
+            automaton = self._compile(mapping)
+            self.mapping, self._automaton, self._mtime = mapping, automaton, mtime
+            self._last_check = time.monotonic()
+            if self.path:
+                total = sum(len(v) for v in mapping.values())
+                print(f"🔑 關鍵字自動機已編譯 ({len(mapping)} 個 key, {total} 個詞)", flush=True, file=sys.stderr)
+
+    def _maybe_reload(self):
+        if not self.path or time.monotonic() - self._last_check < self.check_interval:
+            return
+        self._last_check = time.monotonic()
+        try:
+            mtime = os.path.getmtime(self.path) if os.path.exists(self.path) else None
+        except OSError:
+            return
+        if mtime != self._mtime:
+            self.reload()
+
+    # -----------------------
+    # 擷取
+    # -----------------------
+    def find(self, text):
+        """
+        回傳所有命中 [(key, start, end), ...] (依結束位置排序)
+        """
+        if not text:
+            return []
+        self._maybe_reload()
+        automaton = self._automaton  # 取一次參考，掃描中途換版也不受影響
+        if self.ignore_case:
+            text = text.lower()
+        return list(automaton.iter_matches(text))
+
+    def extract(self, text):
+        """回傳命中的 key (去重，依第一次出現的位置排序)"""
+        return list(dict.fromkeys(key for key, _, _ in self.find(text)))
@@ -3,96 +3,76 @@ LangChain 整合模組：穿搭推薦 AI Agent
 支援對話記憶、工具呼叫、資料庫查詢、多 AI 備援
 """
 
-from langchain_google_genai import ChatGoogleGenerativeAI
-from langchain_groq import ChatGroq
-from langchain_openai import ChatOpenAI
 from langchain_core.prompts import PromptTemplate
 import os
 import json
 import sys
 import time
 from datetime import datetime
-from threading import Lock
 from functools import lru_cache
 
+from llm_cache import LLMResponseCache, make_cache_key
+from llm_hedge import LatencyTracker, HedgedInvoker, LLM_HEDGE_ENABLED
+from circuit_breaker import CircuitBreaker
+from session_store import create_session_store, migrate_legacy_file_once
+from session_cache import SessionCache
+from rate_limiter import (RateLimiter, RateLimited, build_provider_limiters,
+                          SESSION_RATE_LIMIT, SESSION_RATE_BURST)
+from metrics import span, LLM_SECONDS, LLM_REQUESTS, LLM_FALLBACKS, LLM_CACHE
+from llm_providers import build_llms, tag_prompt
+
 # 確保 Python 使用 UTF-8 編碼
 if hasattr(sys.stdout, 'reconfigure'):
     sys.stdout.reconfigure(encoding='utf-8')
 if hasattr(sys.stderr, 'reconfigure'):
     sys.stderr.reconfigure(encoding='utf-8')
 
-# JSON 對話記錄檔案路徑
-CONVERSATIONS_FILE = "/app/data/conversations.json"
-file_lock = Lock()  # 防止多執行緒同時寫入
 
-# 速率限制設定
-last_request_time = {}
-rate_limit_lock = Lock()
-MIN_REQUEST_INTERVAL = 2  # 最少間隔 2 秒 (降低 RPM)
+# 提示詞版本：修改 simple_prompt 的格式時請 +1，舊的快取回應就不會再被使用
+PROMPT_VERSION = "simple-v1"
 
 # =========================
 # 🔧 初始化 LangChain 模型
 # =========================
 class OutfitAIAgent:
-    def __init__(self, gemini_key: str = None, groq_key: str = None, deepseek_key: str = None):
-        """初始化 AI Agent（使用 LangChain，支援多模型備援）"""
-        
-        # 初始化多個 LLM（按優先順序：Gemini -> Groq -> DeepSeek）
-        self.llms = []
-        
-        # 1. Gemini (優先) - 使用 Lite 版本,配額更高
-        if gemini_key:
-            try:
-                self.llms.append({
-                    "name": "Gemini",
-                    "llm": ChatGoogleGenerativeAI(
-                        model="gemini-2.0-flash-lite",  # Lite 版本:更高 RPM/TPM
-                        google_api_key=gemini_key,
-                        temperature=0.5,  # 降低溫度,減少隨機性
-                        max_output_tokens=300  # 減少輸出長度,降低 TPM
-                    )
-                })
-            except Exception as e:
-                print(f"⚠️  Gemini 初始化失敗: {e}")
-        
-        # 2. Groq (備援)
-        if groq_key:
-            try:
-                self.llms.append({
-                    "name": "Groq",
-                    "llm": ChatGroq(
-                        model="llama-3.3-70b-versatile",
-                        groq_api_key=groq_key,
-                        temperature=1.0,
-                        max_tokens=200
-                    )
-                })
-            except Exception as e:
-                print(f"⚠️  Groq 初始化失敗: {e}")
-        
-        # 3. DeepSeek (最終備援)
-        if deepseek_key:
-            try:
-                self.llms.append({
-                    "name": "DeepSeek",
-                    "llm": ChatOpenAI(
-                        model="deepseek-chat",
-                        openai_api_key=deepseek_key,
-                        openai_api_base="https://api.deepseek.com",
-                        temperature=1.0,
-                        max_tokens=200
-                    )
-                })
-            except Exception as e:
-                print(f"⚠️  DeepSeek 初始化失敗: {e}")
-        
+    def __init__(self, gemini_key: str = None, groq_key: str = None, deepseek_key: str = None,
+                 providers: str = None):
+        """
+        初始化 AI Agent（使用 LangChain，支援多模型備援）
+
+        Args:
+            providers: 模型與備援順序，格式同 LLM_PROVIDERS（例如 "fake" 或 "gemini,groq"），預設讀環境變數
+        """
+
+        # 初始化多個 LLM（預設按優先順序：Gemini -> Groq -> DeepSeek，沒有 API Key 的略過）
+        self.llms = build_llms({"gemini": gemini_key, "groq": groq_key, "deepseek": deepseek_key}, providers)
+
         if not self.llms:
-            raise ValueError("❌ 至少需要一個可用的 API Key")
+            raise ValueError("❌ 至少需要一個可用的 API Key（或在 LLM_PROVIDERS 設定 fake / replay）")
         
         print(f"✅ 已初始化 {len(self.llms)} 個 LLM: {[m['name'] for m in self.llms]}")
         
-        # 對話記憶（每個 session 一個）
-        self.sessions = {}
+        # 對話記憶（每個 session 一個，有上限的 LRU；被淘汰的下次用到時再從對話儲存載入）
+        self.sessions = SessionCache()
+
+        # 對話記錄儲存（每則訊息追加寫入，SESSION_STORE=mysql / jsonl），首次啟動時遷移舊的 conversations.json
+        self.store = create_session_store()
+        migrate_legacy_file_once(self.store)
+
+        # LLM 回應快取（相同提示詞直接回傳，不再呼叫模型）
+        self.response_cache = LLMResponseCache()
+
+        # 速率限制（token bucket）：每個 session 一個桶，每個模型供應商一個桶
+        self.session_limiter = RateLimiter("session", SESSION_RATE_LIMIT, SESSION_RATE_BURST)
+        self.provider_limiters = build_provider_limiters([m["name"] for m in self.llms])
+
+        # 對沖請求：自動模式下主要模型太慢時同時送出備援，先回應者勝出（LLM_HEDGE=on 啟用）
+        self.latency = LatencyTracker()
+        self.hedger = HedgedInvoker(self.latency)
+        self.hedge_enabled = LLM_HEDGE_ENABLED
+
+        # 熔斷器：每個模型一個，連續失敗 / 餘額不足時自動模式直接略過
+        self.breakers = {m["name"]: CircuitBreaker(m["name"]) for m in self.llms}
         
         # System Prompt - 超自然對話版
         self.system_prompt = """你是「搭搭」，一個活潑親切的穿搭顧問。
@@ -129,68 +109,42 @@ class OutfitAIAgent:
 1. 休閒約會裝 - 白T + 牛仔褲，輕鬆自在
 2. 浪漫約會裝 - 碎花洋裝，溫柔甜美"""
     
-    def _load_conversations(self):
-        """從 JSON 檔案載入對話記錄"""
+    def _load_session(self, session_id: str):
+        """取得常駐的 session，不在記憶體中就從對話儲存載入（沒有記錄回傳 None）"""
+        session = self.sessions.get(session_id)
+        if session is not None:
+            return session
+        # 只讀取這個 session 的記錄
         try:
-            if os.path.exists(CONVERSATIONS_FILE):
-                with file_lock:
-                    with open(CONVERSATIONS_FILE, 'r', encoding='utf-8') as f:
-                        return json.load(f)
+            turns = self.store.load(session_id, self.sessions.max_turns)
         except Exception as e:
             print(f"⚠️ 載入對話記錄失敗: {e}", file=sys.stderr)
-        return {}
-    
-    def _save_conversations(self, conversations):
-        """儲存對話記錄到 JSON 檔案"""
-        try:
-            os.makedirs(os.path.dirname(CONVERSATIONS_FILE), exist_ok=True)
-            with file_lock:
-                with open(CONVERSATIONS_FILE, 'w', encoding='utf-8') as f:
-                    json.dump(conversations, f, ensure_ascii=False, indent=2)
-        except Exception as e:
-            print(f"⚠️ 儲存對話記錄失敗: {e}", file=sys.stderr)
-    
+            return None
+        if not turns:
+            return None
+        session = {
+            "messages": turns,
+            "created_at": turns[0].get("timestamp") or datetime.now().isoformat()
+        }
+        self.sessions.put(session_id, session)
+        print(f"📂 載入 {session_id} 的歷史對話 ({len(turns)} 則)", file=sys.stderr)
+        return session
+
     def get_or_create_session(self, session_id: str):
-        """取得或建立對話 session（從 JSON 載入或建立新的）"""
-        if session_id not in self.sessions:
-            # 嘗試從 JSON 載入
-            all_conversations = self._load_conversations()
-            if session_id in all_conversations:
-                self.sessions[session_id] = all_conversations[session_id]
-                print(f"📂 載入 {session_id} 的歷史對話 ({len(all_conversations[session_id]['messages'])} 則)", file=sys.stderr)
-            else:
-                # 建立新 session
-                self.sessions[session_id] = {
-                    "history": [],
-                    "messages": [],
-                    "created_at": datetime.now().isoformat()
-                }
-                print(f"🆕 建立新的對話 session: {session_id}", file=sys.stderr)
-        
-        return self.sessions[session_id]
+        """取得或建立對話 session（從對話儲存載入或建立新的）"""
+        session = self._load_session(session_id)
+        if session is None:
+            # 建立新 session
+            session = {
+                "messages": [],
+                "created_at": datetime.now().isoformat()
+            }
+            self.sessions.put(session_id, session)
+            print(f"🆕 建立新的對話 session: {session_id}", file=sys.stderr)
+        return session
     
-    def chat(self, session_id: str, user_input: str, db_outfits=None, preferred_model: str = "auto"):
-        """對話式推薦（使用 LangChain，支援多模型備援和手動選擇）
-        
-        Args:
-            session_id: 對話 session ID
-            user_input: 用戶輸入
-            db_outfits: 資料庫檢索的穿搭資料
-            preferred_model: 偏好模型 ("auto", "gemini", "groq", "deepseek")
-        """
-        # ⏱️ 速率限制: 確保請求之間有最小間隔
-        with rate_limit_lock:
-            current_time = time.time()
-            if session_id in last_request_time:
-                elapsed = current_time - last_request_time[session_id]
-                if elapsed < MIN_REQUEST_INTERVAL:
-                    wait_time = MIN_REQUEST_INTERVAL - elapsed
-                    print(f"⏳ 速率限制: 等待 {wait_time:.1f} 秒...", file=sys.stderr)
-                    time.sleep(wait_time)
-            last_request_time[session_id] = time.time()
-        
-        session = self.get_or_create_session(session_id)
-        
+    def _build_prompt(self, session, user_input: str, db_outfits=None, query: str = None):
+        """組出精簡提示詞，回傳 (提示詞, 是否含對話歷史)；query 為使用者原始問句 (回放比對用)"""
         # 🎯 建立精簡對話上下文 - 減少 token 消耗
         context = ""
         if db_outfits and len(db_outfits) > 0:
@@ -210,97 +164,412 @@ class OutfitAIAgent:
         
         # 🔥 精簡提示詞
         simple_prompt = f"你是穿搭顧問。{history_text}用戶: {user_input}{context}\n建議:"
-        
-        # 調試信息
-        import sys
-        print(f"\n{'='*50}", flush=True, file=sys.stderr)
-        print(f"📝 用戶輸入: {user_input}", flush=True, file=sys.stderr)
-        print(f"📦 資料庫穿搭數量: {len(db_outfits) if db_outfits else 0}", flush=True, file=sys.stderr)
-        print(f"{'='*50}\n", flush=True, file=sys.stderr)
-        
-        # 根據用戶選擇決定使用哪些模型
+        # 提示詞含有檢索結果 (每次可能不同)，錄製 / 回放改用原始問句 + 第幾輪比對
+        simple_prompt = tag_prompt(simple_prompt, query or user_input, turn=len(session["messages"]))
+        return simple_prompt, bool(history_text)
+    
+    def _select_models(self, preferred_model: str):
+        """根據用戶選擇決定使用哪些模型 (找不到指定模型時回傳空列表)"""
         if preferred_model != "auto":
             # 手動選擇模式：只嘗試指定的模型
             models_to_try = [m for m in self.llms if m["name"].lower() == preferred_model.lower()]
-            if not models_to_try:
-                return f"❌ 模型 {preferred_model} 未設定或不可用"
-            print(f"🎯 手動選擇使用 {preferred_model}", flush=True, file=sys.stderr)
+            if models_to_try:
+                print(f"🎯 手動選擇使用 {preferred_model}", flush=True, file=sys.stderr)
         else:
             # 自動模式：依序嘗試所有模型
             models_to_try = self.llms
             print(f"🔄 自動模式：依序嘗試 {[m['name'] for m in models_to_try]}", flush=True, file=sys.stderr)
+        return models_to_try
+    
+    def _lookup_cache(self, simple_prompt: str, models_to_try):
+        """💾 回應快取：自動模式依備援順序查，任何一個模型答過都算命中；回傳 (回應, 模型) 或 (None, None)"""
+        for model_info in models_to_try:
+            hit = self.response_cache.get(make_cache_key(simple_prompt, model_info["name"], PROMPT_VERSION))
+            if hit is not None:
+                print(f"💾 快取命中 ({model_info['name']})", flush=True, file=sys.stderr)
+                LLM_CACHE.inc('hit')
+                return hit, model_info["name"]
+        LLM_CACHE.inc('miss')
+        return None, None
+    
+    def _wait_rate_limit(self, session_id: str):
+        """⏱️ session 速率限制：依設定排隊等待或拋出 RateLimited（不持有共用鎖等待）"""
+        wait_time = self.session_limiter.acquire(session_id)
+        if wait_time:
+            print(f"⏳ 速率限制: 已等待 {wait_time:.1f} 秒", file=sys.stderr)
+    
+    def _acquire_provider(self, model_name: str, has_fallback: bool):
+        """能不能呼叫這個模型：
+        - 熔斷中 (open) 直接略過
+        - 速率限制：還有備援模型時直接跳過被限流的供應商，最後一個才排隊 / 拒絕
+        """
+        breaker = self.breakers.get(model_name)
+        if breaker is not None and not breaker.allow():
+            print(f"⏭️ {model_name} 熔斷中，略過", flush=True, file=sys.stderr)
+            LLM_FALLBACKS.inc(model_name, 'circuit_open')
+            return False
+        limiter = self.provider_limiters.get(model_name)
+        if limiter is None or not limiter.enabled:
+            return True
+        if has_fallback:
+            wait_time = limiter.try_acquire(model_name)
+            if wait_time > 0:
+                print(f"⏭️ {model_name} 已達速率上限，改用下一個模型", flush=True, file=sys.stderr)
+                LLM_FALLBACKS.inc(model_name, 'rate_limited')
+                if breaker is not None:
+                    breaker.cancel_probe()
+                return False
+            return True
+        try:
+            limiter.acquire(model_name)
+        except RateLimited:
+            if breaker is not None:
+                breaker.cancel_probe()
+            raise
+        return True
+    
+    def _unavailable_message(self, model_name: str):
+        """手動模式選到熔斷中的模型"""
+        breaker = self.breakers.get(model_name)
+        retry_in = breaker.retry_in() if breaker is not None else 0
+        return (f"❌ {model_name} 近期連續失敗，暫時停用（約 {max(1, round(retry_in))} 秒後自動重試）\n\n"
+                f"💡 建議切換到「自動切換」模式或選擇其他模型")
+    
+    def _invoke(self, model_info, prompt: str):
+        """呼叫模型並取出文字（記錄延遲與熔斷器結果）"""
+        model_name = model_info["name"]
+        breaker = self.breakers.get(model_name)
+        started = time.monotonic()
+        try:
+            response = model_info["llm"].invoke(prompt)
+        except Exception as e:
+            LLM_REQUESTS.inc(model_name, 'error')
+            if breaker is not None:
+                breaker.record_failure(e)
+            raise
+        except BaseException:
+            # 非 Exception 的中斷 (例如 gevent Timeout)：沒有結果，歸還 half_open 的試探名額
+            if breaker is not None:
+                breaker.cancel_probe()
+            raise
+        latency = time.monotonic() - started
+        LLM_REQUESTS.inc(model_name, 'success')
+        LLM_SECONDS.observe(latency, model_name)
+        self.latency.record(model_name, latency)
+        if breaker is not None:
+            breaker.record_success(latency)
+        return response.content if hasattr(response, 'content') else str(response)
+    
+    def _invoke_hedged(self, simple_prompt: str, models_to_try):
+        """對沖呼叫：回傳 (模型名稱, 回應)，全部失敗回傳 (None, None)"""
+        launched = []
+        
+        def calls():
+            for idx, model_info in enumerate(models_to_try):
+                model_name = model_info["name"]
+                # 已經有模型在執行時，被限流的備援直接略過，不排隊
+                if not self._acquire_provider(model_name, bool(launched) or idx < len(models_to_try) - 1):
+                    continue
+                launched.append(model_name)
+                print(f"🔄 {'送出備援' if len(launched) > 1 else '嘗試使用'} {model_name}...", flush=True, file=sys.stderr)
+                yield model_name, (lambda info=model_info: self._invoke(info, simple_prompt))
+        
+        def on_error(model_name, e):
+            print(f"❌ {model_name} 失敗: {e}", flush=True, file=sys.stderr)
+            LLM_FALLBACKS.inc(model_name, 'error')
+        
+        def on_cancel(model_name):
+            # 已通過 allow() 但還沒開始就被取消：歸還 half_open 的試探名額
+            breaker = self.breakers.get(model_name)
+            if breaker is not None:
+                breaker.cancel_probe()
+        
+        return self.hedger.run(calls(), on_error=on_error, on_cancel=on_cancel)
+    
+    def provider_stats(self):
+        """各模型熔斷狀態、延遲與對沖統計（健康檢查用）"""
+        return {
+            "breakers": {name: breaker.stats() for name, breaker in self.breakers.items()},
+            "latency": self.latency.stats(),
+            "hedge": {"enabled": self.hedge_enabled, **self.hedger.stats()}
+        }
+    
+    def rate_limit_stats(self):
+        """速率限制統計（健康檢查用）"""
+        return {
+            "session": self.session_limiter.stats(),
+            "providers": {name: limiter.stats() for name, limiter in self.provider_limiters.items()
+                          if limiter.enabled}
+        }
+    
+    @staticmethod
+    def _model_error_message(model_name: str, error_msg: str):
+        """手動模式失敗時的友善錯誤訊息"""
+        if "Insufficient Balance" in error_msg or "402" in error_msg:
+            return f"❌ {model_name} 餘額不足,請切換到「自動切換」模式或選擇其他模型 (Gemini/Groq)"
+        return f"❌ {model_name} 回應失敗: {error_msg}\n\n💡 建議切換到「自動切換」模式或選擇其他模型"
+    
+    def _record_turn(self, session_id: str, session, user_input: str, response_text: str,
+                     used_model: str, cached: bool):
+        """儲存對話（附註使用的模型和時間戳），只追加這一輪到對話儲存"""
+        turn = {
+            "user": user_input,
+            "ai": response_text,
+            "model": used_model,
+            "cached": cached,
+            "timestamp": datetime.now().isoformat()
+        }
+        self.sessions.append(session_id, session, turn)
+        
+        try:
+            self.store.append(session_id, turn)
+        except Exception as e:
+            print(f"⚠️ 儲存對話記錄失敗: {e}", file=sys.stderr)
+    
+    def chat(self, session_id: str, user_input: str, db_outfits=None, preferred_model: str = "auto",
+             use_cache: bool = True, query: str = None):
+        """對話式推薦（使用 LangChain，支援多模型備援和手動選擇）
+        
+        Args:
+            session_id: 對話 session ID
+            user_input: 用戶輸入
+            db_outfits: 資料庫檢索的穿搭資料
+            preferred_model: 偏好模型 ("auto", "gemini", "groq", "deepseek")
+            use_cache: 是否使用回應快取（個人化的 session 可傳 False 略過）
+            query: 使用者原始問句（user_input 附加了檢索結果時傳入，供錄製 / 回放比對）
+        
+        Raises:
+            RateLimited: 超過速率限制（reject 模式，或排隊需等待超過上限）
+        """
+        with span('chat', 'session_load'):
+            session = self.get_or_create_session(session_id)
+        simple_prompt, personalized = self._build_prompt(session, user_input, db_outfits, query)
+        
+        # 調試信息
+        print(f"\n{'='*50}", flush=True, file=sys.stderr)
+        print(f"📝 用戶輸入: {user_input}", flush=True, file=sys.stderr)
+        print(f"📦 資料庫穿搭數量: {len(db_outfits) if db_outfits else 0}", flush=True, file=sys.stderr)
+        print(f"{'='*50}\n", flush=True, file=sys.stderr)
+        
+        models_to_try = self._select_models(preferred_model)
+        if not models_to_try:
+            return f"❌ 模型 {preferred_model} 未設定或不可用"
         
-        # 依序嘗試 LLM
         response_text = None
         used_model = None
-        
-        for model_info in models_to_try:
-            try:
-                llm = model_info["llm"]
-                model_name = model_info["name"]
+        cache_enabled = use_cache and self.response_cache.allows(personalized=personalized)
+        if cache_enabled:
+            with span('chat', 'cache_lookup'):
+                response_text, used_model = self._lookup_cache(simple_prompt, models_to_try)
+        else:
+            LLM_CACHE.inc('bypass')
+        cached = response_text is not None
+
+        # 快取命中不呼叫模型，不必等待速率限制
+        if not cached:
+            with span('chat', 'rate_limit_wait'):
+                self._wait_rate_limit(session_id)
+
+        # LLM 階段 (對沖或依序嘗試；快取命中時幾乎為 0)
+        with span('chat', 'llm'):
+            # 自動模式 + 對沖：主要模型超過對沖延遲還沒回應就同時送出備援
+            hedged = (not cached and self.hedge_enabled and preferred_model == "auto"
+                      and len(models_to_try) > 1)
+            if hedged:
+                used_model, response_text = self._invoke_hedged(simple_prompt, models_to_try)
+                if response_text is not None:
+                    print(f"✅ {used_model} 回應成功", flush=True, file=sys.stderr)
+                    if cache_enabled:
+                        self.response_cache.put(
+                            make_cache_key(simple_prompt, used_model, PROMPT_VERSION), response_text)
+
+            # 依序嘗試 LLM
+            for idx, model_info in enumerate([] if cached or hedged else models_to_try):
+                if not self._acquire_provider(model_info["name"], idx < len(models_to_try) - 1):
+                    if preferred_model != "auto":
+                        return self._unavailable_message(model_info["name"])
+                    continue
+                try:
+                    model_name = model_info["name"]
                 
-                print(f"🔄 嘗試使用 {model_name}...", flush=True, file=sys.stderr)
-                response = llm.invoke(simple_prompt)  # 使用精簡提示詞
-                response_text = response.content if hasattr(response, 'content') else str(response)
-                used_model = model_name
-                print(f"✅ {model_name} 回應成功", flush=True, file=sys.stderr)
-                break
+                    print(f"🔄 嘗試使用 {model_name}...", flush=True, file=sys.stderr)
+                    response_text = self._invoke(model_info, simple_prompt)  # 使用精簡提示詞
+                    used_model = model_name
+                    print(f"✅ {model_name} 回應成功", flush=True, file=sys.stderr)
+                    if cache_enabled:
+                        self.response_cache.put(
+                            make_cache_key(simple_prompt, model_name, PROMPT_VERSION), response_text)
+                    break
                 
-            except Exception as e:
-                error_msg = str(e)
-                print(f"❌ {model_name} 失敗: {error_msg}", flush=True, file=sys.stderr)
+                except Exception as e:
+                    error_msg = str(e)
+                    print(f"❌ {model_name} 失敗: {error_msg}", flush=True, file=sys.stderr)
                 
-                if preferred_model != "auto":
-                    # 手動模式失敗時返回友善的錯誤訊息
-                    if "Insufficient Balance" in error_msg or "402" in error_msg:
-                        return f"❌ {model_name} 餘額不足,請切換到「自動切換」模式或選擇其他模型 (Gemini/Groq)"
-                    else:
-                        return f"❌ {model_name} 回應失敗: {error_msg}\n\n💡 建議切換到「自動切換」模式或選擇其他模型"
-                continue
-        
+                    if preferred_model != "auto":
+                        return self._model_error_message(model_name, error_msg)
+                    LLM_FALLBACKS.inc(model_name, 'error')
+                    continue
+
         # 如果所有模型都失敗
         if response_text is None:
             response_text = "抱歉，目前所有 AI 服務都無法使用，請稍後再試。"
             used_model = "None"
         
-        # 儲存對話（附註使用的模型和時間戳）
-        session["messages"].append({
-            "user": user_input,
-            "ai": response_text,
-            "model": used_model,
-            "timestamp": datetime.now().isoformat()
-        })
+        with span('chat', 'save'):
+            self._record_turn(session_id, session, user_input, response_text, used_model, cached)
+        return response_text
+    
+    def chat_stream(self, session_id: str, user_input: str, db_outfits=None, preferred_model: str = "auto",
+                    use_cache: bool = True, query: str = None):
+        """串流版 chat()：逐段產生回應文字（LangChain stream API）
         
-        session["history"].append({
-            "user": user_input,
-            "ai": response_text
-        })
+        參數同 chat()，超過速率限制時同樣拋出 RateLimited。產生 (事件, 內容)：
+            ("model", 模型名稱)  開始由哪個模型回應
+            ("token", 文字片段)  回應內容
+            ("done", 完整回應)   結束（對話已寫入記錄）
+        
+        某個模型在吐出第一段文字前失敗就換下一個；已經開始輸出後才失敗，
+        就在目前內容後面附上錯誤提示結束。串流結束 (或用戶中途斷線) 時才寫入對話記錄。
+        """
+        with span('chat_stream', 'session_load'):
+            session = self.get_or_create_session(session_id)
+        simple_prompt, personalized = self._build_prompt(session, user_input, db_outfits, query)
+        print(f"📝 [stream] 用戶輸入: {user_input}", flush=True, file=sys.stderr)
         
-        # 儲存到 JSON 檔案
-        all_conversations = self._load_conversations()
-        all_conversations[session_id] = session
-        self._save_conversations(all_conversations)
+        models_to_try = self._select_models(preferred_model)
+        if not models_to_try:
+            text = f"❌ 模型 {preferred_model} 未設定或不可用"
+            yield "token", text
+            yield "done", text
+            return
         
-        return response_text
+        cache_enabled = use_cache and self.response_cache.allows(personalized=personalized)
+        if cache_enabled:
+            with span('chat_stream', 'cache_lookup'):
+                hit, used_model = self._lookup_cache(simple_prompt, models_to_try)
+            if hit is not None:
+                self._record_turn(session_id, session, user_input, hit, used_model, True)
+                yield "model", used_model
+                yield "token", hit
+                yield "done", hit
+                return
+        else:
+            LLM_CACHE.inc('bypass')
+        
+        with span('chat_stream', 'rate_limit_wait'):
+            self._wait_rate_limit(session_id)
+        
+        chunks = []
+        used_model = None
+        completed = False
+        try:
+            for idx, model_info in enumerate(models_to_try):
+                model_name = model_info["name"]
+                if not self._acquire_provider(model_name, idx < len(models_to_try) - 1):
+                    if preferred_model != "auto":
+                        text = self._unavailable_message(model_name)
+                        yield "token", text
+                        yield "done", text
+                        return
+                    continue
+                print(f"🔄 [stream] 嘗試使用 {model_name}...", flush=True, file=sys.stderr)
+                breaker = self.breakers.get(model_name)
+                started = time.monotonic()
+                first_token_latency = None
+                recorded = False
+                try:
+                    for chunk in model_info["llm"].stream(simple_prompt):
+                        piece = chunk.content if hasattr(chunk, 'content') else str(chunk)
+                        if not piece:
+                            continue
+                        if used_model is None:
+                            used_model = model_name
+                            first_token_latency = time.monotonic() - started
+                            yield "model", model_name
+                        chunks.append(piece)
+                        yield "token", piece
+                    if first_token_latency is None:
+                        LLM_REQUESTS.inc(model_name, 'empty')
+                        LLM_FALLBACKS.inc(model_name, 'empty_stream')
+                    else:
+                        LLM_REQUESTS.inc(model_name, 'success')
+                        LLM_SECONDS.observe(first_token_latency, model_name)
+                    if breaker is not None:
+                        # 串流以首段文字的延遲判斷慢呼叫；沒有任何輸出視為失敗
+                        if first_token_latency is None:
+                            breaker.record_failure("empty stream")
+                        else:
+                            breaker.record_success(first_token_latency)
+                    recorded = True
+                except Exception as e:
+                    LLM_REQUESTS.inc(model_name, 'error')
+                    if breaker is not None:
+                        breaker.record_failure(e)
+                    recorded = True
+                    error_msg = str(e)
+                    print(f"❌ {model_name} 串流失敗: {error_msg}", flush=True, file=sys.stderr)
+                    if chunks:
+                        # 已經輸出部分內容，不再換模型 (避免前後兩段回答接在一起)
+                        note = "\n\n⚠️ 回應中斷，請稍後再試。"
+                        chunks.append(note)
+                        yield "token", note
+                        break
+                    if preferred_model != "auto":
+                        text = self._model_error_message(model_name, error_msg)
+                        yield "token", text
+                        yield "done", text
+                        return
+                    LLM_FALLBACKS.inc(model_name, 'error')
+                    continue
+                finally:
+                    # 用戶中途斷線 (GeneratorExit) 時上面都沒記錄到：已有輸出算成功，
+                    # 否則歸還 half_open 的試探名額，避免熔斷器一直卡在試探中
+                    if not recorded and breaker is not None:
+                        if first_token_latency is not None:
+                            breaker.record_success(first_token_latency)
+                        else:
+                            breaker.cancel_probe()
+                
+                if used_model is not None:
+                    print(f"✅ {model_name} 串流完成", flush=True, file=sys.stderr)
+                    if cache_enabled:
+                        self.response_cache.put(
+                            make_cache_key(simple_prompt, model_name, PROMPT_VERSION), ''.join(chunks))
+                    break
+            
+            # 如果所有模型都失敗
+            if not chunks:
+                used_model = "None"
+                chunks.append("抱歉，目前所有 AI 服務都無法使用，請稍後再試。")
+                yield "token", chunks[0]
+            completed = True
+        finally:
+            # 正常結束或用戶中途斷線 (GeneratorExit) 都把已產生的內容寫入記錄
+            if chunks:
+                with span('chat_stream', 'save'):
+                    self._record_turn(session_id, session, user_input, ''.join(chunks), used_model, False)
+        if completed:
+            yield "done", ''.join(chunks)
     
     def clear_session(self, session_id: str):
-        """清除對話記憶（記憶體和 JSON 檔案）"""
-        if session_id in self.sessions:
-            del self.sessions[session_id]
+        """清除對話記憶（記憶體和對話儲存）"""
+        self.sessions.pop(session_id)
         
-        # 同時從 JSON 移除
-        all_conversations = self._load_conversations()
-        if session_id in all_conversations:
-            del all_conversations[session_id]
-            self._save_conversations(all_conversations)
+        # 同時從對話儲存移除
+        try:
+            self.store.delete(session_id)
+        except Exception as e:
+            print(f"⚠️ 清除對話記錄失敗: {e}", file=sys.stderr)
+            return False
         
         return True
     
     def get_session_history(self, session_id: str):
-        """取得對話歷史"""
-        if session_id in self.sessions:
-            return self.sessions[session_id]["history"]
-        return None
+        """取得對話歷史（不在記憶體中就從對話儲存載入）"""
+        session = self._load_session(session_id)
+        if session is None:
+            return None
+        return [{"user": m["user"], "ai": m["ai"]} for m in session["messages"]]
 
 
 # =========================
@@ -0,0 +1,191 @@
+"""
+LLM 回應快取模組
+同樣的提示詞 (用戶輸入 + 上一輪 + 前 2 組穿搭) 幾秒內重複送出時，直接回傳上次的回答：
+
+- key = 正規化後提示詞的 SHA-256 + 模型名稱 + 提示詞版本
+  正規化會做全形/半形統一、大小寫統一、去除空白與標點，「我要去約會！」與「我要去約會」視為同一題
+- 記憶體 LRU (有容量上限) + 每筆 TTL
+- 可選的磁碟層 (SQLite)，同一台機器上的 gunicorn worker 共用，重啟後仍有效
+- 政策開關：all (全部快取) / anonymous (只快取沒有對話歷史的提示詞) / off
+"""
+
+import os
+import sys
+import time
+import sqlite3
+import hashlib
+import threading
+import unicodedata
+from collections import OrderedDict
+
+LLM_CACHE_POLICY = os.getenv('LLM_CACHE_POLICY', 'all')     # all / anonymous / off
+LLM_CACHE_SIZE = int(os.getenv('LLM_CACHE_SIZE', '1000'))
+LLM_CACHE_TTL = float(os.getenv('LLM_CACHE_TTL', '600'))
+LLM_CACHE_PATH = os.getenv('LLM_CACHE_PATH', '')            # 空字串表示不使用磁碟層
+
+CACHE_POLICIES = ('all', 'anonymous', 'off')
+
+
+def normalize_prompt(prompt):
+    """提示詞正規化：NFKC、轉小寫、去除空白與標點符號"""
+    text = unicodedata.normalize('NFKC', prompt or '').casefold()
+    return ''.join(ch for ch in text
+                   if not ch.isspace() and not unicodedata.category(ch).startswith('P'))
+
+
+def make_cache_key(prompt, model_name, prompt_version):
+    digest = hashlib.sha256(normalize_prompt(prompt).encode('utf-8')).hexdigest()
+    return f"{prompt_version}:{model_name.lower()}:{digest}"
+
+
+class _DiskTier:
+    """SQLite 磁碟層 (多個 worker 可同時讀寫)"""
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        conn = self._conn()
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS llm_cache (
+                key TEXT PRIMARY KEY,
+                response TEXT NOT NULL,
+                expires_at REAL NOT NULL
+            )
+        """)
+        conn.commit()
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, key, now):
+        row = self._conn().execute(
+            "SELECT response, expires_at FROM llm_cache WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None or row[1] <= now:
+            return None
+        return row
+
+    def put(self, key, response, expires_at):
+        conn = self._conn()
+        conn.execute("INSERT OR REPLACE INTO llm_cache (key, response, expires_at) VALUES (?, ?, ?)",
+                     (key, response, expires_at))
+        # 順便清掉過期的記錄
+        conn.execute("DELETE FROM llm_cache WHERE expires_at <= ?", (time.time(),))
+
+    def clear(self):
+        self._conn().execute("DELETE FROM llm_cache")
+
+
+class LLMResponseCache:
+    """
+    LLM 回應快取
+
+    Args:
+        max_entries: 記憶體層最多幾筆
+        ttl: 每筆存活秒數
+        path: SQLite 檔案路徑 (None / 空字串表示只用記憶體)
+        policy: all / anonymous / off
+    """
+
+    def __init__(self, max_entries=LLM_CACHE_SIZE, ttl=LLM_CACHE_TTL, path=LLM_CACHE_PATH,
+                 policy=LLM_CACHE_POLICY):
+        if policy not in CACHE_POLICIES:
+            print(f"⚠️ 未知的 LLM_CACHE_POLICY={policy}，改用 all", flush=True, file=sys.stderr)
+            policy = 'all'
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.policy = policy
+        self._data = OrderedDict()   # key -> (response, expires_at)
+        self._lock = threading.Lock()
+        self._stats = {'hits': 0, 'disk_hits': 0, 'misses': 0, 'bypassed': 0, 'stores': 0,
+                       'evictions': 0, 'disk_errors': 0}
+        self._disk = None
+        if path:
+            try:
+                self._disk = _DiskTier(path)
+            except Exception as e:
+                print(f"⚠️ LLM 快取磁碟層無法使用，只用記憶體: {e}", flush=True, file=sys.stderr)
+
+    def allows(self, personalized=False):
+        """依政策判斷這次請求能不能用快取 (personalized: 提示詞含對話歷史等個人化內容)"""
+        if self.policy == 'off' or (self.policy == 'anonymous' and personalized):
+            with self._lock:
+                self._stats['bypassed'] += 1
+            return False
+        return True
+
+    def get(self, key):
+        """取得快取的回應，沒有則回傳 None"""
+        now = time.time()
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None:
+                if entry[1] > now:
+                    self._data.move_to_end(key)
+                    self._stats['hits'] += 1
+                    return entry[0]
+                del self._data[key]
+
+        if self._disk is not None:
+            try:
+                row = self._disk.get(key, now)
+            except Exception as e:
+                row = None
+                self._count('disk_errors')
+                print(f"⚠️ LLM 快取磁碟層讀取失敗: {e}", flush=True, file=sys.stderr)
+            if row is not None:
+                self._put_memory(key, row[0], row[1])
+                self._count('disk_hits')
+                return row[0]
+
+        self._count('misses')
+        return None
+
+    def put(self, key, response):
+        expires_at = time.time() + self.ttl
+        self._put_memory(key, response, expires_at)
+        self._count('stores')
+        if self._disk is not None:
+            try:
+                self._disk.put(key, response, expires_at)
+            except Exception as e:
+                self._count('disk_errors')
+                print(f"⚠️ LLM 快取磁碟層寫入失敗: {e}", flush=True, file=sys.stderr)
+
+    def _put_memory(self, key, response, expires_at):
+        with self._lock:
+            self._data[key] = (response, expires_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+                self._stats['evictions'] += 1
+
+    def _count(self, name):
+        with self._lock:
+            self._stats[name] += 1
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+        if self._disk is not None:
+            self._disk.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self._stats['hits'] + self._stats['disk_hits'] + self._stats['misses']
+            hits = self._stats['hits'] + self._stats['disk_hits']
+            return {
+                'policy': self.policy,
+                'size': len(self._data),
+                'max_entries': self.max_entries,
+                'ttl': self.ttl,
+                'disk': bool(self._disk),
+                **self._stats,
+                'hit_rate': round(hits / lookups, 4) if lookups else 0.0,
+            }
@@ -0,0 +1,162 @@
+"""
+LLM 對沖請求 (hedged request) 模組
+自動模式下不必等主要模型逾時才換備援：
+
+- 主要模型先送出；超過對沖延遲還沒回應，就同時送出下一個備援模型
+- 先成功的回應勝出，其餘尚未開始的請求取消、已在執行的結果直接丟棄
+- 對沖延遲依各模型近期成功延遲的 p95 自動調整 (限制在 LLM_HEDGE_MIN_DELAY ~ LLM_HEDGE_MAX_DELAY)
+"""
+
+import os
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+LLM_HEDGE_ENABLED = os.getenv('LLM_HEDGE', 'off').lower() in ('1', 'on', 'true', 'yes')
+LLM_HEDGE_DELAY = float(os.getenv('LLM_HEDGE_DELAY', '3'))          # 樣本不足時的預設延遲 (秒)
+LLM_HEDGE_MIN_DELAY = float(os.getenv('LLM_HEDGE_MIN_DELAY', '0.5'))
+LLM_HEDGE_MAX_DELAY = float(os.getenv('LLM_HEDGE_MAX_DELAY', '8'))
+LLM_HEDGE_PERCENTILE = float(os.getenv('LLM_HEDGE_PERCENTILE', '95'))
+LLM_HEDGE_MAX_WORKERS = int(os.getenv('LLM_HEDGE_MAX_WORKERS', '16'))
+LATENCY_WINDOW = int(os.getenv('LLM_LATENCY_WINDOW', '100'))        # 每個模型保留最近幾筆延遲
+LATENCY_MIN_SAMPLES = 5
+
+
+class LatencyTracker:
+    """各模型最近 N 次成功呼叫的延遲"""
+
+    def __init__(self, window=LATENCY_WINDOW):
+        self.window = window
+        self._samples = {}
+        self._lock = threading.Lock()
+
+    def record(self, name, seconds):
+        with self._lock:
+            samples = self._samples.get(name)
+            if samples is None:
+                samples = self._samples[name] = deque(maxlen=self.window)
+            samples.append(seconds)
+
+    def percentile(self, name, q):
+        """回傳第 q 百分位延遲 (秒)，樣本不足回傳 None"""
+        with self._lock:
+            samples = sorted(self._samples.get(name, ()))
+        if len(samples) < LATENCY_MIN_SAMPLES:
+            return None
+        idx = min(len(samples) - 1, int(round(q / 100 * (len(samples) - 1))))
+        return samples[idx]
+
+    def stats(self):
+        with self._lock:
+            names = list(self._samples)
+        result = {}
+        for name in names:
+            with self._lock:
+                count = len(self._samples[name])
+            result[name] = {
+                'samples': count,
+                'p50_ms': _ms(self.percentile(name, 50)),
+                'p95_ms': _ms(self.percentile(name, 95)),
+            }
+        return result
+
+
+def _ms(seconds):
+    return None if seconds is None else round(seconds * 1000, 1)
+
+
+class HedgedInvoker:
+    """
+    對沖呼叫執行器 (每個 Agent 一個)
+
+    Args:
+        tracker: LatencyTracker，用來計算對沖延遲 (延遲由呼叫函數自行記錄，落選者完成後也會記到)
+    """
+
+    def __init__(self, tracker, default_delay=LLM_HEDGE_DELAY, min_delay=LLM_HEDGE_MIN_DELAY,
+                 max_delay=LLM_HEDGE_MAX_DELAY, percentile=LLM_HEDGE_PERCENTILE,
+                 max_workers=LLM_HEDGE_MAX_WORKERS):
+        self.tracker = tracker
+        self.default_delay = default_delay
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self.percentile = percentile
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='llm-hedge')
+        self._lock = threading.Lock()
+        self._stats = {'calls': 0, 'hedged': 0, 'backup_wins': 0, 'all_failed': 0}
+
+    def hedge_delay(self, name):
+        """啟動 name 後，等多久還沒回應就送出下一個備援"""
+        p = self.tracker.percentile(name, self.percentile)
+        if p is None:
+            return self.default_delay
+        return min(self.max_delay, max(self.min_delay, p))
+
+    def run(self, calls, on_error=None, on_cancel=None):
+        """
+        依序啟動候選呼叫，先成功者勝出
+
+        Args:
+            calls: 可迭代的 (名稱, 無參數函數)；延後產生，被限流 / 熔斷的候選可由呼叫端直接略過
+            on_error: 失敗時呼叫 on_error(名稱, 例外)
+            on_cancel: 尚未開始就被取消的呼叫 on_cancel(名稱) (呼叫端可歸還已取得的名額)
+
+        Returns:
+            (名稱, 結果)；全部失敗回傳 (None, None)
+        """
+        calls = iter(calls)
+        pending = {}   # future -> 名稱
+        order = []     # 啟動順序
+        exhausted = False
+
+        def launch_next():
+            nonlocal exhausted
+            for name, fn in calls:
+                pending[self._executor.submit(fn)] = name
+                order.append(name)
+                return True
+            exhausted = True
+            return False
+
+        launch_next()
+        try:
+            while pending:
+                # 還有備援時，最多等「最後啟動的模型」的對沖延遲
+                timeout = None if exhausted else self.hedge_delay(order[-1])
+                done, _ = wait(list(pending), timeout=timeout, return_when=FIRST_COMPLETED)
+                if not done:
+                    launch_next()  # 逾時：送出下一個備援
+                    continue
+                for future in done:
+                    name = pending.pop(future)
+                    try:
+                        result = future.result()
+                    except Exception as e:
+                        if on_error:
+                            on_error(name, e)
+                        continue
+                    self._record(len(order), backup_won=name != order[0])
+                    return name, result
+                if not pending:
+                    launch_next()  # 執行中的全部失敗：立即改送下一個，不必等對沖延遲
+            self._record(len(order), failed=True)
+            return None, None
+        finally:
+            # 勝出後：尚未開始的取消，執行中的結果直接丟棄
+            for future, name in pending.items():
+                if future.cancel() and on_cancel:
+                    on_cancel(name)
+
+    def _record(self, launched, backup_won=False, failed=False):
+        with self._lock:
+            self._stats['calls'] += 1
+            if launched > 1:
+                self._stats['hedged'] += 1
+            if backup_won:
+                self._stats['backup_wins'] += 1
+            if failed:
+                self._stats['all_failed'] += 1
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats)
@@ -0,0 +1,433 @@
+"""
+LLM 供應商外掛模組
+OutfitAIAgent 的模型清單改由這裡建立，不再寫死 Gemini / Groq / DeepSeek：
+
+- LLM_PROVIDERS 決定要建立哪些模型與備援順序，格式 "種類[:名稱],..."，例如
+    gemini,groq,deepseek        (預設；沒有對應 API key 的略過)
+    fake                        離線假模型 (不連網、不需要 key)
+    fake:Gemini,fake:Groq       兩個假模型，沿用正式的名稱 (PROVIDER_RATE_LIMITS 等設定照樣套用)
+    replay                      從錄製檔 (LLM_CASSETTE) 回放先前錄下的回應
+- LLM_RECORD=on 時，真實模型的回應會錄進 LLM_CASSETTE，之後可用 replay 離線重現
+  (LLM_REPLAY_MATCH=input 時依「使用者原始問句 + 第幾輪 + 模型名稱」比對，提示詞中的檢索結果不同也能命中)
+- 所有模型都包成 {"name", "llm"}，llm 只需要 invoke(prompt) / stream(prompt)
+  (回傳有 .content 的物件)，所以備援、熔斷、速率限制、對話儲存走的是同一套程式
+- 其他種類可用 register_provider() 註冊，或在 LLM_PROVIDER_PLUGINS 列出模組 (匯入時自行註冊)
+"""
+
+import hashlib
+import importlib
+import json
+import os
+import random
+import sys
+import threading
+import time
+
+LLM_PROVIDERS = os.getenv('LLM_PROVIDERS', 'gemini,groq,deepseek')
+LLM_PROVIDER_PLUGINS = os.getenv('LLM_PROVIDER_PLUGINS', '')               # 逗號分隔的模組名稱
+LLM_CASSETTE = os.getenv('LLM_CASSETTE', '/app/data/llm_cassette.jsonl')   # 錄製 / 回放檔 (JSON Lines)
+LLM_RECORD = os.getenv('LLM_RECORD', 'off').lower() in ('1', 'on', 'true', 'yes')
+LLM_REPLAY_LATENCY = os.getenv('LLM_REPLAY_LATENCY', 'recorded')          # recorded: 重現錄製時的延遲 / 0: 不延遲
+# prompt: 只回放完全相同的提示詞 / input: 提示詞不同時再依原始問句 + 第幾輪比對 (同模型名稱的錄製優先)
+LLM_REPLAY_MATCH = os.getenv('LLM_REPLAY_MATCH', 'input')
+
+# 假模型設定
+FAKE_LLM_LATENCY = os.getenv('FAKE_LLM_LATENCY', 'lognormal:0.8,0.5')
+FAKE_LLM_ERROR_RATE = float(os.getenv('FAKE_LLM_ERROR_RATE', '0'))        # 回傳一般錯誤的機率
+FAKE_LLM_429_RATE = float(os.getenv('FAKE_LLM_429_RATE', '0'))            # 回傳 429 的機率
+FAKE_LLM_SEED = os.getenv('FAKE_LLM_SEED', '')                            # 亂數種子 (空白表示不固定)
+
+# 預設的顯示名稱
+DEFAULT_NAMES = {'gemini': 'Gemini', 'groq': 'Groq', 'deepseek': 'DeepSeek', 'fake': 'Fake', 'replay': 'Replay'}
+
+
+class ProviderUnavailable(Exception):
+    """這個供應商無法建立 (例如缺少 API key)，略過即可"""
+
+
+class Prompt(str):
+    """
+    提示詞字串，另外帶著回放比對用的 replay_key (使用者原始問句 + 第幾輪)
+    提示詞含有檢索結果 (隨機抽樣 / 推薦池)，每次執行都可能不同；replay_key 只取穩定的輸入
+    """
+    replay_key = None
+
+
+def tag_prompt(prompt, query, turn=0):
+    """幫提示詞加上 replay_key (仍是 str，真實模型照常使用)"""
+    tagged = Prompt(prompt)
+    tagged.replay_key = hashlib.sha256(f"{turn}\n{query}".encode('utf-8')).hexdigest()
+    return tagged
+
+
+class LLMMessage:
+    """與 LangChain 回應相同，內容放在 .content"""
+    __slots__ = ('content',)
+
+    def __init__(self, content):
+        self.content = content
+
+
+# =======================
+# LangChain 供應商
+# =======================
+def _gemini(name, keys):
+    if not keys.get('gemini'):
+        raise ProviderUnavailable("缺少 API key")
+    from langchain_google_genai import ChatGoogleGenerativeAI
+    return ChatGoogleGenerativeAI(
+        model="gemini-2.0-flash-lite",  # Lite 版本:更高 RPM/TPM
+        google_api_key=keys['gemini'],
+        temperature=0.5,  # 降低溫度,減少隨機性
+        max_output_tokens=300  # 減少輸出長度,降低 TPM
+    )
+
+
+def _groq(name, keys):
+    if not keys.get('groq'):
+        raise ProviderUnavailable("缺少 API key")
+    from langchain_groq import ChatGroq
+    return ChatGroq(
+        model="llama-3.3-70b-versatile",
+        groq_api_key=keys['groq'],
+        temperature=1.0,
+        max_tokens=200
+    )
+
+
+def _deepseek(name, keys):
+    if not keys.get('deepseek'):
+        raise ProviderUnavailable("缺少 API key")
+    from langchain_openai import ChatOpenAI
+    return ChatOpenAI(
+        model="deepseek-chat",
+        openai_api_key=keys['deepseek'],
+        openai_api_base="https://api.deepseek.com",
+        temperature=1.0,
+        max_tokens=200
+    )
+
+
+# =======================
+# 離線假模型
+# =======================
+FAKE_REPLIES = [
+    "1. 白T + 牛仔褲，簡單清爽\n2. 襯衫 + 卡其褲，休閒又有質感",
+    "1. 針織衫 + 長裙，溫柔約會感\n2. 洋裝 + 休閒鞋，輕鬆好走",
+    "1. 西裝外套 + 西裝褲，正式俐落\n2. 襯衫 + 針織背心，上班不無聊",
+    "1. 運動上衣 + 運動褲，透氣好活動\n2. 連帽衫 + 運動鞋，街頭感十足",
+]
+
+
+def parse_latency(spec):
+    """
+    延遲分布 -> 抽樣函數 (秒)
+
+    格式:
+        fixed:0.5              固定 0.5 秒
+        uniform:0.2,1.0        0.2 ~ 1.0 秒均勻分布
+        lognormal:0.8,0.5      中位數 0.8 秒、sigma 0.5 的對數常態分布 (有長尾，最接近真實模型)
+        0                      不延遲
+    """
+    kind, _, args = str(spec).partition(':')
+    if not args:
+        value = float(kind)
+        return lambda rng: value
+    params = [float(x) for x in args.split(',')]
+    if kind == 'fixed':
+        return lambda rng: params[0]
+    if kind == 'uniform':
+        low, high = params
+        return lambda rng: rng.uniform(low, high)
+    if kind == 'lognormal':
+        median, sigma = params
+        return lambda rng: median * rng.lognormvariate(0.0, sigma)
+    raise ValueError(f"未知的延遲分布: {spec}")
+
+
+class FakeChatModel:
+    """
+    決定性的假模型：同樣的提示詞回傳同樣的內容
+    延遲依分布抽樣；可依機率丟出一般錯誤或 429 (測試備援 / 熔斷 / 速率限制路徑)
+    """
+
+    def __init__(self, name='Fake', latency=FAKE_LLM_LATENCY, error_rate=FAKE_LLM_ERROR_RATE,
+                 rate_limit_rate=FAKE_LLM_429_RATE, seed=None, replies=FAKE_REPLIES, chunk_size=8):
+        self.name = name
+        self._latency = parse_latency(latency)
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.replies = list(replies)
+        self.chunk_size = chunk_size
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def reply(self, prompt):
+        digest = hashlib.sha256(str(prompt).encode('utf-8')).digest()
+        return self.replies[digest[0] % len(self.replies)]
+
+    def _delay_and_maybe_fail(self):
+        with self._lock:
+            delay = self._latency(self._rng)
+            roll = self._rng.random()
+        time.sleep(delay)
+        if roll < self.rate_limit_rate:
+            raise RuntimeError(f"429 Rate Limit: {self.name} (fake)")
+        if roll < self.rate_limit_rate + self.error_rate:
+            raise RuntimeError(f"503 Service Unavailable: {self.name} (fake)")
+
+    def invoke(self, prompt):
+        self._delay_and_maybe_fail()
+        return LLMMessage(self.reply(prompt))
+
+    def stream(self, prompt):
+        # 延遲與錯誤都在第一段文字之前
+        self._delay_and_maybe_fail()
+        text = self.reply(prompt)
+        for i in range(0, len(text), self.chunk_size):
+            yield LLMMessage(text[i:i + self.chunk_size])
+
+
+def _fake(name, keys):
+    seed = f"{FAKE_LLM_SEED}:{name}" if FAKE_LLM_SEED else None
+    return FakeChatModel(name, seed=seed)
+
+
+# =======================
+# 錄製 / 回放
+# =======================
+def prompt_key(prompt):
+    return hashlib.sha256(str(prompt).encode('utf-8')).hexdigest()
+
+
+class Cassette:
+    """
+    錄製檔 (JSON Lines，每行一筆)：
+        {"key": 提示詞雜湊, "input_key": 原始問句 + 第幾輪的雜湊, "provider": 名稱,
+         "prompt": ..., "response": ..., "latency": 秒}
+    同一個提示詞錄到多次時，回放依序輪流使用
+    """
+
+    def __init__(self, path=LLM_CASSETTE, match=LLM_REPLAY_MATCH):
+        self.path = path
+        self.match = match
+        self._entries = {}
+        self._by_input = {}
+        self._cursor = {}
+        self._lock = threading.Lock()
+        self._loaded = False
+
+    def _load(self):
+        if self._loaded:
+            return
+        self._loaded = True
+        if not self.path or not os.path.exists(self.path):
+            return
+        with open(self.path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue
+                self._add(entry)
+
+    def _add(self, entry):
+        self._entries.setdefault(entry['key'], []).append(entry)
+        if entry.get('input_key'):
+            self._by_input.setdefault(entry['input_key'], []).append(entry)
+
+    def _next(self, cursor_key, entries):
+        i = self._cursor.get(cursor_key, 0)
+        self._cursor[cursor_key] = i + 1
+        return entries[i % len(entries)]
+
+    def lookup(self, prompt, provider=None):
+        """
+        回傳錄製的 entry (沒有錄到回傳 None)
+        先找完全相同的提示詞；match=input 時再依 replay_key 找，同模型名稱的錄製優先
+        """
+        key = prompt_key(prompt)
+        replay_key = getattr(prompt, 'replay_key', None)
+        with self._lock:
+            self._load()
+            entries = self._entries.get(key)
+            if entries:
+                return self._next(key, entries)
+            if self.match != 'input' or not replay_key:
+                return None
+            entries = self._by_input.get(replay_key)
+            if not entries:
+                return None
+            same_provider = [e for e in entries if e.get('provider') == provider]
+            if same_provider:
+                return self._next((replay_key, provider), same_provider)
+            return self._next((replay_key, None), entries)
+
+    def record(self, provider, prompt, response, latency):
+        entry = {"key": prompt_key(prompt), "input_key": getattr(prompt, 'replay_key', None),
+                 "provider": provider, "prompt": str(prompt), "response": response,
+                 "latency": round(latency, 4)}
+        with self._lock:
+            self._load()
+            self._add(entry)
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(entry, ensure_ascii=False) + '\n')
+
+    def __len__(self):
+        with self._lock:
+            self._load()
+            return sum(len(v) for v in self._entries.values())
+
+
+class ReplayChatModel:
+    """從錄製檔回放；沒有錄到的提示詞丟出錯誤 (走正常的備援路徑)"""
+
+    def __init__(self, name='Replay', cassette=None, latency=LLM_REPLAY_LATENCY, chunk_size=8):
+        self.name = name
+        self.cassette = cassette or Cassette()
+        self.replay_latency = latency == 'recorded'
+        self.chunk_size = chunk_size
+
+    def _entry(self, prompt):
+        entry = self.cassette.lookup(prompt, provider=self.name)
+        if entry is None:
+            raise LookupError(f"{self.name}: 錄製檔中沒有這個提示詞 ({prompt_key(prompt)[:12]})")
+        if self.replay_latency:
+            time.sleep(entry.get('latency') or 0)
+        return entry['response']
+
+    def invoke(self, prompt):
+        return LLMMessage(self._entry(prompt))
+
+    def stream(self, prompt):
+        text = self._entry(prompt)
+        for i in range(0, len(text), self.chunk_size):
+            yield LLMMessage(text[i:i + self.chunk_size])
+
+
+class RecordingChatModel:
+    """包住真實模型，把回應 (含延遲) 錄進錄製檔"""
+
+    def __init__(self, name, llm, cassette):
+        self.name = name
+        self.llm = llm
+        self.cassette = cassette
+
+    def invoke(self, prompt):
+        started = time.monotonic()
+        response = self.llm.invoke(prompt)
+        text = response.content if hasattr(response, 'content') else str(response)
+        self.cassette.record(self.name, prompt, text, time.monotonic() - started)
+        return response
+
+    def stream(self, prompt):
+        started = time.monotonic()
+        first_token = None
+        chunks = []
+        for chunk in self.llm.stream(prompt):
+            if first_token is None:
+                first_token = time.monotonic() - started
+            chunks.append(chunk.content if hasattr(chunk, 'content') else str(chunk))
+            yield chunk
+        if chunks:
+            self.cassette.record(self.name, prompt, ''.join(chunks), first_token or 0.0)
+
+
+_cassettes = {}
+
+
+def get_cassette(path=LLM_CASSETTE):
+    """同一個檔案共用一個 Cassette (錄製與回放看到一致的內容)"""
+    cassette = _cassettes.get(path)
+    if cassette is None:
+        cassette = _cassettes[path] = Cassette(path)
+    return cassette
+
+
+def _replay(name, keys):
+    return ReplayChatModel(name, get_cassette())
+
+
+# =======================
+# 註冊表
+# =======================
+# 種類 -> (建立函數 factory(name, keys), 是否連網；連網的才會被 LLM_RECORD 錄製)
+_PROVIDERS = {
+    'gemini': (_gemini, True),
+    'groq': (_groq, True),
+    'deepseek': (_deepseek, True),
+    'fake': (_fake, False),
+    'replay': (_replay, False),
+}
+
+
+def register_provider(kind, factory, live=True):
+    """
+    註冊新的供應商種類
+
+    Args:
+        factory: factory(name, keys) -> 有 invoke / stream 的模型；無法建立時丟出 ProviderUnavailable
+        live: 是否為真實 (連網) 模型
+    """
+    _PROVIDERS[kind.lower()] = (factory, live)
+
+
+def _load_plugins():
+    for module in filter(None, (m.strip() for m in LLM_PROVIDER_PLUGINS.split(','))):
+        try:
+            importlib.import_module(module)
+        except Exception as e:
+            print(f"⚠️  LLM 外掛 {module} 載入失敗: {e}", flush=True, file=sys.stderr)
+
+
+def parse_providers(spec=None):
+    """ "gemini,fake:Groq" -> [("gemini", "Gemini"), ("fake", "Groq")] """
+    result = []
+    for entry in (spec if spec is not None else LLM_PROVIDERS).split(','):
+        entry = entry.strip()
+        if not entry:
+            continue
+        kind, _, name = entry.partition(':')
+        kind = kind.strip().lower()
+        result.append((kind, name.strip() or DEFAULT_NAMES.get(kind, kind)))
+    return result
+
+
+def offline_providers_configured(spec=None):
+    """LLM_PROVIDERS 是否包含不需要 API key 的種類 (fake / replay)"""
+    return any(kind in ('fake', 'replay') for kind, _ in parse_providers(spec))
+
+
+def build_llms(keys, spec=None, record=LLM_RECORD):
+    """
+    依 LLM_PROVIDERS 建立模型清單 (備援順序)
+
+    Args:
+        keys: {"gemini": key, "groq": key, "deepseek": key, ...}
+        record: 真實模型的回應是否錄進 LLM_CASSETTE
+
+    Returns:
+        [{"name": 名稱, "llm": 模型}, ...]
+    """
+    _load_plugins()
+    llms = []
+    for kind, name in parse_providers(spec):
+        registered = _PROVIDERS.get(kind)
+        if registered is None:
+            print(f"⚠️  未知的 LLM 供應商: {kind}", flush=True, file=sys.stderr)
+            continue
+        factory, live = registered
+        try:
+            llm = factory(name, keys)
+        except ProviderUnavailable:
+            continue
+        except Exception as e:
+            print(f"⚠️  {name} 初始化失敗: {e}", flush=True, file=sys.stderr)
+            continue
+        if record and live:
+            llm = RecordingChatModel(name, llm, get_cassette())
+        llms.append({"name": name, "llm": llm})
+    return llms
@@ -0,0 +1,394 @@
+"""
+效能指標模組 (Prometheus 文字格式)
+取代只能翻 print 記錄猜測慢在哪裡的做法：
+
+- span(pipeline, stage) 量測推薦流程每個階段 (關鍵字、查詢、標準化、LLM、儲存對話...) 的耗時，
+  寫入 outfit_stage_seconds 直方圖
+- LLM 供應商的延遲 / 成功失敗、備援原因、回應快取命中以計數器累計
+- init_metrics(app) 由 create_app() 呼叫：加上每個 endpoint 的請求延遲，並提供 /metrics
+- 熱路徑只有 perf_counter + bisect + 一個短鎖，不配置物件、不做 I/O
+- gunicorn 多 worker 時設定 METRICS_DIR：每個 worker 定期把自己的數值寫成 <pid>.json，
+  /metrics 合併所有 worker 的檔案後輸出 (未設定則只輸出目前 worker)
+- worker 結束時 (gunicorn.conf.py 的 child_exit，或 /metrics 發現該 PID 已不存在)
+  把它的數值併入 archive.json 並刪除 <pid>.json：總數不會倒退，PID 被重用也不會蓋掉舊數值
+"""
+
+import atexit
+import bisect
+import fcntl
+import json
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+METRICS_ENABLED = os.getenv('METRICS_ENABLED', 'on').lower() not in ('0', 'off', 'false', 'no')
+METRICS_DIR = os.getenv('METRICS_DIR', '')                               # 多 worker 合併用的共用目錄
+METRICS_FLUSH_INTERVAL = float(os.getenv('METRICS_FLUSH_INTERVAL', '5'))  # 幾秒寫入一次 METRICS_DIR
+# 直方圖的桶 (秒)
+METRICS_BUCKETS = tuple(float(b) for b in os.getenv(
+    'METRICS_BUCKETS', '0.001,0.005,0.01,0.025,0.05,0.1,0.25,0.5,1,2.5,5,10,30').split(','))
+
+
+ARCHIVE_FILE = 'archive.json'   # 已結束 worker 的累計數值
+LOCK_FILE = '.lock'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(names, values, extra=None):
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _format_float(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+# =======================
+# 指標型別
+# =======================
+class Counter:
+    """只增不減的計數器 (依標籤分開累計)"""
+    kind = 'counter'
+
+    def __init__(self, name, help_text, labelnames=()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels, amount=1.0):
+        if not METRICS_ENABLED:
+            return
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0.0) + amount
+
+    def snapshot(self):
+        with self._lock:
+            return [[list(k), v] for k, v in self._values.items()]
+
+    @staticmethod
+    def merge(a, b):
+        return a + b
+
+    def render(self, values):
+        lines = []
+        for labels, value in values:
+            lines.append(f'{self.name}{_labels(self.labelnames, labels)} {_format_float(value)}')
+        return lines
+
+
+class Histogram:
+    """直方圖：每組標籤一個 [各桶計數..., 總和, 次數]"""
+    kind = 'histogram'
+
+    def __init__(self, name, help_text, labelnames=(), buckets=METRICS_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labels):
+        if not METRICS_ENABLED:
+            return
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            row = self._values.get(labels)
+            if row is None:
+                row = self._values[labels] = [0] * (len(self.buckets) + 1) + [0.0, 0]
+            row[i] += 1
+            row[-2] += value
+            row[-1] += 1
+
+    def snapshot(self):
+        with self._lock:
+            return [[list(k), list(v)] for k, v in self._values.items()]
+
+    @staticmethod
+    def merge(a, b):
+        return [x + y for x, y in zip(a, b)]
+
+    def render(self, values):
+        lines = []
+        for labels, row in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), row):
+                cumulative += count
+                le = 'le="' + _format_float(bound) + '"'
+                lines.append(f'{self.name}_bucket{_labels(self.labelnames, labels, le)} {cumulative}')
+            lines.append(f'{self.name}_sum{_labels(self.labelnames, labels)} {row[-2]!r}')
+            lines.append(f'{self.name}_count{_labels(self.labelnames, labels)} {row[-1]}')
+        return lines
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+        self._flusher = None
+
+    def _register(self, cls, name, help_text, labelnames, **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(name, help_text, labelnames, **kwargs)
+            return metric
+
+    def counter(self, name, help_text, labelnames=()):
+        return self._register(Counter, name, help_text, labelnames)
+
+    def histogram(self, name, help_text, labelnames=(), buckets=METRICS_BUCKETS):
+        return self._register(Histogram, name, help_text, labelnames, buckets=buckets)
+
+    def snapshot(self):
+        return {name: metric.snapshot() for name, metric in self._metrics.items()}
+
+    # ---------- 多 worker 合併 ----------
+    def _path(self, pid=None):
+        return os.path.join(METRICS_DIR, f'{pid or os.getpid()}.json')
+
+    def _read_dir(self):
+        """讀取其他 worker 與 archive.json 的數值；順便封存已不存在的 worker (持有共享鎖，封存時改持排他鎖)"""
+        own = os.getpid()
+        dead = []
+        for filename in os.listdir(METRICS_DIR):
+            stem, ext = os.path.splitext(filename)
+            if ext == '.json' and stem.isdigit() and int(stem) != own and not _pid_alive(int(stem)):
+                dead.append(int(stem))
+        for pid in dead:
+            mark_process_dead(pid)
+
+        snapshots = []
+        with _dir_lock(fcntl.LOCK_SH):
+            for filename in os.listdir(METRICS_DIR):
+                stem, ext = os.path.splitext(filename)
+                if ext != '.json' or stem == str(own) or not (stem.isdigit() or filename == ARCHIVE_FILE):
+                    continue
+                try:
+                    with open(os.path.join(METRICS_DIR, filename), encoding='utf-8') as f:
+                        snapshots.append(json.load(f))
+                except (OSError, ValueError):
+                    continue
+        return snapshots
+
+    def flush(self):
+        """把目前 worker 的數值寫入 METRICS_DIR (先寫暫存檔再改名，讀取端不會看到一半的檔案)"""
+        path = self._path()
+        tmp = path + '.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(self.snapshot(), f, ensure_ascii=False)
+        os.replace(tmp, path)
+
+    def _flush_loop(self):
+        while True:
+            time.sleep(METRICS_FLUSH_INTERVAL)
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"⚠️ 指標寫入失敗: {e}", flush=True, file=sys.stderr)
+
+    def start_flusher(self):
+        """啟動背景寫入 (只有設定 METRICS_DIR 時)"""
+        if not METRICS_DIR or self._flusher is not None:
+            return
+        os.makedirs(METRICS_DIR, exist_ok=True)
+        # 同一個 PID 的舊 worker 沒被封存 (例如沒有 child_exit hook)：先封存，避免被這個 worker 蓋掉
+        mark_process_dead(os.getpid())
+        self._flusher = threading.Thread(target=self._flush_loop, name='metrics-flush', daemon=True)
+        self._flusher.start()
+        atexit.register(self._final_flush)
+
+    def _final_flush(self):
+        """正常結束前寫入最後的數值 (child_exit 封存時才不會少算最後幾秒)"""
+        try:
+            self.flush()
+        except Exception:
+            pass
+
+    def _collect(self):
+        """所有 worker 的數值 (其他 worker 讀檔，自己用記憶體中的最新值)"""
+        snapshots = [self.snapshot()]
+        if METRICS_DIR and os.path.isdir(METRICS_DIR):
+            snapshots += self._read_dir()
+
+        merged = {}
+        for snapshot in snapshots:
+            for name, values in snapshot.items():
+                metric = self._metrics.get(name)
+                if metric is None:
+                    continue
+                target = merged.setdefault(name, {})
+                for labels, value in values:
+                    key = tuple(labels)
+                    target[key] = metric.merge(target[key], value) if key in target else value
+        return merged
+
+    def render(self):
+        """Prometheus 文字格式 (text/plain; version=0.0.4)"""
+        merged = self._collect()
+        lines = []
+        for name, metric in sorted(self._metrics.items()):
+            lines.append(f'# HELP {name} {metric.help}')
+            lines.append(f'# TYPE {name} {metric.kind}')
+            values = sorted(merged.get(name, {}).items())
+            lines.extend(metric.render(values))
+        return '\n'.join(lines) + '\n'
+
+
+# =======================
+# 已結束的 worker
+# =======================
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+@contextmanager
+def _dir_lock(lock_type, directory=None):
+    with open(os.path.join(directory or METRICS_DIR, LOCK_FILE), 'a') as f:
+        fcntl.flock(f.fileno(), lock_type)
+        try:
+            yield
+        finally:
+            fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+
+def _merge_values(a, b):
+    """計數器為數字相加，直方圖為 [各桶計數..., 總和, 次數] 逐項相加"""
+    if isinstance(a, list):
+        return [x + y for x, y in zip(a, b)]
+    return a + b
+
+
+def mark_process_dead(pid, directory=None):
+    """
+    把已結束 worker 的 <pid>.json 併入 archive.json 後刪除
+    (gunicorn.conf.py 的 child_exit 呼叫；/metrics 發現 PID 不存在時也會呼叫)
+    """
+    directory = directory or METRICS_DIR
+    if not directory or not os.path.isdir(directory):
+        return
+    path = os.path.join(directory, f'{pid}.json')
+    archive_path = os.path.join(directory, ARCHIVE_FILE)
+    with _dir_lock(fcntl.LOCK_EX, directory):
+        try:
+            with open(path, encoding='utf-8') as f:
+                dead = json.load(f)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError):
+            dead = {}
+        try:
+            with open(archive_path, encoding='utf-8') as f:
+                archive = json.load(f)
+        except (OSError, ValueError):
+            archive = {}
+        for name, values in dead.items():
+            merged = {tuple(labels): value for labels, value in archive.get(name, [])}
+            for labels, value in values:
+                key = tuple(labels)
+                merged[key] = _merge_values(merged[key], value) if key in merged else value
+            archive[name] = [[list(k), v] for k, v in merged.items()]
+        tmp = archive_path + '.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(archive, f, ensure_ascii=False)
+        os.replace(tmp, archive_path)
+        os.remove(path)
+
+
+def clear_metrics_dir(directory=None):
+    """清掉上一次執行留下的檔案 (gunicorn master 啟動時呼叫，重啟後計數從 0 開始)"""
+    directory = directory or METRICS_DIR
+    if not directory or not os.path.isdir(directory):
+        return
+    for filename in os.listdir(directory):
+        if filename.endswith(('.json', '.tmp')):
+            try:
+                os.remove(os.path.join(directory, filename))
+            except OSError:
+                pass
+
+
+# =======================
+# 全域指標
+# =======================
+registry = MetricsRegistry()
+
+STAGE_SECONDS = registry.histogram(
+    'outfit_stage_seconds', '推薦流程各階段耗時 (秒)', ('pipeline', 'stage'))
+HTTP_SECONDS = registry.histogram(
+    'outfit_http_request_seconds', 'HTTP 請求耗時 (秒)', ('endpoint', 'method', 'status'))
+LLM_SECONDS = registry.histogram(
+    'outfit_llm_seconds', 'LLM 呼叫耗時 (秒，串流為首段文字延遲)', ('provider',))
+LLM_REQUESTS = registry.counter(
+    'outfit_llm_requests_total', 'LLM 呼叫次數', ('provider', 'outcome'))
+LLM_FALLBACKS = registry.counter(
+    'outfit_llm_fallbacks_total', '略過或換下一個模型的次數', ('provider', 'reason'))
+LLM_CACHE = registry.counter(
+    'outfit_llm_cache_total', 'LLM 回應快取查詢結果 (hit / miss / bypass)', ('result',))
+
+
+class span:
+    """
+    量測一個階段的耗時：
+
+        with span('recommend', 'db_query'):
+            ...
+
+    例外也會記錄 (耗時照算)，不吞例外
+    """
+    __slots__ = ('labels', 'started')
+
+    def __init__(self, pipeline, stage):
+        self.labels = (pipeline, stage)
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        STAGE_SECONDS.observe(time.perf_counter() - self.started, *self.labels)
+        return False
+
+
+# =======================
+# Flask 整合
+# =======================
+def init_metrics(app):
+    """在 create_app() 中呼叫：記錄每個請求的延遲，並註冊 /metrics"""
+    from flask import Response, g, request
+
+    @app.before_request
+    def _metrics_start():
+        g._metrics_started = time.perf_counter()
+
+    @app.after_request
+    def _metrics_observe(response):
+        started = g.pop('_metrics_started', None)
+        if started is not None:
+            HTTP_SECONDS.observe(time.perf_counter() - started,
+                                 request.endpoint or 'unmatched', request.method, str(response.status_code))
+        return response
+
+    @app.route('/metrics')
+    def metrics():
+        return Response(registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+    registry.start_flusher()
+    return app
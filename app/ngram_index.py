@@ -0,0 +1,94 @@
+"""
+N-gram 倒排索引模組
+取代 `name LIKE '%x%'` 這種無法使用索引的前置萬用字元查詢
+
+- 每個字串拆成 unigram + bigram (中文逐字、英文逐字母皆適用)
+- posting list 以 NumPy int32 陣列存放「列位置」
+- 查詢時取關鍵字所有 bigram 的 posting list 交集，再用實際字串驗證一次 (排除偽陽性)
+"""
+
+import numpy as np
+
+_EMPTY = np.empty(0, dtype=np.int32)
+
+
+def _grams(text):
+    """字串的 unigram + bigram 集合"""
+    if not text:
+        return set()
+    grams = set(text)
+    grams.update(text[i:i + 2] for i in range(len(text) - 1))
+    return grams
+
+
+def _query_grams(term):
+    """查詢用的 gram：長度 1 用 unigram，其餘用 bigram"""
+    if len(term) == 1:
+        return [term]
+    return list({term[i:i + 2] for i in range(len(term) - 1)})
+
+
+class NgramIndex:
+    """字串列表的倒排索引 (建好後唯讀，更新會產生新物件)"""
+
+    def __init__(self, postings=None):
+        self.postings = postings or {}  # gram -> 排序過的列位置陣列
+
+    @classmethod
+    def build(cls, texts):
+        """由字串列表建立索引 (None 表示該列沒有值)"""
+        lists = {}
+        for pos, text in enumerate(texts):
+            for gram in _grams(text):
+                lists.setdefault(gram, []).append(pos)
+        return cls({g: np.array(v, dtype=np.int32) for g, v in lists.items()})
+
+    def extended(self, updates):
+        """
+        加入新增/更新的列，回傳新的索引 (未受影響的 posting list 直接共用)
+
+        Args:
+            updates: {列位置: 新字串}
+        舊字串留下的 posting 不移除，查詢時的字串驗證會把它們濾掉
+        """
+        added = {}
+        for pos, text in updates.items():
+            for gram in _grams(text):
+                added.setdefault(gram, []).append(pos)
+        postings = dict(self.postings)
+        for gram, positions in added.items():
+            new = np.array(positions, dtype=np.int32)
+            old = postings.get(gram)
+            postings[gram] = new if old is None else np.union1d(old, new).astype(np.int32)
+        return NgramIndex(postings)
+
+    def candidates(self, term):
+        """回傳可能包含 term 的列位置 (尚未驗證)"""
+        grams = _query_grams(term)
+        lists = [self.postings.get(g, _EMPTY) for g in grams]
+        lists.sort(key=len)  # 從最短的 posting list 開始交集
+        result = lists[0]
+        for arr in lists[1:]:
+            if not len(result):
+                break
+            result = np.intersect1d(result, arr, assume_unique=True)
+        return result
+
+    def search(self, term, texts, exact=False):
+        """
+        回傳實際符合的列位置
+
+        Args:
+            term: 已正規化的關鍵字
+            texts: 建索引時的字串列表 (用來驗證候選)
+            exact: True 表示整串相等，False 表示包含
+        """
+        if not term:
+            return _EMPTY
+        cand = self.candidates(term)
+        if exact:
+            return np.array([p for p in cand if texts[p] == term], dtype=np.int32)
+        return np.array([p for p in cand if texts[p] is not None and term in texts[p]], dtype=np.int32)
+
+    def nbytes(self):
+        return sum(arr.nbytes for arr in self.postings.values())
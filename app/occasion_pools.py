@@ -0,0 +1,242 @@
+"""
+場合推薦池模組 (離線預先計算)
+每個場合/風格對應固定的衣物類型，候選商品只有在商品目錄改變時才會變：
+
+- 離線 (pipeline/06_build_occasion_pools.py，05 匯入後執行) 為每個「場合 × 性別」
+  算好排序過、款式與顏色分散的候選池，寫入 occasion_pools 表
+- 線上 worker 整批載入記憶體，推薦時只取池的前段再抽樣，不必即時跑 OR / LIKE 查詢
+- 池記錄計算時的 catalog_meta 版本；與目前版本不同 (匯入後還沒重算) 就視為不可用，
+  由呼叫端改用即時檢索
+"""
+
+import os
+import sys
+import time
+import threading
+from collections import OrderedDict
+
+# =======================
+# 場合/風格 -> 衣物類型
+# =======================
+OCCASION_STYLE_MAPPING = {
+    '運動': ['運動褲', '運動鞋', '運動上衣', '運動外套', 'T恤'],
+    '正式': ['襯衫', '西裝褲', '皮鞋', '西裝外套', '領帶', '正裝襯衫'],
+    '上班': ['襯衫', '西裝褲', '皮鞋', '西裝外套', '針織衫', '卡其褲'],
+    '約會': ['洋裝', '襯衫', '裙子', '休閒鞋', '針織衫'],
+    '休閒': ['T恤', '牛仔褲', '休閒褲', '運動鞋', '連帽衫'],
+    '街頭': ['連帽衫', '牛仔褲', '運動鞋', '棒球帽', 'T恤'],
+    '文青': ['襯衫', '帆布鞋', '卡其褲', '針織衫', '漁夫帽'],
+    '韓風': ['寬褲', '老爹鞋', '大學T', '西裝外套', '襯衫'],
+    '工裝': ['工作褲', '靴子', '工作襯衫', '吊帶褲'],
+}
+
+# 每個池保留幾件
+OCCASION_POOL_SIZE = int(os.getenv('OCCASION_POOL_SIZE', '100'))
+# 多久檢查一次池是否重算過 (秒)
+OCCASION_POOL_CHECK_INTERVAL = float(os.getenv('OCCASION_POOL_CHECK_INTERVAL', '30'))
+
+ALL_GENDERS = ''                         # 不分性別的池
+UNISEX_GENDERS = (None, '', '-', '中性')  # 任何性別的池都包含這些商品
+
+
+# =======================
+# 離線計算
+# =======================
+def _norm(value):
+    return value.strip().casefold() if isinstance(value, str) else ''
+
+
+def _matched_type(row, types):
+    """比對規則同線上檢索 (clothing_type = x OR name LIKE '%x%')，回傳第一個符合的衣物類型"""
+    clothing_type, name = _norm(row.get('clothing_type')), _norm(row.get('name'))
+    for t in types:
+        nt = _norm(t)
+        if clothing_type == nt or nt in name:
+            return t
+    return None
+
+
+def _round_robin(groups):
+    """輪流從每一組取一個，直到全部取完"""
+    queues = [list(g) for g in groups if g]
+    result = []
+    while queues:
+        for q in queues:
+            result.append(q.pop(0))
+        queues = [q for q in queues if q]
+    return result
+
+
+def _diversify(rows, key):
+    """依 key 分組後輪流取 (組內保持原本的排序)，避免同一類連續出現"""
+    groups = OrderedDict()
+    for row in rows:
+        groups.setdefault(key(row), []).append(row)
+    return _round_robin(groups.values())
+
+
+def build_pools(rows, scores=None, pool_size=OCCASION_POOL_SIZE):
+    """
+    計算每個「場合 × 性別」的候選池
+
+    Args:
+        rows: items 的列 (需有 id / name / clothing_type / color / gender)
+        scores: {item_id: 分數}，例如平均評分；沒有的當 0
+        pool_size: 每個池保留幾件
+
+    Returns:
+        {(場合, 性別): [item_id, ...]}，性別 '' 代表不分性別
+    """
+    scores = scores or {}
+    genders = sorted({r.get('gender') for r in rows if r.get('gender') not in UNISEX_GENDERS})
+    # 分數高的在前，同分依 id
+    ranked = sorted(rows, key=lambda r: (-scores.get(r['id'], 0.0), r['id']))
+
+    pools = {}
+    for occasion, types in OCCASION_STYLE_MAPPING.items():
+        by_type = OrderedDict((t, []) for t in types)
+        for row in ranked:
+            t = _matched_type(row, types)
+            if t is not None:
+                by_type[t].append(row)
+        # 先在每種衣物類型內分散顏色，再輪流取各類型
+        groups = [_diversify(g, key=lambda r: _norm(r.get('color'))) for g in by_type.values()]
+        for gender in (ALL_GENDERS, *genders):
+            if gender == ALL_GENDERS:
+                selected = groups
+            else:
+                selected = [[r for r in g if r.get('gender') in (gender, *UNISEX_GENDERS)] for g in groups]
+            pools[(occasion, gender)] = [r['id'] for r in _round_robin(selected)[:pool_size]]
+    return pools
+
+
+def load_item_scores(cur):
+    """平均評分 (評分數少時往整體平均拉近)；沒有 rating 表時回傳空 dict"""
+    try:
+        cur.execute("SELECT item_id, COUNT(*) AS n, AVG(rating_value) AS avg_rating FROM rating GROUP BY item_id")
+        rows = cur.fetchall()
+    except Exception:
+        return {}
+    if not rows:
+        return {}
+    prior_n = 3
+    total = sum(r['n'] for r in rows)
+    prior = sum(float(r['avg_rating']) * r['n'] for r in rows) / total
+    return {r['item_id']: (float(r['avg_rating']) * r['n'] + prior * prior_n) / (r['n'] + prior_n)
+            for r in rows}
+
+
+def save_pools(conn, pools, catalog_version):
+    """整批取代 occasion_pools 表的內容 (同一個交易，線上不會讀到一半)"""
+    rows = [(occasion, gender, rank, item_id, catalog_version)
+            for (occasion, gender), ids in pools.items()
+            for rank, item_id in enumerate(ids)]
+    conn.begin()
+    try:
+        with conn.cursor() as cur:
+            cur.execute("DELETE FROM occasion_pools")
+            cur.executemany(
+                "INSERT INTO occasion_pools (occasion, gender, rank_no, item_id, catalog_version) "
+                "VALUES (%s, %s, %s, %s, %s)", rows)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return len(rows)
+
+
+def rebuild_pools(conn, pool_size=OCCASION_POOL_SIZE):
+    """讀取目前的商品目錄並重算所有池，回傳 (池數, 列數, 版本)"""
+    with conn.cursor() as cur:
+        cur.execute("SELECT id, name, clothing_type, color, gender FROM items ORDER BY id")
+        rows = cur.fetchall()
+        scores = load_item_scores(cur)
+        cur.execute("SELECT version FROM catalog_meta WHERE name = 'items'")
+        meta = cur.fetchone()
+    version = meta['version'] if meta else 0
+    pools = build_pools(rows, scores, pool_size)
+    n_rows = save_pools(conn, pools, version)
+    return len(pools), n_rows, version
+
+
+# =======================
+# 線上讀取
+# =======================
+class OccasionPoolStore:
+    """每個 worker 一份，記憶體中的候選池 (定期檢查是否重算過)"""
+
+    def __init__(self, check_interval=OCCASION_POOL_CHECK_INTERVAL):
+        self.check_interval = check_interval
+        self._pools = {}
+        self._signature = None   # (池的版本, 目前目錄版本)
+        self._last_check = 0.0
+        self._lock = threading.Lock()
+        self._stats = {'hits': 0, 'misses': 0, 'reloads': 0}
+
+    def _refresh(self, cur):
+        if time.monotonic() - self._last_check < self.check_interval:
+            return
+        with self._lock:
+            if time.monotonic() - self._last_check < self.check_interval:
+                return
+            self._last_check = time.monotonic()
+            try:
+                cur.execute("SELECT MAX(catalog_version) AS v FROM occasion_pools")
+                pool_version = (cur.fetchone() or {}).get('v')
+                cur.execute("SELECT version FROM catalog_meta WHERE name = 'items'")
+                catalog_version = (cur.fetchone() or {}).get('version')
+            except Exception as e:
+                # 舊資料庫沒有這張表：一律改用即時檢索
+                print(f"⚠️ 無法讀取場合推薦池: {e}", flush=True, file=sys.stderr)
+                self._pools, self._signature = {}, None
+                return
+            signature = (pool_version, catalog_version)
+            if signature == self._signature:
+                return
+            pools = {}
+            if pool_version is not None and pool_version == catalog_version:
+                cur.execute("SELECT occasion, gender, item_id FROM occasion_pools "
+                            "ORDER BY occasion, gender, rank_no")
+                for row in cur.fetchall():
+                    pools.setdefault((row['occasion'], row['gender']), []).append(row['item_id'])
+                print(f"📦 場合推薦池已載入 ({len(pools)} 個池, 目錄版本 {catalog_version})",
+                      flush=True, file=sys.stderr)
+            else:
+                print("⚠️ 場合推薦池版本與商品目錄不符 (尚未重算)，暫時改用即時檢索",
+                      flush=True, file=sys.stderr)
+            self._pools, self._signature = pools, signature
+            self._stats['reloads'] += 1
+
+    def slice(self, cur, occasions, gender=None, limit=OCCASION_POOL_SIZE):
+        """
+        多個場合的池輪流合併後取前 limit 件 (已去重)
+
+        Returns:
+            item_id 列表；任何一個場合沒有可用的池時回傳 None (呼叫端改用即時檢索)
+        """
+        self._refresh(cur)
+        pools = self._pools
+        selected = []
+        for occasion in occasions:
+            ids = pools.get((occasion, gender or ALL_GENDERS))
+            if ids is None:
+                self._stats['misses'] += 1
+                return None
+            selected.append(ids)
+        self._stats['hits'] += 1
+        seen, result = set(), []
+        for item_id in _round_robin(selected):
+            if item_id not in seen:
+                seen.add(item_id)
+                result.append(item_id)
+                if len(result) >= limit:
+                    break
+        return result
+
+    def stats(self):
+        return {
+            'pools': len(self._pools),
+            'pool_version': self._signature[0] if self._signature else None,
+            'catalog_version': self._signature[1] if self._signature else None,
+            **self._stats,
+        }
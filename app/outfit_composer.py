@@ -0,0 +1,239 @@
+"""
+整套穿搭組合模組
+推薦不再只回傳零散單品，而是從 items 組出「上衣 + 下身 (+ 外套)」的完整穿搭：
+
+- 每件商品依 category / clothing_type 歸到 top / bottom / outer 欄位
+  (category 對應 05_database_import 的 map_clothing_type_to_category；外套由 clothing_type 判斷)
+- 性別、長度相容度先算成「字典代碼 × 字典代碼」的小矩陣，顏色用 Pantone 色盤和諧度矩陣 (color_harmony)，
+  組合分數用 NumPy broadcast 一次算完 (上衣 × 下身)，不跑 Python 雙層迴圈
+- 每個欄位先依單品分數剪枝到 OUTFIT_SLOT_CANDIDATES 件；每件上衣只留最搭的幾件下身，
+  再取前幾名配對，外套只對這些配對計算
+- 欄位代碼與相容矩陣依商品索引版本快取，目錄更新時自動重建
+"""
+
+import os
+import threading
+
+import numpy as np
+
+from catalog_index import get_catalog_index, MATCH_TYPE_OR_NAME
+from color_harmony import HARMONY_MATRIX
+
+OUTFIT_SLOT_CANDIDATES = int(os.getenv('OUTFIT_SLOT_CANDIDATES', '300'))  # 每個欄位最多保留幾件
+OUTFIT_PAIR_POOL = int(os.getenv('OUTFIT_PAIR_POOL', '20'))               # 每套穿搭保留幾個候選配對
+OUTFIT_W_BASE = float(os.getenv('OUTFIT_W_BASE', '1.0'))                  # 單品分數 (評分等) 權重
+OUTFIT_W_COLOR = float(os.getenv('OUTFIT_W_COLOR', '1.0'))                # 顏色相容度權重
+OUTFIT_W_LENGTH = float(os.getenv('OUTFIT_W_LENGTH', '0.5'))              # 長度比例權重
+
+TOP, BOTTOM, OUTER = 0, 1, 2
+SLOT_NAMES = ('top', 'bottom', 'outer')
+CATEGORY_SLOTS = {'top': TOP, 'bottom': BOTTOM, 'outer': OUTER}
+OUTER_MARKERS = ('外套', '夾克', '大衣', '風衣', '羽絨', '西裝外套')
+BOTTOM_MARKERS = ('褲', '裙')
+UNISEX_GENDERS = (None, '', '-', '中性')
+
+# 上衣長度 × 下身長度：短上衣配長下身比例最好，上下都長最容易顯得沉重
+LENGTH_SCORES = {
+    ('短', '長'): 1.0,
+    ('長', '短'): 0.8,
+    ('短', '短'): 0.7,
+    ('長', '長'): 0.6,
+}
+LENGTH_UNKNOWN_SCORE = 0.8
+
+
+def _lookup(values, fn, default):
+    """字典代碼 -> 值的陣列；最後多一格給 NULL (代碼 -1)"""
+    return np.array([fn(v) for v in values] + [default])
+
+
+def _pair_matrix(values, fn):
+    """字典代碼 × 字典代碼 的相容矩陣；最後一列 / 一欄給 NULL"""
+    values = list(values) + [None]
+    return np.array([[fn(a, b) for b in values] for a in values], dtype=np.float32)
+
+
+class _Tables:
+    """某個商品索引快照的欄位代碼與相容矩陣"""
+
+    def __init__(self, snap):
+        vocabs = snap.vocabs
+        cat_slot = _lookup(vocabs['category'].values, lambda v: CATEGORY_SLOTS.get(v, -1), -2)
+        type_slot = _lookup(vocabs['clothing_type'].values, self._type_slot, -1)
+        cat, typ = cat_slot[snap.codes['category']], type_slot[snap.codes['clothing_type']]
+        # 外套以 clothing_type 為準 (05 匯入時 category 只分 top / bottom)，其餘以 category 為準
+        slot = np.where(typ == OUTER, OUTER, np.where(cat >= 0, cat, np.where(typ >= 0, typ, TOP)))
+        # category 為鞋子 / 配件的不參與組合
+        slot[(cat == -1) & (typ != OUTER)] = -1
+        self.slot = slot
+
+        self.gender_values = list(vocabs['gender'].values)
+        self.gender = snap.codes['gender']
+        self.gender_ok = _pair_matrix(self.gender_values, self._gender_compatible).astype(bool)
+
+        self.length = snap.codes['length']
+        self.length_score = _pair_matrix(vocabs['length'].values,
+                                         lambda a, b: LENGTH_SCORES.get((a, b), LENGTH_UNKNOWN_SCORE))
+
+        # 色盤代碼 (隨快照保存) 直接索引和諧度矩陣
+        self.color = snap.palette
+        self.color_score = HARMONY_MATRIX
+
+    @staticmethod
+    def _type_slot(clothing_type):
+        if any(m in clothing_type for m in OUTER_MARKERS):
+            return OUTER
+        if any(m in clothing_type for m in BOTTOM_MARKERS):
+            return BOTTOM
+        return -1
+
+    @staticmethod
+    def _gender_compatible(a, b):
+        return a == b or a in UNISEX_GENDERS or b in UNISEX_GENDERS
+
+    def gender_mask(self, gender):
+        """可推薦給 gender 的商品 (該性別 + 中性)"""
+        allowed = _lookup(self.gender_values, lambda v: v == gender or v in UNISEX_GENDERS, True)
+        return allowed[self.gender]
+
+
+def _top_positions(scores, k):
+    """分數最高的 k 個位置 (不排序)"""
+    if len(scores) <= k:
+        return np.arange(len(scores))
+    return np.argpartition(-scores, k - 1)[:k]
+
+
+class OutfitComposer:
+    """整套穿搭組合器 (每個 worker 一份)"""
+
+    def __init__(self, index=None, slot_candidates=OUTFIT_SLOT_CANDIDATES,
+                 pair_pool=OUTFIT_PAIR_POOL, weights=(OUTFIT_W_BASE, OUTFIT_W_COLOR, OUTFIT_W_LENGTH)):
+        self.index = index or get_catalog_index()
+        self.slot_candidates = slot_candidates
+        self.pair_pool = pair_pool
+        self.w_base, self.w_color, self.w_length = weights
+        self._tables = None
+        self._tables_version = None
+        self._lock = threading.Lock()
+
+    def tables(self, snap):
+        with self._lock:
+            if self._tables_version != snap.version:
+                self._tables = _Tables(snap)
+                self._tables_version = snap.version
+            return self._tables
+
+    def _slot_candidates(self, t, slot, mask, fallback, base):
+        """某個欄位的候選位置 (依單品分數剪枝)；符合條件的沒有就用 fallback 遮罩"""
+        positions = np.nonzero(mask & (t.slot == slot))[0]
+        if not len(positions) and fallback is not None:
+            positions = np.nonzero(fallback & (t.slot == slot))[0]
+        return positions[_top_positions(base[positions], self.slot_candidates)]
+
+    def compose(self, cur, n=3, gender=None, terms=None, match=MATCH_TYPE_OR_NAME, candidate_ids=None,
+                with_outer=True, item_scores=None, jitter=0.0, seed=None):
+        """
+        組出 n 套穿搭
+
+        Args:
+            cur: 資料庫 cursor (只在商品索引需要更新時使用)
+            gender: 只用該性別與中性的商品
+            terms / match: 關鍵字篩選 (同 catalog_index)；某個欄位沒有符合的商品時改用全部商品
+            candidate_ids: 只從這些 id 中挑選 (例如場合推薦池)
+            item_scores: {item_id: 分數} 單品分數 (例如平均評分)
+            jitter: 加在單品分數上的隨機擾動幅度，讓每次結果有變化
+
+        Returns:
+            [{"top": id, "bottom": id, "outer": id 或 None, "score": 分數}, ...] (分數由高到低，單品不重複)
+        """
+        snap = self.index.refresh(cur)
+        t = self.tables(snap)
+
+        fallback = np.ones(len(snap), dtype=bool)
+        if gender:
+            fallback &= t.gender_mask(gender)
+        mask = fallback.copy()
+        if terms:
+            mask &= snap.mask(terms=terms, match=match)
+        if candidate_ids is not None:
+            mask &= np.isin(snap.ids, np.asarray(list(candidate_ids), dtype=np.int64))
+
+        base = np.zeros(len(snap), dtype=np.float32)
+        if item_scores and len(snap):
+            keys = np.fromiter(item_scores.keys(), dtype=np.int64, count=len(item_scores))
+            vals = np.fromiter(item_scores.values(), dtype=np.float32, count=len(item_scores))
+            pos = np.minimum(np.searchsorted(snap.ids, keys), len(snap) - 1)
+            found = snap.ids[pos] == keys
+            base[pos[found]] = vals[found]
+        if jitter:
+            base += jitter * np.random.default_rng(seed).random(len(snap), dtype=np.float32)
+
+        tops = self._slot_candidates(t, TOP, mask, fallback, base)
+        bottoms = self._slot_candidates(t, BOTTOM, mask, fallback, base)
+        if not len(tops) or not len(bottoms):
+            return []
+
+        # 上衣 × 下身：一次 broadcast 算完
+        ct, cb = t.color[tops], t.color[bottoms]
+        scores = (self.w_base * (base[tops][:, None] + base[bottoms][None, :])
+                  + self.w_color * t.color_score[ct[:, None], cb[None, :]]
+                  + self.w_length * t.length_score[t.length[tops][:, None], t.length[bottoms][None, :]])
+        scores = np.where(t.gender_ok[t.gender[tops][:, None], t.gender[bottoms][None, :]], scores, -np.inf)
+
+        # 每件上衣只留最搭的 n 件下身 (避免前幾名配對都集中在少數上衣)，再取整體前幾名
+        m = min(n, len(bottoms))
+        per_top = np.argpartition(-scores, m - 1, axis=1)[:, :m]
+        cand = np.take_along_axis(scores, per_top, axis=1).ravel()
+        best = _top_positions(cand, n * self.pair_pool)
+        best = best[np.isfinite(cand[best])]
+        pair_top, pair_bottom = tops[best // m], bottoms[per_top.ravel()[best]]
+        totals = cand[best]
+
+        # 外套：只對候選配對計算，與上衣、下身的顏色相容度取平均；
+        # 每個配對保留前 n 名外套，挑選時跳過已用過的
+        outer_choices = np.empty((len(best), 0), dtype=np.int64)
+        if with_outer:
+            outers = self._slot_candidates(t, OUTER, mask, fallback, base)
+            if len(outers):
+                co = t.color[outers]
+                outer_scores = (self.w_base * base[outers][None, :]
+                                + self.w_color * (t.color_score[t.color[pair_top][:, None], co[None, :]]
+                                                  + t.color_score[t.color[pair_bottom][:, None], co[None, :]]) / 2)
+                go = t.gender[outers][None, :]
+                outer_ok = (t.gender_ok[t.gender[pair_top][:, None], go]
+                            & t.gender_ok[t.gender[pair_bottom][:, None], go])
+                outer_scores = np.where(outer_ok, outer_scores, -np.inf)
+                m = min(n, len(outers))
+                choice = np.argpartition(-outer_scores, m - 1, axis=1)[:, :m]
+                chosen = np.take_along_axis(outer_scores, choice, axis=1)
+                order = np.argsort(-chosen, axis=1, kind='stable')
+                choice = np.take_along_axis(choice, order, axis=1)
+                chosen = np.take_along_axis(chosen, order, axis=1)
+                outer_choices = np.where(np.isfinite(chosen), outers[choice], -1)
+                totals = totals + np.where(np.isfinite(chosen[:, 0]), chosen[:, 0], 0.0)
+
+        # 由高到低挑選，同一件上衣 / 下身 / 外套不重複出現
+        outfits, used = [], set()
+        for i in np.argsort(-totals, kind='stable'):
+            top_id, bottom_id = int(snap.ids[pair_top[i]]), int(snap.ids[pair_bottom[i]])
+            if top_id in used or bottom_id in used:
+                continue
+            outer_id = next((int(snap.ids[o]) for o in outer_choices[i]
+                             if o >= 0 and int(snap.ids[o]) not in used), None)
+            used.update(x for x in (top_id, bottom_id, outer_id) if x is not None)
+            outfits.append({'top': top_id, 'bottom': bottom_id, 'outer': outer_id,
+                            'score': round(float(totals[i]), 4)})
+            if len(outfits) >= n:
+                break
+        return outfits
+
+
+# =======================
+# 每個 worker 共用一個組合器
+# =======================
+_composer = OutfitComposer()
+
+
+def get_outfit_composer():
+    return _composer
@@ -0,0 +1,384 @@
+"""
+outfits 表格欄位偵測與投影模組
+資料庫欄位名稱不固定 (name / title / 標題 ...)，回傳給前端前要轉成統一的 _id / _title / _occasion / _image / _description：
+
+- 欄位偵測 (精確 + 模糊匹配) 每個 schema 版本只做一次，編譯成 OutfitProjector：
+  每個標準欄位對應一串「依序嘗試的欄位名」(只保留表格中真的存在的欄位)
+- 套用到一批資料只是單純的 key 對應，不再每列重跑候選迴圈、不逐列印警告，也不複製資料列
+- 投影器依查詢結果的欄位 (cursor.description) 快取，每組欄位只編譯一次 (不是 SELECT * 的查詢也不會反覆編譯)；
+  遇到沒看過的欄位組合時重新 DESCRIBE outfits，確實被 ALTER TABLE 過才印出偵測結果並捨棄舊的投影器
+- 資料品質以計數器累計 (每個欄位幾筆精確 / 模糊 / 預設值)，由 /data_quality 查看
+"""
+
+import sys
+import threading
+from collections import OrderedDict
+
+from db_pool import get_db_conn
+
+# =======================
+# 欄位候選名稱
+# =======================
+FIELD_CANDIDATES = {
+    'primary_key': ['id', 'outfit_id', 'ID', 'pk', 'outfit_pk'],
+    'title': ['name', 'title', '標題', '名稱', 'outfit_name', 'item_name'],
+    'occasion': ['occasion', 'type', '場合', '類型', 'category', 'style'],
+    'image': ['image_url', 'image_path', 'img', 'picture', '圖片', 'photo'],
+    'description': ['description', 'desc', '描述', 'details', 'notes', 'remark']
+}
+
+# 二次保險: 欄位名包含這些關鍵字也算
+FUZZY_RULES = {
+    'title': ['title', 'name', '標題', '名', '名稱'],
+    'occasion': ['occasion', 'type', 'event', '場合', '類型', '事件'],
+    'image': ['image', 'img', 'pic', 'photo', '圖', '照片'],
+    'description': ['desc', 'detail', 'note', 'info', 'memo', '描述', '說明', '備註']
+}
+
+# 三重保險: 偵測到的欄位值為空時，依序改用這些欄位 (image 沒有備援)
+FALLBACK_KEYS = {
+    'primary_key': ['id', 'outfit_id', 'ID', 'uid', 'pk'],
+    'title': ['name', 'title', 'outfit_name', '標題', '名稱', 'outfit_title', 'label', 'outfit名稱'],
+    'occasion': ['occasion', 'type', 'category', 'style', '場合', '類型', 'event_type', 'scene', 'suitable_for'],
+    'image': [],
+    'description': ['description', 'desc', 'details', 'notes', '描述', '說明', 'memo', 'comment', '簡介'],
+}
+
+# 標準欄位 -> (輸出 key, 都找不到時的預設值)
+STANDARD_KEYS = {
+    'primary_key': ('_id', -1),  # -1 表示無效 ID
+    'title': ('_title', '⚠️ 未命名穿搭'),
+    'occasion': ('_occasion', '⚠️ 未分類'),
+    'image': ('_image', ''),
+    'description': ('_description', '⚠️ 無說明'),
+}
+
+DEFAULT_FIELDS = {
+    'primary_key': 'id',
+    'title': 'name',
+    'occasion': 'occasion',
+    'image': 'image_url',
+    'description': 'description'
+}
+
+# 品質計數器的分類
+EXACT, FUZZY, DEFAULT = 'exact', 'fuzzy', 'default'
+
+# 最多快取幾組查詢欄位的投影器
+MAX_PROJECTORS = 32
+
+
+# =======================
+# 欄位偵測
+# =======================
+def fuzzy_match_fields(columns, missing_fields):
+    """
+    二次保險: 模糊匹配欄位
+    使用關鍵字匹配,例如包含 'title' 或 'name' 的欄位都可能是標題
+    """
+    matched = {}
+    for field_type in missing_fields:
+        if field_type not in FUZZY_RULES:
+            continue
+
+        keywords = FUZZY_RULES[field_type]
+        for col in columns:
+            col_lower = col.lower()
+            # 檢查欄位名是否包含任一關鍵字
+            if any(keyword.lower() in col_lower or keyword in col for keyword in keywords):
+                matched[field_type] = col
+                break
+
+    return matched
+
+
+def detect_fields(columns, verbose=True):
+    """由欄位名稱列表偵測標準欄位 (含二次保險機制)；verbose 時印出偵測結果"""
+    if not verbose:
+        detected = {field_type: next((col for col in columns if col in candidates), None)
+                    for field_type, candidates in FIELD_CANDIDATES.items()}
+        missing_fields = [field_type for field_type, col in detected.items() if not col]
+        detected.update(fuzzy_match_fields(columns, missing_fields))
+        return detected
+
+    detected = {}
+    missing_fields = []
+
+    for field_type, candidates in FIELD_CANDIDATES.items():
+        matched = next((col for col in columns if col in candidates), None)
+        detected[field_type] = matched
+        if not matched:
+            missing_fields.append(field_type)
+
+    # 印出偵測結果（方便除錯；只在第一次載入與表格結構變更時印出）
+    print("\n" + "="*50, flush=True)
+    print("📊 資料庫欄位偵測結果:", flush=True)
+    print("="*50, flush=True)
+    for field_type, field_name in detected.items():
+        status = "✅" if field_name else "❌"
+        print(f"{status} {field_type:15s}: {field_name or '未找到'}", flush=True)
+
+    # 🛡️ 二次保險: 如果有未偵測到的欄位,嘗試模糊匹配
+    if missing_fields:
+        print("\n🔍 啟動二次保險機制 (模糊匹配)...", flush=True)
+        fuzzy_matched = fuzzy_match_fields(columns, missing_fields)
+
+        for field_type, fuzzy_col in fuzzy_matched.items():
+            if fuzzy_col:
+                detected[field_type] = fuzzy_col
+                print(f"✅ 模糊匹配成功: {field_type:15s} -> {fuzzy_col}", flush=True)
+
+    print("="*50 + "\n", flush=True)
+    return detected
+
+
+def describe_columns(conn):
+    """DESCRIBE outfits 取得欄位名稱"""
+    with conn.cursor() as cur:
+        cur.execute("DESCRIBE outfits")
+        result = cur.fetchall()
+    # 處理可能是字典或元組的結果
+    if result and isinstance(result[0], dict):
+        return tuple(row['Field'] for row in result)
+    return tuple(row[0] for row in result)
+
+
+def detect_outfit_fields(conn):
+    """自動偵測 outfits 表格的欄位結構 (含二次保險機制)"""
+    try:
+        return detect_fields(describe_columns(conn))
+    except Exception as e:
+        print(f"⚠️ 欄位偵測失敗: {e}", flush=True, file=sys.stderr)
+        # 返回預設值
+        return dict(DEFAULT_FIELDS)
+
+
+# =======================
+# 編譯後的投影器
+# =======================
+class OutfitProjector:
+    """
+    某個 schema 版本的欄位投影 (由欄位偵測結果編譯而成)
+
+    plan: [(標準欄位, 輸出 key, 依序嘗試的欄位名, 預設值, 第一個欄位是否為偵測到的欄位)]
+    """
+
+    def __init__(self, columns, fields):
+        self.columns = tuple(columns)
+        self.fields = dict(fields)
+        present = set(self.columns)
+        self.plan = []
+        for field_type, (out_key, default) in STANDARD_KEYS.items():
+            detected = self.fields.get(field_type)
+            keys = [detected] if detected else []
+            keys += [k for k in FALLBACK_KEYS[field_type] if k in present and k not in keys]
+            self.plan.append((field_type, out_key, tuple(keys), default, bool(detected)))
+        # 每個欄位: 依第幾個候選命中計數，最後一格為預設值
+        self._hits = {field_type: [0] * (len(keys) + 1) for field_type, _, keys, _, _ in self.plan}
+        self.rows = 0
+
+    def apply(self, rows):
+        """
+        就地加上 _id / _title / _occasion / _image / _description (資料列不複製)
+
+        Returns:
+            rows (同一個 list)
+        """
+        plan = [(out_key, keys, default, self._hits[field_type])
+                for field_type, out_key, keys, default, _ in self.plan]
+        for row in rows:
+            for out_key, keys, default, hits in plan:
+                for i, key in enumerate(keys):
+                    value = row.get(key)
+                    if value:
+                        break
+                else:
+                    i, value = len(keys), default
+                row[out_key] = value
+                hits[i] += 1
+        self.rows += len(rows)
+        return rows
+
+    def explain(self, row):
+        """
+        單筆資料的品質說明 (給 /data_quality 抽樣檢查用；一般請求不會呼叫)
+
+        Returns:
+            {"source": exact / fuzzy / mixed / default, "warnings": [...], "missing_fields": [...]}
+        """
+        quality = {'source': 'unknown', 'missing_fields': [], 'warnings': []}
+        kinds = {}
+        for field_type, out_key, keys, default, has_detected in self.plan:
+            hit = next((i for i, key in enumerate(keys) if row.get(key)), None)
+            if hit is None:
+                kinds[field_type] = DEFAULT
+                if field_type != 'image':
+                    quality['missing_fields'].append('id' if field_type == 'primary_key' else field_type)
+            elif hit == 0 and has_detected:
+                kinds[field_type] = EXACT
+            else:
+                kinds[field_type] = FUZZY
+                quality['warnings'].append(f"{out_key} 使用模糊匹配: {keys[hit]}")
+
+        checked = [kinds[f] for f in STANDARD_KEYS if f != 'image']
+        if kinds['primary_key'] == DEFAULT:
+            quality['source'] = 'default'
+        elif all(k == EXACT for k in checked):
+            quality['source'] = 'exact'
+        elif all(k == FUZZY for k in checked):
+            quality['source'] = 'fuzzy'
+        else:
+            quality['source'] = 'mixed'
+        return quality
+
+    def stats(self):
+        """累計的資料品質計數"""
+        result = {}
+        for field_type, _, keys, _, has_detected in self.plan:
+            hits = self._hits[field_type]
+            exact = hits[0] if has_detected and keys else 0
+            result[field_type] = {EXACT: exact, FUZZY: sum(hits[:-1]) - exact, DEFAULT: hits[-1]}
+        return {"rows": self.rows, "columns": len(self.columns), "fields": result}
+
+
+class OutfitFieldRegistry:
+    """
+    快取表格結構 (DESCRIBE outfits) 的偵測結果，以及每組查詢欄位的投影器 (每個 worker 一份)
+    遇到沒看過的查詢欄位時重新 DESCRIBE；確實被 ALTER 過才重新偵測 (印出結果) 並捨棄舊的投影器
+    """
+
+    def __init__(self, max_projectors=MAX_PROJECTORS):
+        self.max_projectors = max_projectors
+        self._projector = None              # 表格結構 (DESCRIBE) 的投影器
+        self._by_columns = OrderedDict()    # 查詢欄位 tuple -> 投影器
+        self._lock = threading.Lock()
+        self.compiles = 0
+        self.schema_changes = 0
+
+    def _compile(self, columns, fields=None, verbose=True):
+        projector = OutfitProjector(columns, fields or detect_fields(columns, verbose=verbose))
+        self.compiles += 1
+        return projector
+
+    def _cache(self, projector):
+        self._by_columns[projector.columns] = projector
+        self._by_columns.move_to_end(projector.columns)
+        while len(self._by_columns) > self.max_projectors:
+            self._by_columns.popitem(last=False)
+
+    def _set_table(self, projector):
+        self._projector = projector
+        self._cache(projector)
+
+    def projector(self, conn=None):
+        """表格結構的投影器 (第一次使用時 DESCRIBE outfits)"""
+        projector = self._projector
+        if projector is not None:
+            return projector
+        with self._lock:
+            if self._projector is None:
+                own = conn is None
+                conn = conn or get_db_conn()
+                try:
+                    try:
+                        columns = describe_columns(conn)
+                    except Exception as e:
+                        print(f"⚠️ 欄位偵測失敗: {e}", flush=True, file=sys.stderr)
+                        return OutfitProjector(tuple(DEFAULT_FIELDS.values()), DEFAULT_FIELDS)
+                    self._set_table(self._compile(columns))
+                finally:
+                    if own:
+                        conn.close()
+            return self._projector
+
+    def fields(self):
+        """目前 schema 的欄位偵測結果"""
+        return self.projector().fields
+
+    def _check_schema(self, cur):
+        """重新 DESCRIBE，表格確實變更過就換掉表格投影器 (呼叫時已持有鎖；每組新欄位只會做一次)"""
+        table = self._projector
+        conn = getattr(cur, 'connection', None)
+        try:
+            described = describe_columns(conn) if conn is not None else None
+        except Exception:
+            described = None
+        if described and (table is None or described != table.columns):
+            print(f"🔄 outfits 欄位已變更，重新偵測欄位 ({len(described)} 欄)", flush=True)
+            self.schema_changes += 1
+            self._by_columns.clear()
+            self._set_table(self._compile(described))
+
+    def project(self, cur, rows):
+        """
+        依 cur 最近一次查詢的欄位套用投影 (每組欄位只編譯一次)
+        rows 為查詢 outfits 的結果 (SELECT * 或只選部分欄位皆可)
+        """
+        columns = tuple(d[0] for d in cur.description or ())
+        if not columns:
+            return self.projector().apply(rows)
+        projector = self._by_columns.get(columns)
+        if projector is None:
+            self.projector()
+            with self._lock:
+                projector = self._by_columns.get(columns)
+                if projector is None:
+                    self._check_schema(cur)
+                    projector = self._by_columns.get(columns)
+                    if projector is None and self._projector is not None and columns == self._projector.columns:
+                        projector = self._projector
+                        self._cache(projector)
+                    elif projector is None:
+                        # 同一個表格的不同查詢欄位：安靜地編譯，不印偵測結果
+                        projector = self._compile(columns, verbose=False)
+                        self._cache(projector)
+        return projector.apply(rows)
+
+    def invalidate(self):
+        """捨棄快取 (下次使用時重新 DESCRIBE)"""
+        with self._lock:
+            self._projector = None
+            self._by_columns.clear()
+
+    def stats(self):
+        with self._lock:
+            projectors = list(self._by_columns.values())
+        table = self._projector
+        fields = {}
+        for projector in projectors:
+            for field_type, counts in projector.stats()['fields'].items():
+                total = fields.setdefault(field_type, {EXACT: 0, FUZZY: 0, DEFAULT: 0})
+                for kind, n in counts.items():
+                    total[kind] += n
+        return {
+            "compiles": self.compiles,
+            "schema_changes": self.schema_changes,
+            "projectors": len(projectors),
+            "rows": sum(p.rows for p in projectors),
+            "columns": len(table.columns) if table else 0,
+            "fields": fields,
+        }
+
+
+# =======================
+# 每個 worker 共用一份
+# =======================
+_registry = OutfitFieldRegistry()
+
+
+def get_outfit_fields():
+    """取得或快取欄位偵測結果"""
+    return _registry.fields()
+
+
+def get_outfit_projector():
+    return _registry.projector()
+
+
+def project_outfits(cur, rows):
+    """把 SELECT * FROM outfits 的結果標準化 (就地修改並回傳)"""
+    return _registry.project(cur, rows)
+
+
+def outfit_field_stats():
+    return _registry.stats()
@@ -0,0 +1,78 @@
+"""
+/aichat/items 的 keyset 分頁與 NDJSON 串流
+
+- 分頁以 id 為 keyset (WHERE id > 上一頁最後一筆)，不用 OFFSET，越後面的頁一樣快
+- next 為不透明的游標字串 (客戶端原樣帶回 ?cursor=)，沒有下一頁時為 null
+- 每頁筆數 ?limit= 預設 ITEMS_PAGE_SIZE，上限 ITEMS_MAX_PAGE_SIZE
+- ?format=ndjson (或 Accept: application/x-ndjson) 時改為串流：每行一筆，不分頁，
+  由 catalog_index.ItemStream 逐批讀取，記憶體用量與商品數無關
+"""
+
+import base64
+import binascii
+import json
+import os
+
+from json_provider import dumps_bytes
+
+ITEMS_PAGE_SIZE = int(os.getenv('ITEMS_PAGE_SIZE', '100'))          # 每頁預設筆數
+ITEMS_MAX_PAGE_SIZE = int(os.getenv('ITEMS_MAX_PAGE_SIZE', '500'))  # 每頁筆數上限
+
+NDJSON_MIMETYPE = 'application/x-ndjson'
+
+
+class InvalidPage(ValueError):
+    """cursor / limit 參數不合法 (路由回應 400)"""
+
+
+def encode_cursor(last_id):
+    """上一頁最後一筆的 id -> 游標字串"""
+    raw = json.dumps({"after": int(last_id)}, separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).rstrip(b'=').decode('ascii')
+
+
+def decode_cursor(cursor):
+    """游標字串 -> after_id (沒有游標時為 0)"""
+    if not cursor:
+        return 0
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        after = json.loads(raw)["after"]
+    except (binascii.Error, ValueError, TypeError, KeyError):
+        raise InvalidPage("cursor 無效")
+    if not isinstance(after, int) or after < 0:
+        raise InvalidPage("cursor 無效")
+    return after
+
+
+def page_size(value):
+    """?limit= -> 每頁筆數 (限制在 1 ~ ITEMS_MAX_PAGE_SIZE)"""
+    if value in (None, ''):
+        return ITEMS_PAGE_SIZE
+    try:
+        return max(1, min(int(value), ITEMS_MAX_PAGE_SIZE))
+    except (TypeError, ValueError):
+        raise InvalidPage("limit 必須是整數")
+
+
+def wants_ndjson(request):
+    """?format=ndjson 或 Accept 只要 NDJSON"""
+    fmt = request.args.get('format')
+    if fmt:
+        return fmt.lower() == 'ndjson'
+    return request.accept_mimetypes.best == NDJSON_MIMETYPE
+
+
+def page_response(rows, limit, projection):
+    """
+    一頁的回應內容：{"items": [...], "next": 游標或 None}
+    游標取自投影前的 id (fields 不含 id 也能翻頁)；剛好取滿 limit 筆時才有下一頁
+    """
+    next_cursor = encode_cursor(rows[-1]['id']) if len(rows) == limit else None
+    return {"items": projection.apply(rows), "next": next_cursor}
+
+
+def ndjson_lines(rows, projection):
+    """逐筆投影並編碼成 NDJSON (每行 UTF-8 bytes)"""
+    for row in rows:
+        yield dumps_bytes(projection.one(row)) + b'\n'
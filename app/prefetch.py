@@ -0,0 +1,61 @@
+"""
+批次預先載入 (prefetch) 模組
+一次查詢把整批 outfit 的 items 撈回來，再在 Python 端分組，
+避免「每個 outfit 各查一次」的 N+1 查詢
+"""
+
+from collections import defaultdict
+
+# 單次 IN (...) 最多放幾個 id，避免 SQL 過長
+PREFETCH_CHUNK_SIZE = 500
+
+
+def prefetch_outfit_items(cur, outfit_ids):
+    """
+    一次取回多個 outfit 的 items
+
+    Args:
+        cur: 資料庫 cursor (DictCursor)
+        outfit_ids: outfit id 列表 (可重複，會自動去重)
+
+    Returns:
+        dict: {outfit_id: [item, ...]}，沒有 items 的 outfit 對應空列表
+    """
+    ids = list(dict.fromkeys(oid for oid in outfit_ids if oid is not None))
+    grouped = defaultdict(list)
+    if not ids:
+        return grouped
+
+    for start in range(0, len(ids), PREFETCH_CHUNK_SIZE):
+        chunk = ids[start:start + PREFETCH_CHUNK_SIZE]
+        placeholders = ','.join(['%s'] * len(chunk))
+        cur.execute(f"""
+            SELECT oi.outfit_id AS _prefetch_outfit_id, i.* FROM items i
+            JOIN outfit_items oi ON i.id = oi.item_id
+            WHERE oi.outfit_id IN ({placeholders})
+            ORDER BY oi.outfit_id, oi.item_id
+        """, chunk)
+        for row in cur.fetchall():
+            outfit_id = row.pop('_prefetch_outfit_id')
+            grouped[outfit_id].append(row)
+
+    return grouped
+
+
+def attach_outfit_items(cur, outfits, id_key='_id'):
+    """
+    幫每個 outfit 掛上 `items` 欄位 (整批只查一次資料庫)
+
+    Args:
+        cur: 資料庫 cursor
+        outfits: outfit dict 列表 (會直接修改)
+        id_key: outfit 中代表 id 的欄位名稱
+
+    Returns:
+        同一個 outfits 列表
+    """
+    items_by_outfit = prefetch_outfit_items(cur, [o.get(id_key) for o in outfits])
+    for o in outfits:
+        # 各 outfit 拿到自己的副本，避免重複 id 時共用同一份 dict 被重複轉換
+        o['items'] = [dict(item) for item in items_by_outfit.get(o.get(id_key), [])]
+    return outfits
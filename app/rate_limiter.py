@@ -0,0 +1,183 @@
+"""
+速率限制模組 (Token Bucket)
+取代「持有全域鎖時 time.sleep」的做法：
+
+- 每個 key (session / 模型供應商) 各自一個 token bucket
+- 鎖只保護令牌計算，絕不在持有鎖時等待
+- 兩種模式：
+    reject: 令牌不足立即拋出 RateLimited (路由回 429 + Retry-After)
+    queue:  先預約令牌，放開鎖後再等待 (gevent 下 time.sleep 會讓出給其他請求)；
+            需要等待超過 RATE_LIMIT_MAX_WAIT 秒時仍拋出 RateLimited
+- 所有參數由環境變數設定
+"""
+
+import os
+import time
+import threading
+from collections import OrderedDict
+
+RATE_LIMIT_MODE = os.getenv('RATE_LIMIT_MODE', 'queue')           # queue / reject
+RATE_LIMIT_MAX_WAIT = float(os.getenv('RATE_LIMIT_MAX_WAIT', '10'))
+# 每個 session 每秒幾次請求 (0.5 = 每 2 秒 1 次)，0 表示不限制
+SESSION_RATE_LIMIT = float(os.getenv('SESSION_RATE_LIMIT', '0.5'))
+SESSION_RATE_BURST = float(os.getenv('SESSION_RATE_BURST', '1'))
+# 模型供應商的限制 (每個 worker)，格式: "gemini=0.5:5,groq=1:10" (每秒次數:突發量)，未列出的不限制
+PROVIDER_RATE_LIMITS = os.getenv('PROVIDER_RATE_LIMITS', '')
+# 最多追蹤幾個 key (超過時淘汰最久沒用的)
+RATE_LIMIT_MAX_KEYS = int(os.getenv('RATE_LIMIT_MAX_KEYS', '10000'))
+
+
+class RateLimited(Exception):
+    """超過速率限制 (retry_after: 建議幾秒後重試)"""
+
+    def __init__(self, key, retry_after):
+        self.key = key
+        self.retry_after = retry_after
+        super().__init__(f"429 Rate Limit: {key} 請在 {retry_after:.1f} 秒後重試")
+
+
+def rate_limited_response(e):
+    """Flask 路由用：RateLimited -> 429 + Retry-After"""
+    import math
+    from flask import jsonify
+    retry_after = math.ceil(e.retry_after)
+    response = jsonify({
+        "error": f"請求太頻繁，請 {retry_after} 秒後再試",
+        "retry_after": retry_after
+    })
+    response.status_code = 429
+    response.headers['Retry-After'] = str(retry_after)
+    return response
+
+
+class TokenBucket:
+    __slots__ = ('rate', 'burst', 'tokens', 'updated')
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = max(burst, 1.0)
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, now):
+        """取得一個令牌需要等待的秒數 (不扣令牌)"""
+        self._refill(now)
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self):
+        """扣一個令牌 (可以變成負數，代表已被預約)"""
+        self.tokens -= 1
+
+
+class RateLimiter:
+    """
+    以 key 分開計算的 token bucket 限流器
+
+    Args:
+        name: 名稱 (錯誤訊息 / 統計用)
+        rate: 每秒補充幾個令牌 (0 表示不限制)
+        burst: 令牌上限 (允許的突發量)
+        mode: queue / reject
+        max_wait: queue 模式最多等待秒數
+    """
+
+    def __init__(self, name, rate, burst=1, mode=RATE_LIMIT_MODE, max_wait=RATE_LIMIT_MAX_WAIT,
+                 max_keys=RATE_LIMIT_MAX_KEYS):
+        self.name = name
+        self.rate = rate
+        self.burst = burst
+        self.mode = mode if mode in ('queue', 'reject') else 'queue'
+        self.max_wait = max_wait
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {'allowed': 0, 'queued': 0, 'rejected': 0, 'wait_total_s': 0.0}
+
+    @property
+    def enabled(self):
+        return self.rate > 0
+
+    def _bucket(self, key):
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = TokenBucket(self.rate, self.burst)
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(key)
+        return bucket
+
+    def try_acquire(self, key):
+        """不等待：有令牌就扣掉並回傳 0，否則回傳需要等待的秒數"""
+        if not self.enabled:
+            return 0.0
+        with self._lock:
+            bucket = self._bucket(key)
+            wait = bucket.wait_time(time.monotonic())
+            if wait <= 0:
+                bucket.take()
+                self._stats['allowed'] += 1
+            return wait
+
+    def acquire(self, key, mode=None):
+        """
+        取得一個令牌；依模式立即拒絕或排隊等待
+        等待發生在鎖外，其他 key 完全不受影響
+
+        Raises:
+            RateLimited: reject 模式令牌不足，或 queue 模式需等待超過 max_wait
+        """
+        if not self.enabled:
+            return 0.0
+        mode = mode or self.mode
+        with self._lock:
+            bucket = self._bucket(key)
+            wait = bucket.wait_time(time.monotonic())
+            if wait > 0 and (mode == 'reject' or wait > self.max_wait):
+                self._stats['rejected'] += 1
+                raise RateLimited(f"{self.name}:{key}", wait)
+            bucket.take()  # 先預約，之後的請求會排在後面
+            if wait > 0:
+                self._stats['queued'] += 1
+                self._stats['wait_total_s'] += wait
+            else:
+                self._stats['allowed'] += 1
+
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+    def stats(self):
+        with self._lock:
+            return {
+                'name': self.name,
+                'rate': self.rate,
+                'burst': self.burst,
+                'mode': self.mode,
+                'keys': len(self._buckets),
+                **self._stats,
+                'wait_total_s': round(self._stats['wait_total_s'], 3),
+            }
+
+
+def parse_provider_limits(spec=PROVIDER_RATE_LIMITS):
+    """解析 "gemini=0.5:5,groq=1:10" -> {"gemini": (0.5, 5.0), ...}"""
+    limits = {}
+    for part in filter(None, (p.strip() for p in spec.split(','))):
+        name, _, value = part.partition('=')
+        rate, _, burst = value.partition(':')
+        limits[name.strip().lower()] = (float(rate), float(burst or 1))
+    return limits
+
+
+def build_provider_limiters(names, spec=PROVIDER_RATE_LIMITS):
+    """為每個模型供應商建立限流器 (未設定的不限制)"""
+    limits = parse_provider_limits(spec)
+    return {
+        name: RateLimiter(f"provider:{name}", *limits.get(name.lower(), (0, 1)))
+        for name in names
+    }
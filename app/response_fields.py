@@ -0,0 +1,97 @@
+"""
+回應欄位投影 (?fields=)
+/aichat/recommend、/aichat/items 預設只回傳前端用得到的精簡欄位，
+需要其他欄位時以 fields 指定：
+
+    fields=_id,_title,items.name,items.color    只要這些欄位 (items.x 表示巢狀 items 的欄位)
+    fields=_id,_title,items                     items 使用預設的精簡欄位
+    fields=*                                    完整資料列 (items 也完整)
+    fields=*,items.name                         外層完整，items 只要 name
+
+不存在的欄位直接略過；同樣的 fields 字串只解析一次
+"""
+
+from functools import lru_cache
+
+ALL = '*'
+
+# 預設欄位：前端 (aichat.html / recommend_stream.js) 實際使用的欄位
+ITEM_FIELDS = 'id,name,category,color,image_url,price'
+OUTFIT_FIELDS = '_id,_title,_occasion,_image,_description,items'
+
+NESTED_DEFAULTS = {'items': ITEM_FIELDS}
+
+
+class FieldProjection:
+    """
+    編譯後的投影
+
+    keys: 要保留的欄位 (None 表示全部)
+    nested: {巢狀欄位: FieldProjection}，巢狀欄位是列表時逐筆投影
+    """
+
+    def __init__(self, keys, nested):
+        self.keys = keys
+        self.nested = nested
+
+    def one(self, row):
+        if row is None:
+            return None
+        if self.keys is None:
+            out = dict(row)
+        else:
+            out = {k: row[k] for k in self.keys if k in row}
+        for key, projection in self.nested.items():
+            value = out.get(key)
+            if isinstance(value, list):
+                out[key] = [projection.one(v) for v in value]
+            elif isinstance(value, dict):
+                out[key] = projection.one(value)
+        return out
+
+    def apply(self, rows):
+        """回傳新的 dict 列表 (原資料不修改)"""
+        return [self.one(row) for row in rows]
+
+
+@lru_cache(maxsize=256)
+def _compile(spec):
+    names = [name.strip() for name in spec.split(',') if name.strip()]
+    keys, nested = [], {}
+    for name in names:
+        head, dot, rest = name.partition('.')
+        if dot:
+            nested.setdefault(head, []).append(rest)
+        if head not in keys:
+            keys.append(head)
+
+    # 巢狀欄位：有指定子欄位用指定的，只寫名稱用預設精簡欄位；"*" 時其餘巢狀欄位完整保留
+    projections = {}
+    for head in keys:
+        if head in nested:
+            projections[head] = _compile(','.join(nested[head]))
+        elif head in NESTED_DEFAULTS:
+            projections[head] = _compile(NESTED_DEFAULTS[head])
+
+    if ALL in keys:
+        return FieldProjection(None, projections)
+    return FieldProjection(tuple(keys), projections)
+
+
+def parse_fields(spec, default):
+    """
+    fields 參數 -> FieldProjection
+
+    Args:
+        spec: 請求的 fields 參數，字串或列表 (JSON body)；None / 空白使用 default
+        default: 預設欄位字串 (ITEM_FIELDS / OUTFIT_FIELDS)
+    """
+    if isinstance(spec, (list, tuple)):
+        spec = ','.join(str(name) for name in spec)
+    spec = (spec or '').strip() or default
+    return _compile(spec)
+
+
+def project(rows, spec, default):
+    """依 fields 參數投影資料列"""
+    return parse_fields(spec, default).apply(rows)
@@ -0,0 +1,118 @@
+"""
+檢索結果快取模組
+熱門場合 (約會 / 上班 / 休閒 ...) 佔了大部分流量，同樣的關鍵字組合不必每次重新檢索：
+
+- LRU + TTL：容量有上限，過期自動失效
+- 版本失效：每筆快取記錄當時的商品目錄版本，版本改變 (例如 05_database_import 匯入新資料) 即視為失效
+- 提前刷新 (refresh-ahead)：快要過期的熱門 key 在背景重新載入，使用者不必等待
+- 命中 / 未命中等統計，供健康檢查輸出
+"""
+
+import os
+import sys
+import time
+import threading
+from collections import OrderedDict
+
+RETRIEVAL_CACHE_SIZE = int(os.getenv('RETRIEVAL_CACHE_SIZE', '512'))
+RETRIEVAL_CACHE_TTL = float(os.getenv('RETRIEVAL_CACHE_TTL', '300'))
+# 存活超過 TTL 的這個比例後被讀到，就在背景提前刷新
+RETRIEVAL_CACHE_REFRESH_AHEAD = float(os.getenv('RETRIEVAL_CACHE_REFRESH_AHEAD', '0.8'))
+
+
+class _Entry:
+    __slots__ = ('value', 'version', 'created', 'refreshing')
+
+    def __init__(self, value, version):
+        self.value = value
+        self.version = version
+        self.created = time.monotonic()
+        self.refreshing = False
+
+
+class RetrievalCache:
+    """LRU + TTL + 版本失效 + 提前刷新的快取"""
+
+    def __init__(self, name='retrieval', max_entries=RETRIEVAL_CACHE_SIZE, ttl=RETRIEVAL_CACHE_TTL,
+                 refresh_ahead=RETRIEVAL_CACHE_REFRESH_AHEAD):
+        self.name = name
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.refresh_ahead = refresh_ahead
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {'hits': 0, 'misses': 0, 'expired': 0, 'invalidated': 0,
+                       'refreshes': 0, 'refresh_errors': 0, 'evictions': 0}
+
+    def get_or_load(self, key, loader, version=None):
+        """
+        取得快取值，沒有 (或已失效) 就呼叫 loader() 載入
+
+        Args:
+            key: 快取 key (需可 hash，例如 frozenset(關鍵字))
+            loader: 無參數的載入函數；提前刷新時會在背景執行緒呼叫，
+                    因此需自行取得資料庫連線，不可借用呼叫端的 cursor
+            version: 目前的商品目錄版本，與快取記錄的版本不同即失效
+        """
+        now = time.monotonic()
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None:
+                age = now - entry.created
+                if entry.version != version:
+                    self._stats['invalidated'] += 1
+                elif age >= self.ttl:
+                    self._stats['expired'] += 1
+                else:
+                    self._stats['hits'] += 1
+                    self._data.move_to_end(key)
+                    if age >= self.ttl * self.refresh_ahead and not entry.refreshing:
+                        entry.refreshing = True
+                        threading.Thread(target=self._refresh, args=(key, loader, version),
+                                         daemon=True).start()
+                    return entry.value
+            self._stats['misses'] += 1
+
+        value = loader()
+        self._put(key, value, version)
+        return value
+
+    def _put(self, key, value, version):
+        with self._lock:
+            self._data[key] = _Entry(value, version)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+                self._stats['evictions'] += 1
+
+    def _refresh(self, key, loader, version):
+        """背景提前刷新"""
+        try:
+            value = loader()
+            self._put(key, value, version)
+            with self._lock:
+                self._stats['refreshes'] += 1
+        except Exception as e:
+            with self._lock:
+                self._stats['refresh_errors'] += 1
+                entry = self._data.get(key)
+                if entry is not None:
+                    entry.refreshing = False
+            print(f"⚠️ 檢索快取背景刷新失敗 ({self.name}): {e}", flush=True, file=sys.stderr)
+
+    def invalidate(self):
+        """清空所有快取"""
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self._stats['hits'] + self._stats['misses']
+            return {
+                'name': self.name,
+                'size': len(self._data),
+                'max_entries': self.max_entries,
+                'ttl': self.ttl,
+                **self._stats,
+                'hit_rate': round(self._stats['hits'] / lookups, 4) if lookups else 0.0,
+            }
@@ -0,0 +1,143 @@
+"""
+對話 session 記憶體快取模組
+取代「self.sessions 是一個只會變大的 dict」的做法：
+
+- 最多保留 SESSION_CACHE_SIZE 個 session，超過時淘汰最久沒用的 (LRU)
+- 閒置超過 SESSION_IDLE_TIMEOUT 秒的 session 也會被淘汰
+- 每個 session 只保留一份訊息列表 (最近 SESSION_MEMORY_TURNS 輪)，不再另存重複的 history
+- 被淘汰的 session 下次用到時再從對話儲存 (session_store) 載入
+- 統計常駐的 session 數與估計位元組數
+"""
+
+import os
+import time
+import threading
+from collections import OrderedDict
+
+SESSION_CACHE_SIZE = int(os.getenv('SESSION_CACHE_SIZE', '1000'))
+SESSION_IDLE_TIMEOUT = float(os.getenv('SESSION_IDLE_TIMEOUT', '1800'))   # 0 表示不依閒置時間淘汰
+SESSION_MEMORY_TURNS = int(os.getenv('SESSION_MEMORY_TURNS', '20'))
+
+# 每輪對話除了文字之外的固定開銷 (dict、時間戳、模型名稱等) 的粗估
+TURN_OVERHEAD_BYTES = 200
+
+
+def turn_bytes(turn):
+    """估計一輪對話佔用的位元組數 (以 UTF-8 文字長度為主)"""
+    return (len(turn.get("user", "").encode('utf-8'))
+            + len(turn.get("ai", "").encode('utf-8'))
+            + TURN_OVERHEAD_BYTES)
+
+
+class SessionCache:
+    """
+    有上限的 LRU session 快取
+
+    session 格式: {"messages": [對話輪, ...], "created_at": ISO 時間}
+    """
+
+    def __init__(self, max_sessions=SESSION_CACHE_SIZE, idle_timeout=SESSION_IDLE_TIMEOUT,
+                 max_turns=SESSION_MEMORY_TURNS):
+        self.max_sessions = max_sessions
+        self.idle_timeout = idle_timeout
+        self.max_turns = max_turns
+        self._entries = OrderedDict()   # session_id -> [session, 最後使用時間, 估計位元組數]
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._stats = {'hits': 0, 'misses': 0, 'evicted': 0, 'expired': 0}
+
+    def __contains__(self, session_id):
+        with self._lock:
+            return session_id in self._entries
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, session_id):
+        """取得常駐的 session (不存在或已閒置過久回傳 None)"""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(session_id)
+            if entry is not None and self._is_idle(entry, now):
+                self._remove(session_id)
+                self._stats['expired'] += 1
+                entry = None
+            if entry is None:
+                self._stats['misses'] += 1
+                return None
+            entry[1] = now
+            self._entries.move_to_end(session_id)
+            self._stats['hits'] += 1
+            return entry[0]
+
+    def put(self, session_id, session):
+        """放入 session (只保留最近 max_turns 輪)，並淘汰閒置 / 超出上限的 session"""
+        self._trim(session)
+        size = sum(turn_bytes(t) for t in session["messages"])
+        now = time.monotonic()
+        with self._lock:
+            if session_id in self._entries:
+                self._remove(session_id)
+            self._entries[session_id] = [session, now, size]
+            self._bytes += size
+            self._evict(now)
+
+    def append(self, session_id, session, turn):
+        """追加一輪對話；session 已被淘汰時重新放回"""
+        session["messages"].append(turn)
+        with self._lock:
+            entry = self._entries.get(session_id)
+            if entry is not None and entry[0] is session:
+                dropped = self._trim(session)
+                delta = turn_bytes(turn) - sum(turn_bytes(t) for t in dropped)
+                entry[1] = time.monotonic()
+                entry[2] += delta
+                self._bytes += delta
+                self._entries.move_to_end(session_id)
+                return
+        self.put(session_id, session)
+
+    def pop(self, session_id):
+        with self._lock:
+            entry = self._remove(session_id)
+        return entry[0] if entry else None
+
+    def _trim(self, session):
+        """只保留最近 max_turns 輪，回傳被移除的對話"""
+        messages = session["messages"]
+        if self.max_turns and len(messages) > self.max_turns:
+            dropped = messages[:-self.max_turns]
+            del messages[:-self.max_turns]
+            return dropped
+        return []
+
+    def _is_idle(self, entry, now):
+        return self.idle_timeout > 0 and now - entry[1] > self.idle_timeout
+
+    def _remove(self, session_id):
+        entry = self._entries.pop(session_id, None)
+        if entry is not None:
+            self._bytes -= entry[2]
+        return entry
+
+    def _evict(self, now):
+        # 依最後使用時間排序，最前面的就是最久沒用的
+        while self._entries:
+            session_id, entry = next(iter(self._entries.items()))
+            if self._is_idle(entry, now):
+                self._stats['expired'] += 1
+            elif len(self._entries) > self.max_sessions:
+                self._stats['evicted'] += 1
+            else:
+                break
+            self._remove(session_id)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'resident_sessions': len(self._entries),
+                'resident_bytes': self._bytes,
+                'max_sessions': self.max_sessions,
+                'idle_timeout_s': self.idle_timeout,
+                **self._stats,
+            }
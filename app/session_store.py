@@ -0,0 +1,306 @@
+"""
+對話記錄儲存模組
+取代「每則訊息都整個讀寫 conversations.json」的做法：
+
+- 每則訊息 O(1) 追加、每個 session 獨立讀取
+- 兩種後端 (SESSION_STORE 設定)：
+    mysql: 寫入既有的 conversation_history 表 (一輪對話 = user + assistant 兩列)；
+           預設經由背景批次寫入 (history_writer)，不佔用請求時間
+    jsonl: 每個 session 一個 append-only 的 JSON Lines 檔，檔案過大時只保留最近的對話 (壓縮)；
+           以 fcntl.flock 保護，多個 gunicorn worker 同時寫入也安全
+- 可由舊的 conversations.json 遷移：python session_store.py migrate [conversations.json]
+"""
+
+import os
+import sys
+import json
+import fcntl
+import hashlib
+
+SESSION_STORE = os.getenv('SESSION_STORE', 'mysql')                  # mysql / jsonl
+# mysql 後端是否使用背景批次寫入
+SESSION_WRITE_BEHIND = os.getenv('SESSION_WRITE_BEHIND', 'on').lower() in ('1', 'on', 'true', 'yes')
+SESSION_LOG_DIR = os.getenv('SESSION_LOG_DIR', '/app/data/sessions')
+# 單一 session 檔超過此大小就壓縮：只保留最近 SESSION_KEEP_TURNS 輪，且總大小不超過此值的一半
+# (壓縮後至少還能再追加一半的空間，不會每次追加都重寫整個檔案)
+SESSION_LOG_COMPACT_BYTES = int(os.getenv('SESSION_LOG_COMPACT_BYTES', str(256 * 1024)))
+SESSION_KEEP_TURNS = int(os.getenv('SESSION_KEEP_TURNS', '200'))
+# 載入 session 時最多讀回幾輪
+SESSION_LOAD_TURNS = int(os.getenv('SESSION_LOAD_TURNS', '50'))
+
+LEGACY_CONVERSATIONS_FILE = "/app/data/conversations.json"
+
+
+# =======================
+# JSON Lines 後端
+# =======================
+class JsonlSessionStore:
+    """每個 session 一個 append-only 檔案 (檔名為 session_id 的雜湊，避免路徑注入)"""
+
+    def __init__(self, directory=SESSION_LOG_DIR, compact_bytes=SESSION_LOG_COMPACT_BYTES,
+                 keep_turns=SESSION_KEEP_TURNS):
+        self.directory = directory
+        self.compact_bytes = compact_bytes
+        self.keep_turns = keep_turns
+
+    def _path(self, session_id):
+        digest = hashlib.sha1(session_id.encode('utf-8')).hexdigest()
+        return os.path.join(self.directory, f"{digest}.jsonl")
+
+    def _open_locked(self, path, lock_type):
+        """開檔並上鎖；若拿到鎖時檔案已被壓縮替換，就重新開啟新檔"""
+        while True:
+            f = open(path, 'a+', encoding='utf-8')
+            fcntl.flock(f.fileno(), lock_type)
+            try:
+                if os.fstat(f.fileno()).st_ino == os.stat(path).st_ino:
+                    return f
+            except FileNotFoundError:
+                pass
+            f.close()
+
+    def load(self, session_id, limit=SESSION_LOAD_TURNS):
+        path = self._path(session_id)
+        if not os.path.exists(path):
+            return []
+        with self._open_locked(path, fcntl.LOCK_SH) as f:
+            f.seek(0)
+            lines = f.readlines()
+        turns = []
+        for line in lines[-limit:] if limit else lines:
+            try:
+                turns.append(json.loads(line))
+            except ValueError:
+                continue  # 寫到一半的行 (例如程序被強制終止) 直接略過
+        return turns
+
+    def append(self, session_id, turn):
+        path = self._path(session_id)
+        line = json.dumps(turn, ensure_ascii=False) + "\n"
+        os.makedirs(self.directory, exist_ok=True)
+        with self._open_locked(path, fcntl.LOCK_EX) as f:
+            f.write(line)
+            f.flush()
+            if f.tell() > self.compact_bytes:
+                self._compact(path, f)
+
+    def _compact(self, path, f):
+        """
+        只保留最近的對話 (最多 keep_turns 輪、總大小不超過 compact_bytes 的一半)，
+        寫到暫存檔後原子替換 (呼叫時已持有排他鎖)
+        """
+        f.seek(0)
+        budget = self.compact_bytes // 2
+        lines, size = [], 0
+        for line in reversed(f.readlines()[-self.keep_turns:]):
+            size += len(line.encode('utf-8'))
+            if lines and size > budget:
+                break
+            lines.append(line)
+        lines.reverse()
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as tmp:
+            tmp.writelines(lines)
+        os.replace(tmp_path, path)
+
+    def delete(self, session_id):
+        path = self._path(session_id)
+        if os.path.exists(path):
+            with self._open_locked(path, fcntl.LOCK_EX):
+                os.remove(path)
+
+    def stats(self):
+        return {'backend': 'jsonl', 'directory': self.directory}
+
+
+# =======================
+# MySQL 後端 (conversation_history)
+# =======================
+def _turn_rows(session_id, turn):
+    """一輪對話 -> conversation_history 的兩列"""
+    metadata = json.dumps({
+        "model": turn.get("model"),
+        "cached": turn.get("cached", False),
+        "timestamp": turn.get("timestamp"),
+    }, ensure_ascii=False)
+    return [
+        (session_id, 'user', turn["user"], None),
+        (session_id, 'assistant', turn["ai"], metadata),
+    ]
+
+
+def _rows_to_turns(rows):
+    """conversation_history 的列 (依 id 排序) -> 對話輪"""
+    turns = []
+    pending_user = None
+    for row in rows:
+        if row['message_type'] == 'user':
+            pending_user = row
+        elif row['message_type'] == 'assistant' and pending_user is not None:
+            metadata = row.get('metadata') or {}
+            if isinstance(metadata, (str, bytes)):
+                metadata = json.loads(metadata)
+            created = pending_user.get('created_at')
+            turns.append({
+                "user": pending_user['content'],
+                "ai": row['content'],
+                "model": metadata.get("model"),
+                "cached": metadata.get("cached", False),
+                "timestamp": metadata.get("timestamp") or (created.isoformat() if created else None),
+            })
+            pending_user = None
+    return turns
+
+
+INSERT_SQL = ("INSERT INTO conversation_history (session_id, message_type, content, metadata) "
+              "VALUES (%s, %s, %s, %s)")
+
+
+class MySQLSessionStore:
+    """寫入 conversation_history 表 (session_id 有索引，讀取只掃該 session)"""
+
+    def load(self, session_id, limit=SESSION_LOAD_TURNS):
+        from db_pool import get_db_conn
+        conn = get_db_conn()
+        try:
+            with conn.cursor() as cur:
+                cur.execute(
+                    "SELECT message_type, content, metadata, created_at FROM ("
+                    "  SELECT id, message_type, content, metadata, created_at FROM conversation_history"
+                    "  WHERE session_id = %s ORDER BY id DESC LIMIT %s"
+                    ") recent ORDER BY id",
+                    (session_id, limit * 2))
+                return _rows_to_turns(cur.fetchall())
+        finally:
+            conn.close()
+
+    def append(self, session_id, turn):
+        self.append_many([(session_id, turn)])
+
+    def append_many(self, entries):
+        """一次寫入多輪對話 (多列 INSERT)"""
+        rows = [row for session_id, turn in entries for row in _turn_rows(session_id, turn)]
+        if not rows:
+            return
+        from db_pool import get_db_conn
+        conn = get_db_conn()
+        try:
+            with conn.cursor() as cur:
+                cur.executemany(INSERT_SQL, rows)
+        finally:
+            conn.close()
+
+    def delete(self, session_id):
+        from db_pool import get_db_conn
+        conn = get_db_conn()
+        try:
+            with conn.cursor() as cur:
+                cur.execute("DELETE FROM conversation_history WHERE session_id = %s", (session_id,))
+        finally:
+            conn.close()
+
+    def stats(self):
+        return {'backend': 'mysql'}
+
+
+class WriteBehindSessionStore:
+    """
+    在 MySQLSessionStore 前面加上背景批次寫入：
+    append 只進佇列；load 會合併尚未寫入的內容；delete 先把佇列寫完再刪除，避免舊資料又被寫回
+    """
+
+    def __init__(self, inner):
+        from history_writer import WriteBehindWriter
+        self.inner = inner
+        self.writer = WriteBehindWriter(inner)
+
+    def load(self, session_id, limit=SESSION_LOAD_TURNS):
+        pending = self.writer.pending_for(session_id)
+        turns = self.inner.load(session_id, limit)
+        # 寫入中的批次可能已經進了資料庫，以 timestamp + 內容去重
+        seen = {(t.get("timestamp"), t["user"]) for t in turns}
+        turns += [t for t in pending if (t.get("timestamp"), t["user"]) not in seen]
+        return turns[-limit:] if limit else turns
+
+    def append(self, session_id, turn):
+        self.writer.submit(session_id, turn)
+
+    def append_many(self, entries):
+        # 遷移等大量匯入直接同步寫入
+        self.inner.append_many(entries)
+
+    def delete(self, session_id):
+        self.writer.flush()
+        self.inner.delete(session_id)
+
+    def stats(self):
+        return {'backend': 'mysql', 'write_behind': self.writer.stats()}
+
+
+# =======================
+# 依設定建立後端
+# =======================
+def create_session_store(kind=SESSION_STORE):
+    if kind == 'jsonl':
+        return JsonlSessionStore()
+    if kind != 'mysql':
+        print(f"⚠️ 未知的 SESSION_STORE={kind}，改用 mysql", flush=True, file=sys.stderr)
+    store = MySQLSessionStore()
+    return WriteBehindSessionStore(store) if SESSION_WRITE_BEHIND else store
+
+
+def migrate_json_file(store, path=LEGACY_CONVERSATIONS_FILE):
+    """
+    把舊的 conversations.json ({session_id: {"messages": [...]}}) 匯入新的儲存後端
+
+    Returns:
+        (session 數, 對話輪數)
+    """
+    with open(path, 'r', encoding='utf-8') as f:
+        conversations = json.load(f)
+    sessions = turns = 0
+    for session_id, session in conversations.items():
+        messages = [m for m in session.get("messages", []) if "user" in m and "ai" in m]
+        if hasattr(store, 'append_many'):
+            store.append_many([(session_id, m) for m in messages])
+        else:
+            for message in messages:
+                store.append(session_id, message)
+        sessions += 1
+        turns += len(messages)
+    return sessions, turns
+
+
+def migrate_legacy_file_once(store, path=LEGACY_CONVERSATIONS_FILE):
+    """
+    啟動時自動遷移舊的 conversations.json (只執行一次)：
+    以檔案鎖避免多個 worker 同時遷移，完成後原檔改名為 .migrated
+    """
+    if not os.path.exists(path):
+        return
+    try:
+        with open(path + ".lock", 'w') as lock:
+            fcntl.flock(lock.fileno(), fcntl.LOCK_EX)
+            if not os.path.exists(path):
+                return  # 其他 worker 已經遷移完成
+            n_sessions, n_turns = migrate_json_file(store, path)
+            os.replace(path, path + ".migrated")
+            print(f"📦 已將 {path} 遷移到新的對話儲存 ({n_sessions} 個 session、{n_turns} 輪)",
+                  flush=True, file=sys.stderr)
+    except Exception as e:
+        print(f"⚠️ 舊對話記錄遷移失敗: {e}", flush=True, file=sys.stderr)
+
+
+if __name__ == "__main__":
+    # 用法: python session_store.py migrate [conversations.json]
+    if len(sys.argv) < 2 or sys.argv[1] != 'migrate':
+        print("用法: python session_store.py migrate [conversations.json]")
+        sys.exit(1)
+    source = sys.argv[2] if len(sys.argv) > 2 else LEGACY_CONVERSATIONS_FILE
+    if not os.path.exists(source):
+        print(f"❌ 找不到 {source}")
+        sys.exit(1)
+    n_sessions, n_turns = migrate_json_file(create_session_store(), source)
+    print(f"✅ 已遷移 {n_sessions} 個 session、{n_turns} 輪對話到 {SESSION_STORE}")
+    os.replace(source, source + ".migrated")
+    print(f"📦 原檔已改名為 {source}.migrated")
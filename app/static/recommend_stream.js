@@ -0,0 +1,63 @@
+// 串流版 AI 穿搭推薦（/aichat/recommend/stream，Server-Sent Events）
+// 用 fetch + ReadableStream 讀取（EventSource 只能 GET，這裡用 POST 送 JSON）
+//
+// handlers:
+//   onItems({db_data, keywords, session_id})  檢索結果（最先到達）
+//   onModel({model})                          開始回應的模型
+//   onToken({text})                           AI 回應片段
+//   onDone({response})                        完整回應
+//   onError({error})                          錯誤
+async function streamRecommendation(body, handlers) {
+  const res = await fetch("/aichat/recommend/stream", {
+    method: "POST",
+    headers: { "Content-Type": "application/json", "Accept": "text/event-stream" },
+    body: JSON.stringify(body)
+  });
+
+  if (!res.ok || !res.body) {
+    let message = "HTTP " + res.status;
+    try {
+      const data = await res.json();
+      if (data.error) message = data.error;
+    } catch (e) { /* 不是 JSON 就用狀態碼 */ }
+    handlers.onError && handlers.onError({ error: message });
+    return;
+  }
+
+  const callbacks = {
+    items: handlers.onItems,
+    model: handlers.onModel,
+    token: handlers.onToken,
+    done: handlers.onDone,
+    error: handlers.onError
+  };
+
+  const reader = res.body.getReader();
+  const decoder = new TextDecoder("utf-8");
+  let buffer = "";
+
+  // 一則 SSE 訊息以空行分隔：event: xxx\ndata: {...}
+  function dispatch(block) {
+    let event = "message";
+    const dataLines = [];
+    for (const line of block.split("\n")) {
+      if (line.startsWith("event:")) event = line.slice(6).trim();
+      else if (line.startsWith("data:")) dataLines.push(line.slice(5).trimStart());
+    }
+    if (!dataLines.length) return;
+    const callback = callbacks[event];
+    if (callback) callback(JSON.parse(dataLines.join("\n")));
+  }
+
+  while (true) {
+    const { value, done } = await reader.read();
+    if (done) break;
+    buffer += decoder.decode(value, { stream: true });
+    let idx;
+    while ((idx = buffer.indexOf("\n\n")) !== -1) {
+      dispatch(buffer.slice(0, idx));
+      buffer = buffer.slice(idx + 2);
+    }
+  }
+  if (buffer.trim()) dispatch(buffer);
+}
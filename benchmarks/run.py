@@ -0,0 +1,378 @@
+"""
+推薦端點壓測
+不花 Gemini 配額量測 /aichat/recommend、/aichat/items 的吞吐量與延遲：
+
+1. (可選) 建立壓測資料庫並灌入合成資料 (seed.py)
+2. 每個服務版本 (v1 = services.py、v4 = services_v4.py) 各啟動一個 server.py 子行程，LLM 換成假模型
+3. 多條執行緒同時送出請求，統計 RPS、p50/p95/p99、錯誤數、每個請求的 SQL 查詢數，
+   以及 /metrics 中各階段 (outfit_stage_seconds) 的平均耗時
+4. 結果存成 JSON (檔名含 commit)，可用 --compare 比較兩次結果
+
+壓測前會檢查伺服器連到的資料庫已有資料 (沒有就中止，請先 --seed-db)；
+任一情境的錯誤率超過 --max-error-rate 時結果標記為 "valid": false 並以 exit code 1 結束，
+這樣的結果只能拿來除錯，不能當作效能數據
+
+用法:
+    python benchmarks/run.py --seed-db                   # 建立資料庫後壓測全部版本
+    python benchmarks/run.py --variants v4 -c 32 -n 2000 --llm-latency lognormal:0.5,0.6
+    python benchmarks/run.py --compare results/a.json results/b.json
+"""
+
+import argparse
+import http.client
+import json
+import math
+import os
+import random
+import re
+import socket
+import subprocess
+import sys
+import threading
+import time
+from datetime import datetime
+from urllib.parse import urlencode
+
+sys.path.append(os.path.dirname(__file__))
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+RESULTS_DIR = os.path.join(BENCH_DIR, 'results')
+
+PROMPTS = [
+    "我要去約會，穿什麼好？",
+    "上班穿搭推薦",
+    "週末想休閒一點",
+    "明天要運動，幫我搭一套",
+    "想要韓風的穿搭",
+    "今天好熱",
+    "有沒有文青一點的衣服",
+    "參加派對要穿什麼",
+    "出去旅遊的穿搭",
+    "推薦一套適合面試的正式服裝",
+]
+ITEM_QUERIES = [
+    {},
+    {"color": "白色"},
+    {"color": "黑色"},
+    {"category": "top"},
+    {"category": "bottom", "color": "藍色"},
+]
+VARIANTS = ('v1', 'v4')   # AICHAT_SERVICES 可選的版本 (services_v2 / v3 沒有路由)
+STAGE_LINE = re.compile(r'^outfit_stage_seconds_(sum|count)\{pipeline="([^"]*)",stage="([^"]*)"\} (\S+)$', re.M)
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def _git(*args):
+    try:
+        return subprocess.run(['git', *args], cwd=BENCH_DIR, capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except Exception:
+        return None
+
+
+def percentile(values, p):
+    """最近秩 (nearest-rank) 百分位數"""
+    if not values:
+        return None
+    values = sorted(values)
+    k = min(len(values), max(1, math.ceil(p / 100 * len(values))))
+    return values[k - 1]
+
+
+# =======================
+# 伺服器子行程
+# =======================
+class BenchServer:
+    def __init__(self, variant, args):
+        self.variant = variant
+        self.port = _free_port()
+        env = dict(os.environ)
+        env.update({
+            'AICHAT_SERVICES': variant,
+            'DB_NAME': args.db_name,
+            # 假 LLM 沿用正式的模型名稱，備援 / 熔斷 / 供應商速率限制照常運作
+            'LLM_PROVIDERS': args.llm_providers,
+            'LLM_RECORD': 'off',
+            'FAKE_LLM_LATENCY': args.llm_latency,
+            'FAKE_LLM_ERROR_RATE': str(args.llm_error_rate),
+            'FAKE_LLM_429_RATE': str(args.llm_429_rate),
+            'FAKE_LLM_SEED': str(args.seed),
+            'BENCH_SERVER': args.server,
+            # 壓測時不限制每個 session 的速率、不使用回應快取 (每個請求都走到 LLM)
+            'SESSION_RATE_LIMIT': '0',
+            'LLM_CACHE_POLICY': args.llm_cache,
+            'METRICS_DIR': '',
+        })
+        self.proc = subprocess.Popen([sys.executable, os.path.join(BENCH_DIR, 'server.py'),
+                                      '--port', str(self.port)], env=env)
+
+    def request(self, method, path, body=None, timeout=60):
+        conn = http.client.HTTPConnection('127.0.0.1', self.port, timeout=timeout)
+        try:
+            headers = {'Content-Type': 'application/json'} if body is not None else {}
+            conn.request(method, path, body=json.dumps(body) if body is not None else None, headers=headers)
+            resp = conn.getresponse()
+            return resp.status, resp.read()
+        finally:
+            conn.close()
+
+    def wait_ready(self, timeout=120):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if self.proc.poll() is not None:
+                raise RuntimeError(f"壓測伺服器 ({self.variant}) 啟動失敗，exit code {self.proc.returncode}")
+            try:
+                status, _ = self.request('GET', '/__bench/stats', timeout=2)
+                if status == 200:
+                    return
+            except OSError:
+                pass
+            time.sleep(0.3)
+        raise RuntimeError(f"壓測伺服器 ({self.variant}) 啟動逾時")
+
+    def stats(self):
+        return json.loads(self.request('GET', '/__bench/stats')[1])
+
+    def check_db(self):
+        """確認連得到資料庫且壓測資料表都有資料，回傳 /__bench/db 的內容"""
+        status, body = self.request('GET', '/__bench/db')
+        info = json.loads(body)
+        if status != 200 or not info.get('ok'):
+            raise RuntimeError(f"壓測伺服器 ({self.variant}) 連不到資料庫: {info.get('error')}")
+        empty = [table for table, n in info['tables'].items() if not n]
+        if empty:
+            raise RuntimeError(f"壓測資料庫 {info['db']} 的 {', '.join(empty)} 沒有資料，請先執行 --seed-db")
+        return info
+
+    def stage_totals(self):
+        """/metrics 中 outfit_stage_seconds 的 {(pipeline, stage): (sum, count)}"""
+        text = self.request('GET', '/metrics')[1].decode('utf-8')
+        totals = {}
+        for kind, pipeline, stage, value in STAGE_LINE.findall(text):
+            entry = totals.setdefault((pipeline, stage), [0.0, 0])
+            entry[0 if kind == 'sum' else 1] = float(value)
+        return totals
+
+    def stop(self):
+        self.proc.terminate()
+        try:
+            self.proc.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            self.proc.kill()
+
+
+# =======================
+# 負載產生
+# =======================
+def _scenario_requests(scenario, rng, worker, i):
+    if scenario == 'recommend':
+        return 'POST', '/aichat/recommend', {
+            "message": rng.choice(PROMPTS),
+            "session_id": f"bench-{worker}-{i}",
+        }
+    if scenario == 'items':
+        query = urlencode(rng.choice(ITEM_QUERIES))
+        return 'GET', '/aichat/items' + ('?' + query if query else ''), None
+    raise ValueError(f"未知的情境: {scenario}")
+
+
+def drive(server, scenario, total, concurrency, seed=0):
+    """concurrency 條執行緒送出共 total 個請求；回傳 (延遲列表, 錯誤數, 耗時)"""
+    latencies, errors = [], [0]
+    lock = threading.Lock()
+    counter = iter(range(total))
+
+    def worker(w):
+        rng = random.Random(seed * 1000 + w)
+        conn = http.client.HTTPConnection('127.0.0.1', server.port, timeout=120)
+        local = []
+        while True:
+            with lock:
+                i = next(counter, None)
+            if i is None:
+                break
+            method, path, body = _scenario_requests(scenario, rng, w, i)
+            started = time.perf_counter()
+            try:
+                conn.request(method, path, body=json.dumps(body) if body is not None else None,
+                             headers={'Content-Type': 'application/json'})
+                resp = conn.getresponse()
+                resp.read()
+                ok = resp.status < 400
+                if resp.getheader('Connection', '').lower() == 'close':
+                    conn.close()
+            except (OSError, http.client.HTTPException):
+                ok = False
+                conn.close()
+                conn = http.client.HTTPConnection('127.0.0.1', server.port, timeout=120)
+            local.append(time.perf_counter() - started)
+            if not ok:
+                with lock:
+                    errors[0] += 1
+        conn.close()
+        with lock:
+            latencies.extend(local)
+
+    threads = [threading.Thread(target=worker, args=(w,)) for w in range(concurrency)]
+    started = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return latencies, errors[0], time.perf_counter() - started
+
+
+def run_scenario(server, scenario, args):
+    if args.warmup:
+        drive(server, scenario, args.warmup, min(args.concurrency, args.warmup), seed=999)
+    queries_before = server.stats()['queries']
+    stages_before = server.stage_totals()
+    latencies, errors, elapsed = drive(server, scenario, args.requests, args.concurrency, seed=args.seed)
+    queries = server.stats()['queries'] - queries_before
+    stages_after = server.stage_totals()
+
+    stages = {}
+    for key, (total_sum, total_count) in sorted(stages_after.items()):
+        before_sum, before_count = stages_before.get(key, (0.0, 0))
+        count = total_count - before_count
+        if count:
+            stages['/'.join(key)] = {"count": int(count), "mean_ms": round((total_sum - before_sum) / count * 1000, 3)}
+
+    ms = [x * 1000 for x in latencies]
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "concurrency": args.concurrency,
+        "elapsed_s": round(elapsed, 3),
+        "rps": round(len(latencies) / elapsed, 2) if elapsed else None,
+        "latency_ms": {
+            "mean": round(sum(ms) / len(ms), 3) if ms else None,
+            "p50": round(percentile(ms, 50), 3) if ms else None,
+            "p95": round(percentile(ms, 95), 3) if ms else None,
+            "p99": round(percentile(ms, 99), 3) if ms else None,
+            "max": round(max(ms), 3) if ms else None,
+        },
+        "db_queries_per_request": round(queries / len(latencies), 3) if latencies else None,
+        "stages": stages,
+    }
+
+
+# =======================
+# 結果比較
+# =======================
+def compare(old_path, new_path):
+    with open(old_path, encoding='utf-8') as f:
+        old = json.load(f)
+    with open(new_path, encoding='utf-8') as f:
+        new = json.load(f)
+    print(f"比較 {old.get('commit', '?')[:10]} -> {new.get('commit', '?')[:10]}")
+    for path, report in ((old_path, old), (new_path, new)):
+        if not report.get('valid', False):
+            print(f"⚠️ {path} 沒有通過驗證 (資料庫檢查或錯誤率)，比較結果僅供參考")
+    print(f"{'情境':<20}{'指標':<14}{'舊':>12}{'新':>12}{'變化':>10}")
+    for variant, scenarios in new['results'].items():
+        for scenario, result in scenarios.items():
+            before = old.get('results', {}).get(variant, {}).get(scenario)
+            if not before:
+                continue
+            rows = [('rps', before['rps'], result['rps'])]
+            rows += [(p, before['latency_ms'][p], result['latency_ms'][p]) for p in ('p50', 'p95', 'p99')]
+            rows.append(('queries/req', before['db_queries_per_request'], result['db_queries_per_request']))
+            for metric, a, b in rows:
+                change = f"{(b - a) / a * 100:+.1f}%" if a and b is not None else '-'
+                print(f"{variant + '/' + scenario:<20}{metric:<14}{a!s:>12}{b!s:>12}{change:>10}")
+
+
+# =======================
+# 主程式
+# =======================
+def main():
+    parser = argparse.ArgumentParser(description='推薦端點壓測 (假 LLM)')
+    parser.add_argument('--variants', default='v1,v4',
+                        help='服務版本，逗號分隔 (v1 / v4；services_v2 / v3 沒有路由，不在壓測範圍)')
+    parser.add_argument('--scenarios', default='recommend,items', help='情境，逗號分隔 (recommend / items)')
+    parser.add_argument('-c', '--concurrency', type=int, default=16)
+    parser.add_argument('-n', '--requests', type=int, default=500, help='每個情境的請求數')
+    parser.add_argument('--warmup', type=int, default=20)
+    parser.add_argument('--seed', type=int, default=1, help='請求內容的亂數種子')
+    parser.add_argument('--seed-db', action='store_true', help='先重建壓測資料庫並灌入合成資料')
+    parser.add_argument('--items', type=int, default=5000, help='--seed-db 時的商品數')
+    parser.add_argument('--outfits', type=int, default=300, help='--seed-db 時的穿搭數')
+    parser.add_argument('--db-name', default=os.getenv('BENCH_DB_NAME', 'outfit_bench'))
+    parser.add_argument('--llm-providers', default='fake:Gemini,fake:Groq,fake:DeepSeek',
+                        help='LLM_PROVIDERS (例如 replay 回放 LLM_CASSETTE 錄下的回應)')
+    parser.add_argument('--llm-latency', default='lognormal:0.8,0.5', help='假 LLM 延遲分布 (見 llm_providers.parse_latency)')
+    parser.add_argument('--llm-error-rate', type=float, default=0.0)
+    parser.add_argument('--llm-429-rate', type=float, default=0.0, help='假 LLM 回傳 429 的機率')
+    parser.add_argument('--llm-cache', default='off', help='LLM_CACHE_POLICY (預設 off，每個請求都走到 LLM)')
+    parser.add_argument('--server', default='gevent', help='gevent / threaded')
+    parser.add_argument('--max-error-rate', type=float, default=0.01,
+                        help='任一情境錯誤率超過此值時結果標記為無效 (--llm-error-rate 注入的錯誤會降級回應，不計入)')
+    parser.add_argument('--output', default=None, help='結果 JSON 路徑 (預設 benchmarks/results/<時間>-<commit>.json)')
+    parser.add_argument('--compare', nargs=2, metavar=('OLD', 'NEW'), help='比較兩份結果後結束')
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    unknown = set(args.variants.split(',')) - set(VARIANTS)
+    if unknown:
+        parser.error(f"不支援的服務版本: {', '.join(sorted(unknown))} (只有 {' / '.join(VARIANTS)} 有路由)")
+
+    if args.seed_db:
+        from seed import seed_database
+        print(f"🌱 建立壓測資料庫 {args.db_name} ...", flush=True)
+        print(f"✅ {seed_database(args.items, args.outfits, db_name=args.db_name)}", flush=True)
+
+    commit = _git('rev-parse', 'HEAD')
+    report = {
+        "commit": commit,
+        "dirty": bool(_git('status', '--porcelain')),
+        "timestamp": datetime.now().isoformat(timespec='seconds'),
+        "python": sys.version.split()[0],
+        "config": {k: v for k, v in vars(args).items() if k not in ('compare', 'output')},
+        "results": {},
+        "valid": True,
+    }
+
+    for variant in args.variants.split(','):
+        print(f"\n🚀 {variant}: 啟動壓測伺服器 ...", flush=True)
+        server = BenchServer(variant, args)
+        try:
+            server.wait_ready()
+            report.setdefault("models", server.stats().get('models'))
+            db = server.check_db()
+            report.setdefault("database", {"name": db['db'], "version": db['version'], "tables": db['tables']})
+            print(f"🗄️ {variant}: 資料庫 {db['db']} ({db['version']}) {db['tables']}", flush=True)
+            for scenario in args.scenarios.split(','):
+                result = run_scenario(server, scenario, args)
+                report["results"].setdefault(variant, {})[scenario] = result
+                lat = result['latency_ms']
+                print(f"📊 {variant}/{scenario}: {result['rps']} req/s, p50 {lat['p50']} ms, "
+                      f"p95 {lat['p95']} ms, p99 {lat['p99']} ms, 錯誤 {result['errors']}, "
+                      f"SQL {result['db_queries_per_request']} 次/請求", flush=True)
+                if not result['requests'] or result['errors'] / result['requests'] > args.max_error_rate:
+                    report["valid"] = False
+                    print(f"❌ {variant}/{scenario}: 錯誤率超過 {args.max_error_rate:.0%}，結果無效", flush=True)
+        finally:
+            server.stop()
+
+    output = args.output or os.path.join(
+        RESULTS_DIR, f"{datetime.now():%Y%m%d-%H%M%S}-{(commit or 'nogit')[:10]}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"\n💾 結果已儲存: {output}")
+    if not report["valid"]:
+        print("❌ 有情境錯誤率過高，這份結果只能用來除錯，不能當作效能數據", flush=True, file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,141 @@
+"""
+壓測資料庫 - 建立並灌入合成資料
+用 init/*.sql 建立與正式環境相同的結構 (資料庫名稱換成 BENCH_DB_NAME，不會動到 outfit_db)，
+再灌入可重現的合成商品、穿搭、評分，最後重算場合推薦池
+
+v1 服務讀取的 outfits / outfit_items 已在 03_modify_tables.sql 刪除，這裡另外建立給壓測使用
+"""
+
+import glob
+import os
+import random
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'app'))
+from occasion_pools import OCCASION_STYLE_MAPPING, rebuild_pools
+from color_harmony import PALETTE_NAMES
+
+INIT_DIR = os.path.join(os.path.dirname(__file__), '..', 'init')
+BENCH_DB_NAME = os.getenv('BENCH_DB_NAME', 'outfit_bench')
+
+GENDERS = ['男', '女', '中性', '-']
+LENGTHS = ['短', '長', '中', None]
+OUTFIT_OCCASIONS = ['約會', '運動', '上班', '休閒', '派對', '旅遊']
+EXTRA_TYPES = ['寬褲', '牛仔褲', '短褲', '長裙', '羽絨外套', '大衣', '帽T', '背心']
+
+OUTFIT_TABLES = [
+    """CREATE TABLE IF NOT EXISTS outfits (
+      id INT AUTO_INCREMENT PRIMARY KEY,
+      name VARCHAR(255) NOT NULL,
+      occasion VARCHAR(50) DEFAULT NULL,
+      image_url VARCHAR(255) DEFAULT NULL,
+      description TEXT DEFAULT NULL,
+      created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+      INDEX idx_occasion (occasion)
+    ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci""",
+    """CREATE TABLE IF NOT EXISTS outfit_items (
+      id INT AUTO_INCREMENT PRIMARY KEY,
+      outfit_id INT NOT NULL,
+      item_id INT NOT NULL,
+      INDEX idx_outfit (outfit_id)
+    ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci""",
+]
+
+
+def connect(db=None):
+    import pymysql
+    return pymysql.connect(
+        host=os.getenv('DB_HOST', 'localhost'),
+        port=int(os.getenv('DB_PORT', '3306')),
+        user=os.getenv('DB_USER', 'root'),
+        password=os.getenv('DB_PASS', 'rootpassword'),
+        db=db,
+        charset='utf8mb4',
+        cursorclass=pymysql.cursors.DictCursor,
+        autocommit=True,
+    )
+
+
+def create_schema(conn, db_name=BENCH_DB_NAME):
+    """依序執行 init/*.sql (outfit_db 換成 db_name)"""
+    with conn.cursor() as cur:
+        cur.execute(f"DROP DATABASE IF EXISTS `{db_name}`")
+        for sql_file in sorted(glob.glob(os.path.join(INIT_DIR, '*.sql'))):
+            with open(sql_file, 'r', encoding='utf-8') as f:
+                sql_commands = f.read().replace('outfit_db', db_name).split(';')
+            for command in sql_commands:
+                # 去掉註解行，只剩註解的片段略過
+                command = '\n'.join(line for line in command.splitlines()
+                                    if not line.strip().startswith('--')).strip()
+                if command:
+                    cur.execute(command)
+                    cur.fetchall()
+        for ddl in OUTFIT_TABLES:
+            cur.execute(ddl)
+
+
+def synthetic_items(n, rng):
+    types = sorted({t for types in OCCASION_STYLE_MAPPING.values() for t in types} | set(EXTRA_TYPES))
+    rows = []
+    for i in range(n):
+        clothing_type = rng.choice(types)
+        category = 'bottom' if any(m in clothing_type for m in ('褲', '裙')) else 'top'
+        color = rng.choice(PALETTE_NAMES)
+        rows.append((
+            f"{color.split(' (')[0]} {clothing_type} #{i}", category, color,
+            f"https://example.com/img/{i}.jpg", f"BENCH-{i:07d}", rng.choice(GENDERS),
+            clothing_type, rng.choice(LENGTHS), round(rng.uniform(290, 2990), 0), 'bench',
+        ))
+    return rows
+
+
+def seed_database(n_items=5000, n_outfits=300, n_users=50, n_ratings=5000, seed=42, db_name=BENCH_DB_NAME):
+    """
+    建立壓測資料庫並灌入合成資料
+
+    Returns:
+        {"items": ..., "outfits": ..., "ratings": ..., "pools": ...}
+    """
+    rng = random.Random(seed)
+    conn = connect()
+    try:
+        create_schema(conn, db_name)
+    finally:
+        conn.close()
+
+    conn = connect(db_name)
+    try:
+        with conn.cursor() as cur:
+            cur.executemany(
+                "INSERT INTO items (name, category, color, image_url, sku, gender, clothing_type, length, price, source) "
+                "VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)", synthetic_items(n_items, rng))
+            cur.executemany("INSERT INTO users (username) VALUES (%s)", [(f"bench{i}",) for i in range(n_users)])
+            cur.execute("SELECT id FROM users")
+            user_ids = [r['id'] for r in cur.fetchall()]
+            cur.execute("SELECT id FROM items")
+            item_ids = [r['id'] for r in cur.fetchall()]
+
+            ratings = {(rng.choice(user_ids), rng.choice(item_ids)) for _ in range(n_ratings)}
+            cur.executemany("INSERT INTO rating (user_id, item_id, rating_value) VALUES (%s, %s, %s)",
+                            [(u, i, rng.randint(1, 5)) for u, i in ratings])
+
+            cur.executemany(
+                "INSERT INTO outfits (name, occasion, image_url, description) VALUES (%s, %s, %s, %s)",
+                [(f"{occ}穿搭 #{i}", occ, f"https://example.com/outfit/{i}.jpg", f"適合{occ}的搭配")
+                 for i, occ in ((i, rng.choice(OUTFIT_OCCASIONS)) for i in range(n_outfits))])
+            cur.execute("SELECT id FROM outfits")
+            outfit_ids = [r['id'] for r in cur.fetchall()]
+            cur.executemany("INSERT INTO outfit_items (outfit_id, item_id) VALUES (%s, %s)",
+                            [(o, i) for o in outfit_ids for i in rng.sample(item_ids, 3)])
+            cur.execute("UPDATE catalog_meta SET version = version + 1 WHERE name = 'items'")
+
+        n_pools, _, _ = rebuild_pools(conn)
+    finally:
+        conn.close()
+
+    return {"items": n_items, "outfits": n_outfits, "ratings": len(ratings), "pools": n_pools}
+
+
+if __name__ == '__main__':
+    print(f"🌱 建立壓測資料庫 {BENCH_DB_NAME} ...")
+    print(f"✅ {seed_database()}")
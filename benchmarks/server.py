@@ -0,0 +1,119 @@
+"""
+壓測用的應用程式行程
+由 run.py 以子行程啟動 (環境變數決定服務版本、資料庫、假 LLM 設定)：
+
+- 用 create_app() 建立與正式環境相同的應用程式
+- LLM 由 LLM_PROVIDERS 決定 (預設 fake:Gemini,fake:Groq,fake:DeepSeek，見 app/llm_providers.py)，
+  走與正式環境相同的備援 / 熔斷 / 速率限制 / 對話儲存路徑
+- 計算 SQL 查詢次數，由 GET /__bench/stats 回報
+- GET /__bench/db 回報連到的資料庫與各表筆數 (run.py 壓測前檢查資料庫已灌好資料)
+- 有 gevent 時用 gevent WSGIServer (同正式環境的 gunicorn gevent worker)，否則用 werkzeug 多執行緒
+
+用法: python benchmarks/server.py --port 5055
+"""
+
+import argparse
+import os
+import sys
+
+BENCH_SERVER = os.getenv('BENCH_SERVER', 'gevent')   # gevent / threaded
+
+if BENCH_SERVER == 'gevent':
+    try:
+        from gevent import monkey
+        monkey.patch_all()
+    except ImportError:
+        BENCH_SERVER = 'threaded'
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'app'))
+
+os.environ.setdefault('LLM_PROVIDERS', 'fake:Gemini,fake:Groq,fake:DeepSeek')
+
+# =======================
+# SQL 查詢計數
+# =======================
+_query_count = [0]
+
+# 壓測情境會讀到的資料表 (seed.py 灌入)
+BENCH_TABLES = ('items', 'outfits', 'outfit_items')
+
+
+def _count_queries():
+    import pymysql.cursors
+    original = pymysql.cursors.Cursor.execute
+
+    def execute(self, query, args=None):
+        _query_count[0] += 1
+        return original(self, query, args)
+
+    # executemany 內部也呼叫 execute，DictCursor 繼承自 Cursor
+    pymysql.cursors.Cursor.execute = execute
+
+
+def _agent_models():
+    """服務模組的 agent 使用的模型名稱"""
+    from blueprints.aichat import AICHAT_SERVICES
+    if AICHAT_SERVICES == 'v4':
+        from blueprints.aichat import services_v4 as services
+    else:
+        from blueprints.aichat import services
+    agent = services.agent
+    if agent is None:
+        return []
+    return [m["name"] for m in agent.llms]
+
+
+def build_app():
+    _count_queries()
+    from app import create_app
+    from flask import jsonify
+
+    app = create_app()
+    models = _agent_models()
+
+    @app.route('/__bench/stats')
+    def bench_stats():
+        return jsonify({"queries": _query_count[0], "models": models, "server": BENCH_SERVER})
+
+    @app.route('/__bench/db')
+    def bench_db():
+        from db_pool import get_db_conn
+        try:
+            conn = get_db_conn()
+            try:
+                with conn.cursor() as cur:
+                    cur.execute("SELECT DATABASE() AS db, VERSION() AS version")
+                    info = dict(cur.fetchone())
+                    tables = {}
+                    for table in BENCH_TABLES:
+                        cur.execute(f"SELECT COUNT(*) AS n FROM {table}")
+                        tables[table] = cur.fetchone()['n']
+            finally:
+                conn.close()
+        except Exception as e:
+            return jsonify({"ok": False, "error": str(e)}), 503
+        return jsonify({"ok": True, **info, "tables": tables})
+
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description='壓測用應用程式行程')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=5055)
+    args = parser.parse_args()
+
+    app = build_app()
+    print(f"🚀 壓測伺服器啟動 ({BENCH_SERVER}) http://{args.host}:{args.port}", flush=True, file=sys.stderr)
+    if BENCH_SERVER == 'gevent':
+        from gevent.pywsgi import WSGIServer
+        WSGIServer((args.host, args.port), app, log=None).serve_forever()
+    else:
+        import logging
+        from werkzeug.serving import run_simple
+        logging.getLogger('werkzeug').setLevel(logging.ERROR)
+        run_simple(args.host, args.port, app, threaded=True, use_reloader=False)
+
+
+if __name__ == '__main__':
+    main()
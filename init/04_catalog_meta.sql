@@ -0,0 +1,29 @@
+-- ========================================
+-- 商品目錄版本表
+-- 日期: 2025-12-10
+-- ========================================
+-- 
+-- 📋 修改內容:
+--   1. 新增 catalog_meta 表格 (商品目錄版本號)
+-- 
+-- 💡 用途:
+--   - pipeline/05_database_import.py 每次匯入後將 version +1
+--   - Flask worker 定期讀取版本號，改變時重新載入商品索引並讓檢索快取失效
+-- 
+-- ========================================
+
+USE outfit_db;
+
+-- =============================
+-- 1. 新增 catalog_meta 表格
+-- =============================
+CREATE TABLE IF NOT EXISTS catalog_meta (
+  name VARCHAR(50) PRIMARY KEY COMMENT '目錄名稱 (目前只有 items)',
+  version INT NOT NULL DEFAULT 1 COMMENT '每次匯入 +1',
+  updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP COMMENT '更新時間'
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
+COMMENT='商品目錄版本 - 供快取失效使用';
+
+INSERT IGNORE INTO catalog_meta (name, version) VALUES ('items', 1);
+
+SELECT '✅ catalog_meta 表格已建立' AS status;
@@ -0,0 +1,31 @@
+-- ========================================
+-- 場合推薦池表
+-- 日期: 2025-12-12
+-- ========================================
+-- 
+-- 📋 修改內容:
+--   1. 新增 occasion_pools 表格 (每個場合 × 性別預先排序好的候選商品)
+-- 
+-- 💡 用途:
+--   - pipeline/06_build_occasion_pools.py 在每次 05_database_import 匯入後重算
+--   - Flask worker 整批載入記憶體，推薦時不必即時跑 OR / LIKE 查詢
+--   - catalog_version 與 catalog_meta.version 不同 (尚未重算) 時，worker 改用即時檢索
+-- 
+-- ========================================
+
+USE outfit_db;
+
+-- =============================
+-- 1. 新增 occasion_pools 表格
+-- =============================
+CREATE TABLE IF NOT EXISTS occasion_pools (
+  occasion VARCHAR(20) NOT NULL COMMENT '場合/風格 (運動, 正式, 上班 ...)',
+  gender VARCHAR(20) NOT NULL DEFAULT '' COMMENT '性別，空字串代表不分性別',
+  rank_no INT NOT NULL COMMENT '排序 (0 為最優先)',
+  item_id INT NOT NULL COMMENT '商品ID',
+  catalog_version INT NOT NULL COMMENT '計算時的 catalog_meta.version',
+  PRIMARY KEY (occasion, gender, rank_no)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
+COMMENT='場合推薦池 - 由 pipeline/06_build_occasion_pools.py 產生';
+
+SELECT '✅ occasion_pools 表格已建立' AS status;
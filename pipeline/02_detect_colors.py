@@ -16,6 +16,10 @@ from sklearn.cluster import KMeans
 from collections import Counter
 import time
 import colorsys
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'app'))
 
 # 可選依賴
 try:
@@ -34,48 +38,8 @@ except ImportError:
 
 
 # ==================== Pantone 色號系統 ====================
-PANTONE_COLORS = {
-    # 無彩色系
-    "黑色 (Pantone Black 6)": {"rgb": (0, 0, 0), "h_range": None, "v_max": 20},
-    "白色 (Pantone White)": {"rgb": (255, 255, 255), "h_range": None, "v_min": 90},
-    "深灰色 (Pantone Cool Gray 11)": {"rgb": (83, 86, 90), "h_range": (180, 270), "v_range": (20, 40)},
-    "灰色 (Pantone Cool Gray 8)": {"rgb": (147, 149, 152), "h_range": (180, 270), "v_range": (40, 65)},
-    "淺灰色 (Pantone Cool Gray 3)": {"rgb": (200, 201, 202), "h_range": (180, 270), "v_range": (65, 90)},
-    
-    # 藍色系 (H: 180-240)
-    "深藍色 (Pantone 2767 C)": {"rgb": (13, 36, 107), "h_range": (200, 240)},
-    "藍色 (Pantone 2945 C)": {"rgb": (0, 102, 179), "h_range": (190, 220)},
-    "淺藍色 (Pantone 283 C)": {"rgb": (155, 194, 230), "h_range": (180, 210)},
-    
-    # 綠色系 (H: 80-180)
-    "深綠色 (Pantone 3308 C)": {"rgb": (0, 86, 63), "h_range": (130, 160)},
-    "綠色 (Pantone 355 C)": {"rgb": (0, 135, 68), "h_range": (120, 180)},
-    "淺綠色 (Pantone 351 C)": {"rgb": (175, 215, 145), "h_range": (80, 130)},
-    
-    # 紅色系 (H: 330-30)
-    "正紅色 (Pantone 186 C)": {"rgb": (200, 16, 46), "h_range": (350, 10)},
-    "深紅色 (Pantone 1815 C)": {"rgb": (135, 0, 35), "h_range": (340, 0)},
-    "粉紅色 (Pantone 189 C)": {"rgb": (247, 168, 184), "h_range": (330, 360)},
-    "酒紅色 (Pantone 209 C)": {"rgb": (123, 30, 66), "h_range": (330, 350)},
-    
-    # 黃色系 (H: 40-60)
-    "黃色 (Pantone 109 C)": {"rgb": (255, 209, 0), "h_range": (45, 60)},
-    "淺黃色 (Pantone 100 C)": {"rgb": (244, 223, 142), "h_range": (40, 55)},
-    
-    # 橘色系 (H: 10-40)
-    "橘色 (Pantone 021 C)": {"rgb": (254, 80, 0), "h_range": (15, 35)},
-    
-    # 紫色系 (H: 270-330)
-    "深紫色 (Pantone 2627 C)": {"rgb": (82, 35, 152), "h_range": (270, 290)},
-    "紫色 (Pantone 2685 C)": {"rgb": (140, 91, 170), "h_range": (280, 310)},
-    "淺紫色 (Pantone 2567 C)": {"rgb": (199, 180, 217), "h_range": (270, 300)},
-    
-    # 棕色系 (H: 20-40, 低飽和度)
-    "深咖啡色 (Pantone 476 C)": {"rgb": (75, 56, 42), "h_range": (20, 40), "s_max": 50},
-    "咖啡色 (Pantone 4625 C)": {"rgb": (120, 94, 74), "h_range": (20, 40)},
-    "米色 (Pantone 468 C)": {"rgb": (214, 196, 166), "h_range": (30, 50), "s_max": 40},
-    "卡其色 (Pantone 7502 C)": {"rgb": (164, 143, 110), "h_range": (30, 50)},
-}
+# (色盤定義在 app/color_harmony.py，與穿搭顏色和諧度共用)
+from color_harmony import PANTONE_COLORS
 
 
 # ==================== 圖片處理函數 ====================
@@ -10,6 +10,9 @@
 
 import pandas as pd
 import os
+import re
+
+USE_STATEMENT = re.compile(r"^\s*USE\s+`?(\w+)`?\s*;", re.IGNORECASE | re.MULTILINE)
 
 
 # ==================== SQL 生成 ====================
@@ -148,6 +151,30 @@ CREATE TABLE IF NOT EXISTS items (
 -- =============================
 {chr(10).join(insert_statements)}
 
+-- =============================
+-- 商品目錄版本號 +1 (線上 worker 會重新載入商品索引、檢索快取失效)
+-- =============================
+CREATE TABLE IF NOT EXISTS catalog_meta (
+  name VARCHAR(50) PRIMARY KEY,
+  version INT NOT NULL DEFAULT 1,
+  updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP
+);
+
+INSERT INTO catalog_meta (name, version) VALUES ('items', 1)
+ON DUPLICATE KEY UPDATE version = version + 1;
+
+-- =============================
+-- 場合推薦池 occasion_pools (由 pipeline/06_build_occasion_pools.py 重算)
+-- =============================
+CREATE TABLE IF NOT EXISTS occasion_pools (
+  occasion VARCHAR(20) NOT NULL,
+  gender VARCHAR(20) NOT NULL DEFAULT '',
+  rank_no INT NOT NULL,
+  item_id INT NOT NULL,
+  catalog_version INT NOT NULL,
+  PRIMARY KEY (occasion, gender, rank_no)
+);
+
 -- =============================
 -- 穿搭表 outfits
 -- =============================
@@ -223,11 +250,44 @@ SELECT CONCAT('📊 Imported ', COUNT(*), ' items') AS info FROM items;
     print(f"✅ SQL 腳本已生成: {output_file}")
 
 
+def used_database(sql_text: str):
+    """SQL 腳本最後 USE 的資料庫名稱 (沒有 USE 時回傳 None)"""
+    names = USE_STATEMENT.findall(sql_text)
+    return names[-1] if names else None
+
+
+def rebuild_derived_data(user: str, password: str, host: str, port: int, db: str):
+    """
+    匯入後重算場合推薦池與語意索引 (否則線上會因版本不符改用即時檢索)
+    資料已經匯入，這裡失敗只需重跑 06 / 07，不必重新匯入
+    """
+    import importlib
+
+    try:
+        build_pools = importlib.import_module("06_build_occasion_pools")
+        pools_ok = build_pools.build_occasion_pools(
+            user=user, password=password, host=host, port=port, db=db
+        )
+        build_embeddings = importlib.import_module("07_build_embeddings")
+        embeddings_ok = build_embeddings.build_embeddings(
+            user=user, password=password, host=host, port=port, db=db
+        )
+    except Exception as e:
+        print(f"⚠️  資料已匯入，但重算場合推薦池 / 語意索引失敗: {e}")
+        pools_ok = embeddings_ok = False
+
+    if not (pools_ok and embeddings_ok):
+        print("\n資料已匯入，請另外重算:")
+        print("  python pipeline/06_build_occasion_pools.py")
+        print("  python pipeline/07_build_embeddings.py")
+
+
 def import_to_mysql(
     sql_file: str,
     user: str = "root",
     password: str = None,
     host: str = "localhost",
+    port: int = 3306,
 ):
     """
     直接匯入 MySQL (需要 pymysql)
@@ -237,6 +297,7 @@ def import_to_mysql(
         user: MySQL使用者名稱
         password: MySQL密碼
         host: MySQL主機
+        port: MySQL連接埠
     """
     try:
         import pymysql
@@ -254,14 +315,15 @@ def import_to_mysql(
     try:
         # 連接 MySQL
         conn = pymysql.connect(
-            host=host, user=user, password=password, charset="utf8mb4"
+            host=host, port=port, user=user, password=password, charset="utf8mb4"
         )
 
         cursor = conn.cursor()
 
         # 執行 SQL 檔案
         with open(sql_file, "r", encoding="utf-8") as f:
-            sql_commands = f.read().split(";")
+            sql_text = f.read()
+        sql_commands = sql_text.split(";")
 
         for command in sql_commands:
             command = command.strip()
@@ -278,6 +340,10 @@ def import_to_mysql(
         print(f"❌ 匯入失敗: {e}")
         print(f"\n請手動執行:")
         print(f"  mysql -u {user} -p < {sql_file}")
+        return
+
+    # 用與匯入相同的連線設定，並指定 SQL 實際 USE 的資料庫 (不依賴 DB_NAME / DB_PORT 環境變數)
+    rebuild_derived_data(user, password, host, port, used_database(sql_text))
 
 
 def main():
@@ -323,6 +389,9 @@ def main():
     print(f"  mysql -u root -p < {output_file}")
     print("\n或在 MySQL 中執行:")
     print(f"  SOURCE {output_file};")
+    print("\n匯入後請重算場合推薦池與語意索引:")
+    print("  python pipeline/06_build_occasion_pools.py")
+    print("  python pipeline/07_build_embeddings.py")
 
     # 可選: 自動匯入
     # response = input("\n是否現在匯入到 MySQL? (y/n): ")
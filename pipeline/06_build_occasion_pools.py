@@ -0,0 +1,77 @@
+"""
+場合推薦池計算 - 離線工作
+每次 05_database_import 匯入後執行，為每個「場合 × 性別」預先算好候選商品池
+
+輸入: MySQL outfit_db.items (+ rating 平均評分，作為排序依據)
+輸出: MySQL outfit_db.occasion_pools
+
+排序與分散:
+  - 評分高的商品在前 (評分數少時往整體平均拉近)，同分依 id
+  - 同一場合的各種衣物類型輪流出現，同一類型內再分散顏色
+"""
+
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'app'))
+from occasion_pools import rebuild_pools, OCCASION_POOL_SIZE
+
+
+def build_occasion_pools(
+    user: str = None,
+    password: str = None,
+    host: str = None,
+    port: int = None,
+    db: str = None,
+    pool_size: int = OCCASION_POOL_SIZE,
+):
+    """
+    連線 MySQL 並重算所有場合推薦池 (連線參數預設讀取 DB_* 環境變數)
+
+    Returns:
+        是否成功
+    """
+    try:
+        import pymysql
+    except ImportError:
+        print("⚠️  pymysql 未安裝，無法計算場合推薦池")
+        return False
+
+    try:
+        conn = pymysql.connect(
+            host=host or os.getenv("DB_HOST", "localhost"),
+            port=port or int(os.getenv("DB_PORT", "3306")),
+            user=user or os.getenv("DB_USER", "root"),
+            password=password if password is not None else os.getenv("DB_PASS", ""),
+            db=db or os.getenv("DB_NAME", "outfit_db"),
+            charset="utf8mb4",
+            cursorclass=pymysql.cursors.DictCursor,
+        )
+    except Exception as e:
+        print(f"❌ 連線 MySQL 失敗: {e}")
+        return False
+
+    try:
+        n_pools, n_rows, version = rebuild_pools(conn, pool_size)
+    except Exception as e:
+        print(f"❌ 場合推薦池計算失敗: {e}")
+        return False
+    finally:
+        conn.close()
+
+    print(f"✅ 已寫入 {n_pools} 個場合推薦池 (共 {n_rows} 筆，商品目錄版本 {version})")
+    return True
+
+
+def main():
+    """主程式流程"""
+    print("=" * 80)
+    print("📦 場合推薦池計算")
+    print("=" * 80)
+
+    if not build_occasion_pools():
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+"""
+商品語意向量索引 - 離線工作
+每次 05_database_import 匯入後執行，為 items 建立語意檢索用的向量索引
+
+輸入: MySQL outfit_db.items (name / color / clothing_type / category)
+輸出: EMBEDDING_DIR (預設為專案的 data/embeddings，docker-compose 掛載到容器的 /app/data/embeddings) 下的新版本目錄
+  - vectors.npy: 正規化後的向量矩陣 (worker 以 mmap 載入)
+  - ids.npy / idf.npy / meta.json
+  - centroids.npy / list_offsets.npy: 商品數超過 EMBEDDING_ANN_THRESHOLD 時的 IVF 分群索引
+  - CURRENT: 指向最新版本 (寫完才更新，worker 會自動切換)
+"""
+
+import os
+import sys
+import time
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'app'))
+from embedding_index import build_from_db, EMBEDDING_DIM
+
+# 在主機上執行：寫到專案的 data/ (docker-compose 掛載給 flask 容器讀取)
+EMBEDDING_DIR = os.getenv(
+    "EMBEDDING_DIR",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "data", "embeddings"),
+)
+
+
+def build_embeddings(
+    user: str = None,
+    password: str = None,
+    host: str = None,
+    port: int = None,
+    db: str = None,
+    directory: str = EMBEDDING_DIR,
+    dim: int = EMBEDDING_DIM,
+):
+    """
+    連線 MySQL 並重建語意向量索引 (連線參數預設讀取 DB_* 環境變數)
+
+    Returns:
+        是否成功
+    """
+    try:
+        import pymysql
+    except ImportError:
+        print("⚠️  pymysql 未安裝，無法建立語意索引")
+        return False
+
+    try:
+        conn = pymysql.connect(
+            host=host or os.getenv("DB_HOST", "localhost"),
+            port=port or int(os.getenv("DB_PORT", "3306")),
+            user=user or os.getenv("DB_USER", "root"),
+            password=password if password is not None else os.getenv("DB_PASS", ""),
+            db=db or os.getenv("DB_NAME", "outfit_db"),
+            charset="utf8mb4",
+            cursorclass=pymysql.cursors.DictCursor,
+        )
+    except Exception as e:
+        print(f"❌ 連線 MySQL 失敗: {e}")
+        return False
+
+    started = time.time()
+    try:
+        index = build_from_db(conn, directory, dim)
+    except Exception as e:
+        print(f"❌ 語意索引建立失敗: {e}")
+        return False
+    finally:
+        conn.close()
+
+    ivf = f"，IVF {len(index.centroids)} 群" if index.centroids is not None else ""
+    print(f"✅ 已建立 {len(index)} 件商品的語意索引 ({dim} 維{ivf}，耗時 {time.time() - started:.1f} 秒)")
+    print(f"   輸出目錄: {directory}")
+    return True
+
+
+def main():
+    """主程式流程"""
+    print("=" * 80)
+    print("🧭 商品語意向量索引")
+    print("=" * 80)
+
+    if not build_embeddings():
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()